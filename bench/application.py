@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+#
+# Imported modules
+#
+
+import os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import enact
+
+
+#
+# Global constants
+#
+
+# Computing applications that reverse each work unit; 'flush' is replaced by
+# a statement that flushes the standard output, or by nothing.
+LINES = '''
+import sys
+while True:
+    work = sys.stdin.readline()
+    if not work:
+        break
+    sys.stdout.write(work[-2::-1] + '\\n')
+    %(flush)s
+'''
+FRAMES = '''
+import sys
+while True:
+    size = sys.stdin.readline()
+    if not size:
+        break
+    result = sys.stdin.read(int(size))[::-1]
+    sys.stdout.write('%%i\\n%%s' %% (len(result), result))
+    %(flush)s
+'''
+
+CASES = [
+    # name, application, flush, io
+    ('popen2 (before)',         LINES,  True,  None),
+    ('pipe',                    LINES,  True,  'pipe'),
+    ('pty, no flush',           LINES,  False, 'pty'),
+    ('framed',                  FRAMES, True,  'framed'),
+    ('python',                  None,   False, 'python'),
+    ('python, worker process',  None,   False, 'process'),
+]
+
+
+#
+# Definitions
+#
+
+class _Popen2:
+    'The computing application as started by previous versions of enact.'
+
+    def __init__(self, command):
+        self.cmd_in, self.cmd_out = os.popen2(command, 't')
+
+    def put_work(self, work):
+        self.cmd_in.write('%s\n' % work)
+        self.cmd_in.flush()
+
+    def get_results(self):
+        return [ self.cmd_out.readline().rstrip('\n') ]
+
+    def close(self):
+        self.cmd_in.close()
+        self.cmd_out.close()
+
+
+def reverse(work):
+    'The computing application as a Python function.'
+
+    return work[::-1]
+
+
+def bench(units, source, flush, io):
+    """Sends 'units' work units to a computing application, one at a time.
+
+If 'io' is 'process', the Python function is called by a worker process.
+Returns the number of work units processed per second."""
+
+    if source:
+        source = source % { 'flush': flush and 'sys.stdout.flush()' or '' }
+        command = '"%s" -c "%s"' % (sys.executable,
+            source.replace('\\', '\\\\').replace('"', '\\"'))
+    if io in ('python', 'process'):
+        app = enact.start_application('application:reverse', False,
+            'python', io == 'process')
+    elif io:
+        app = enact.Application(command, False, io)
+    else:
+        app = _Popen2(command)
+    work = 'x' * 40
+    start = time.time()
+    for i in xrange(units):
+        app.put_work(work)
+        assert app.get_results() == [ work[::-1] ]
+    elapsed = time.time() - start
+    app.close()
+    return units / elapsed
+
+
+#
+# Application entry point
+#
+
+if __name__ == '__main__':
+
+    units = 20000
+    if len(sys.argv) > 1:
+        units = int(sys.argv[1])
+
+    print '%-24s %14s' % ('application I/O', 'units/s')
+    for name, source, flush, io in CASES:
+        if (io == 'pty') and (os.name <> 'posix'):
+            continue
+        print '%-24s %14.0f' % (name, bench(units, source, flush, io))
+
+
+# EOF
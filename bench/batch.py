@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+#
+# Imported modules
+#
+
+import os, subprocess, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import common, enact
+
+
+#
+# Definitions
+#
+
+def bench(units, batch):
+    """Serves 'units' trivial work units over loopback to a single client.
+
+The client requests 'batch' work units at a time and 'computes' each result by
+reversing the work unit. Returns the number of work units processed per second.
+"""
+
+    port = common.free_port()
+    script = os.path.join(os.path.dirname(__file__), os.pardir, 'dispense.py')
+    input = tempfile.TemporaryFile()
+    input.write(''.join([ '%d\n' % i for i in xrange(units) ]))
+    input.seek(0)
+    host = subprocess.Popen([sys.executable, script, '-p%d' % port],
+        stdin = input, stdout = open(os.devnull, 'w'))
+
+    # Wait for the host to start listening
+    while True:
+        try:
+            conn = enact.Connection(('localhost', port), False, batch)
+            break
+        except enact.ConnectionFailure:
+            time.sleep(0.05)
+
+    start = time.time()
+    try:
+        while True:
+            work = conn.get_work()
+            if not work:
+                break
+            conn.put_results([work[::-1]])
+    except enact.ConnectionFailure:
+        pass
+    elapsed = time.time() - start
+    host.wait()
+    return units / elapsed
+
+
+#
+# Application entry point
+#
+
+if __name__ == '__main__':
+
+    units = 20000
+    if len(sys.argv) > 1:
+        units = int(sys.argv[1])
+
+    print '%8s %12s' % ('batch', 'units/sec')
+    for batch in (1, 4, 16, 64):
+        print '%8d %12.0f' % (batch, bench(units, batch))
+
+
+# EOF
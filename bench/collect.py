@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+#
+# Imported modules
+#
+
+import multiprocessing, os, random, subprocess, sys, tempfile, time
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+script = os.path.join(os.path.dirname(__file__), os.pardir, 'collect.py')
+
+
+#
+# Definitions
+#
+
+def generate(input_path, results_path, units, size, spread = 1000,
+             unit_size = 0):
+    """Writes an input file and dispense output with results of 'size' bytes.
+
+Results appear out of order: each is displaced by up to 'spread' positions.
+Work units are padded to 'unit_size' bytes."""
+
+    f = file(input_path, 'w')
+    for i in xrange(units):
+        f.write('%0*d\n' % (unit_size, i))
+    f.close()
+
+    order = [ i + random.randint(0, spread) for i in xrange(units) ]
+    order = [ i for _, i in sorted(zip(order, xrange(units))) ]
+    f = file(results_path, 'w')
+    for i in order:
+        f.write('[Thu Jan  1 00:00:00 1970] localhost:1234\n')
+        f.write('>%0*d\n<%s\n' %
+            (unit_size, i, str(i) * (size / len(str(i)))))
+    f.close()
+
+
+def run(args, results_path, jobs = None):
+    """Runs the collect tool with command line arguments 'args'.
+
+The results are read from standard input, or in 'jobs' processes from the
+results file if 'jobs' is given.
+
+Returns a tuple of the elapsed time, the peak RSS in megabytes and a digest of
+the output."""
+
+    # Unbuffered standard input would make every readline() a system call
+    env = os.environ.copy()
+    env.pop('PYTHONUNBUFFERED', None)
+
+    output = tempfile.TemporaryFile()
+    start = time.time()
+    if jobs == None:
+        child = subprocess.Popen([sys.executable, script] + args,
+            stdin = file(results_path), stdout = output, env = env)
+    else:
+        child = subprocess.Popen([sys.executable, script, '-j', str(jobs)] +
+            args + [results_path], stdout = output, env = env)
+    _, _, usage = os.wait4(child.pid, 0)
+    elapsed = time.time() - start
+    output.seek(0)
+    digest = md5()
+    while True:
+        block = output.read(65536)
+        if not block:
+            break
+        digest.update(block)
+    return elapsed, usage.ru_maxrss / 1024.0, digest.hexdigest()
+
+
+#
+# Application entry point
+#
+
+if __name__ == '__main__':
+
+    units, size, unit_size = 200000, 1000, 0
+    if len(sys.argv) > 1:
+        units = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        size = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        unit_size = int(sys.argv[3])
+
+    _, input_path = tempfile.mkstemp()
+    _, results_path = tempfile.mkstemp()
+    try:
+        generate(input_path, results_path, units, size,
+            unit_size = unit_size)
+        print 'Results: %d work units, %.1f MB' % \
+            (units, os.path.getsize(results_path) / 1048576.0)
+        print '%-16s %10s %14s  %s' % ('options', 'time (s)', 'peak RSS (MB)',
+            'output digest')
+        for args in ([], ['-w', '16'], ['-w', '0'], ['-d'],
+                     ['-d', '-w', '16']):
+            elapsed, rss, digest = run(args + ['-i', input_path], results_path)
+            print '%-16s %10.1f %14.1f  %s' % (' '.join(args + ['-i']),
+                elapsed, rss, digest)
+        jobs = 1
+        while True:
+            elapsed, rss, digest = run(['-i', input_path], results_path, jobs)
+            print '%-16s %10.1f %14.1f  %s' % ('-j %d -i' % jobs,
+                elapsed, rss, digest)
+            if jobs >= multiprocessing.cpu_count():
+                break
+            jobs = min(2 * jobs, multiprocessing.cpu_count())
+    finally:
+        os.remove(input_path)
+        os.remove(results_path)
+
+
+# EOF
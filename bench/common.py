@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+#
+# Imported modules
+#
+
+import os, resource, socket, sys
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import dispense
+
+
+#
+# Definitions
+#
+
+class NullOutput:
+    'Output file that discards everything written to it.'
+
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+
+
+class Clock:
+    'Simulated replacement for the time module, as used by dispense.'
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def ctime(self, *args):
+        return ''
+
+
+
+def make_project(units):
+    'Returns a new dispense.Project serving \'units\' work units.'
+
+    project = dispense.Project()
+    project.input  = StringIO(''.join([ '%d\n' % i for i in xrange(units) ]))
+    project.output = NullOutput()
+    return project
+
+
+def free_port():
+    'Returns a TCP port on the loopback interface that is not in use.'
+
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('localhost', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def peak_rss():
+    'Returns the peak resident set size of this process in megabytes.'
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss / 1048576.0      # reported in bytes
+    return rss / 1024.0             # reported in kilobytes
+
+
+# EOF
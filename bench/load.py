@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+#
+# Imported modules
+#
+
+import errno, getopt, os, select, socket, subprocess, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import common, dispense
+
+
+#
+# Definitions
+#
+
+def usage(code = 0):
+    'Displays command line usage information.'
+
+    print 'Usage:\n    %s [<options>] [<clients> ...]' % sys.argv[0]
+    print """
+Optional arguments:
+    <clients>           numbers of simulated clients (default: 100 1000 5000)
+
+Available options:
+    -h, --help:         show this description
+    -u<n>, --units=<n>: serve <n> work units per run (default: 200000)
+
+Starts a dispense host for each number of clients and opens that many
+simulated clients over loopback, which answer every work unit at once. Reports
+the number of connections accepted, the number of work units processed per
+second, and the median and 99th percentile of the dispatch latency: the time
+between sending a result and receiving the next work unit.
+"""
+    sys.exit(code)
+
+
+def percentile(values, fraction):
+    'Returns the given fraction percentile of the sorted list \'values\'.'
+
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def bench(units, clients):
+    """Serves 'units' work units to 'clients' simulated legacy clients.
+
+Returns a tuple (accepted, units per second, median latency, p99 latency)."""
+
+    port = common.free_port()
+    script = os.path.join(os.path.dirname(__file__), os.pardir, 'dispense.py')
+    input = tempfile.TemporaryFile()
+    input.write(''.join([ '%d\n' % i for i in xrange(units) ]))
+    input.seek(0)
+    host = subprocess.Popen([sys.executable, script, '-p%d' % port],
+        stdin = input, stdout = open(os.devnull, 'w'))
+
+    # Wait for the host to start listening
+    while True:
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if s.connect_ex(('127.0.0.1', port)) == 0:
+            break
+        s.close()
+        time.sleep(0.05)
+    socks = [ s ]
+
+    poller = select.epoll()
+    start = time.time()
+    for _ in xrange(clients - 1):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setblocking(0)
+        s.connect_ex(('127.0.0.1', port))
+        socks.append(s)
+    conns = {}
+    for s in socks:
+        s.setblocking(0)
+        poller.register(s.fileno(), select.EPOLLIN)
+        conns[s.fileno()] = [ s, '', None ]
+
+    accepted = processed = 0
+    latencies = []
+    while conns:
+        if host.poll() is not None:
+            # Connections that were never accepted do not see the host exit
+            break
+        for fd, flags in poller.poll(0.1):
+            conn = conns[fd]
+            s, buffer, sent = conn
+            try:
+                data = s.recv(65536)
+            except socket.error, e:
+                if e.args[0] == errno.EAGAIN:
+                    continue
+                data = ''
+            if not data:
+                poller.unregister(fd)
+                s.close()
+                del conns[fd]
+                continue
+            lines = (buffer + data).split('\r\n')
+            conn[1] = lines.pop()
+            now = time.time()
+            for line in lines:
+                if sent is None:
+                    accepted += 1
+                else:
+                    latencies.append(now - sent)
+                processed += 1
+                s.send('%s\r\n' % line[::-1])
+                sent = conn[2] = time.time()
+    elapsed = time.time() - start
+    host.wait()
+    for s, _, _ in conns.values():
+        s.close()
+    latencies.sort()
+    return (accepted, processed / elapsed, percentile(latencies, 0.5),
+        percentile(latencies, 0.99))
+
+
+#
+# Application entry point
+#
+
+if __name__ == '__main__':
+
+    units = 200000
+
+    # Parse command line arguments
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hu:', ['help', 'units='])
+    except getopt.GetoptError, message:
+        sys.stderr.write('Error: %s.\n' % str(message))
+        usage(2)
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            usage()
+        if opt in ('-u', '--units'):
+            units = int(arg)
+    counts = [ int(arg) for arg in args ] or [ 100, 1000, 5000 ]
+
+    dispense._raise_file_limit()
+    print '%8s %9s %12s %12s %12s' % ('clients', 'accepted', 'units/sec',
+        'p50 (ms)', 'p99 (ms)')
+    for clients in counts:
+        accepted, rate, p50, p99 = bench(units, clients)
+        print '%8d %9d %12.0f %12.2f %12.2f' % (clients, accepted, rate,
+            p50 * 1000, p99 * 1000)
+
+
+# EOF
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+#
+# Imported modules
+#
+
+import os, random, sys, time
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import common, dispense
+
+
+#
+# Definitions
+#
+
+def bench(pending, operations = 10000):
+    """Measures completion and re-dispatch with 'pending' outstanding units.
+
+Returns a tuple of the mean time (in microseconds) per put_work() and per
+round-robin get_work() call."""
+
+    project = dispense.Project()
+    project.input  = StringIO(''.join([ 'unit-%d\n' % i
+                                        for i in xrange(pending) ]))
+    project.output = common.NullOutput()
+    for _ in xrange(pending):
+        project.get_work()
+
+    # Complete random units, replacing each with a re-dispatched one
+    units = random.sample(xrange(pending), min(pending, operations))
+    start = time.time()
+    for i in units:
+        project.put_work(('localhost', 0), 'unit-%d' % i, ['result'])
+    put_time = time.time() - start
+
+    start = time.time()
+    for _ in units:
+        project.get_work()
+    get_time = time.time() - start
+
+    return 1e6*put_time/len(units), 1e6*get_time/len(units)
+
+
+#
+# Application entry point
+#
+
+if __name__ == '__main__':
+
+    print '%10s %14s %14s' % ('pending', 'put_work (us)', 'get_work (us)')
+    for pending in (1000, 10000, 100000, 1000000):
+        put_time, get_time = bench(pending)
+        print '%10d %14.2f %14.2f' % (pending, put_time, get_time)
+
+
+# EOF
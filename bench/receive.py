@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+#
+# Imported modules
+#
+
+import asynchat, os, socket, sys, time
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import dispense
+
+
+#
+# Definitions
+#
+
+class ConcatSession(dispense._DispenseSession):
+    'Session that receives lines like before, by string concatenation.'
+
+    def __init__(self, *args):
+        dispense._DispenseSession.__init__(self, *args)
+        self.buffer = ''
+        self.set_terminator('\r\n')
+
+    handle_read = asynchat.async_chat.handle_read
+
+    def collect_incoming_data(self, data):
+        self.buffer = self.buffer + data
+
+    def found_terminator(self):
+        line = self.buffer
+        self.buffer = ''
+        self.handle_line(line)
+
+
+def bench(session_class, units, size, segment):
+    """Receives 'units' results of 'size' bytes, sent in 'segment' byte writes.
+
+Each segment is read by the session before the next one is sent, like a result
+that trickles in over the network. Returns the number of megabytes received
+per second."""
+
+    work = ''.join([ '%d\n' % i for i in xrange(units + 1) ])
+    project = dispense.Project()
+    project.input  = StringIO(work)
+    project.output = open(os.devnull, 'w')
+    client, server = socket.socketpair()
+    session = session_class((server, ('localhost', 0)), [ project ])
+    result = 'x' * size + '\r\n'
+    start = time.time()
+    for _ in xrange(units):
+        client.recv(4096)
+        for i in xrange(0, len(result), segment):
+            client.sendall(result[i:i + segment])
+            session.handle_read()
+    elapsed = time.time() - start
+    session.close()
+    client.close()
+    return units * size / elapsed / 1048576
+
+
+#
+# Application entry point
+#
+
+if __name__ == '__main__':
+
+    total = 32
+    if len(sys.argv) > 1:
+        total = int(sys.argv[1])
+
+    print 'Receiving %i MB of results in 1 KB segments:' % total
+    print '%-12s %12s %12s' % ('result size', 'before MB/s', 'after MB/s')
+    for size in (1024, 65536, 1048576):
+        units = (total << 20) // size
+        print '%-12d %12.1f %12.1f' % (size,
+            bench(ConcatSession, units, size, 1024),
+            bench(dispense._DispenseSession, units, size, 1024))
+
+
+# EOF
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+#
+# Imported modules
+#
+
+import os, shutil, subprocess, sys, tempfile, time
+
+import common
+
+
+#
+# Global constants
+#
+
+UNITS = 300                 # work units per run
+CRASH_UNIT = '100'          # work unit on which the application crashes once
+OUTAGES = 2                 # number of host restarts
+DOWNTIME = 0.5              # seconds the host is down
+
+# Computing application that takes 10 ms per work unit and logs the time at
+# which it completed each; it crashes on CRASH_UNIT, the first time only.
+APPLICATION = '''
+import os, sys, time
+log = open('log', 'a')
+while True:
+    work = sys.stdin.readline().strip()
+    if not work:
+        break
+    if (work == '%s') and not os.path.exists('crashed'):
+        open('crashed', 'w').write('%%.6f' %% time.time())
+        os._exit(1)
+    time.sleep(0.01)
+    log.write('%%.6f %%s\\n' %% (time.time(), work))
+    log.flush()
+    sys.stdout.write(work[::-1] + '\\n')
+    sys.stdout.flush()
+''' % CRASH_UNIT
+
+CONFIGS = [
+    # name, enact options
+    ('one at a time',   [ '-j', '1' ]),
+    ('batches of 10',   [ '-j', '1', '-b', '10' ]),
+]
+
+
+#
+# Definitions
+#
+
+def computed(workdir):
+    'Returns the (time, work unit) pairs logged by the application.'
+
+    path = os.path.join(workdir, 'log')
+    if not os.path.exists(path):
+        return []
+    return [ (float(line.split()[0]), line.split()[1])
+             for line in open(path) if line.endswith('\n') ]
+
+
+def dispense(workdir, port, output, resume = None):
+    'Starts a host serving the input file in \'workdir\'.'
+
+    args = [ sys.executable, os.path.join(root, 'dispense.py'),
+             '-p%d' % port ]
+    if resume:
+        args.append('-r%s' % resume)
+    return subprocess.Popen(args, cwd = workdir,
+        stdin = open(os.path.join(workdir, 'input')),
+        stdout = open(os.path.join(workdir, output), 'w'),
+        stderr = open(os.devnull, 'w'))
+
+
+def run(enact, options):
+    """Runs a project with a client whose application crashes once, and
+whose host is restarted OUTAGES times.
+
+Returns the time from the crash until the work unit is computed again, the
+average time from the host restarting until the next work unit is computed,
+and the total time taken."""
+
+    workdir = tempfile.mkdtemp()
+    try:
+        open(os.path.join(workdir, 'input'), 'w').write(
+            ''.join([ '%d\n' % i for i in xrange(UNITS) ]))
+        open(os.path.join(workdir, 'app.py'), 'w').write(APPLICATION)
+        port = common.free_port()
+        start = time.time()
+        host = dispense(workdir, port, 'output0')
+        time.sleep(0.5)
+        client = subprocess.Popen([ sys.executable, enact, '-n0', '-p%d' %
+            port ] + options + [ '%s app.py' % sys.executable, '127.0.0.1' ],
+            cwd = workdir, stdout = open(os.devnull, 'w'),
+            stderr = open(os.devnull, 'w'))
+
+        # Restart the host when a third and two thirds of the work is done
+        restarts = []
+        for i in xrange(OUTAGES):
+            while len(computed(workdir)) < UNITS * (i + 1) / (OUTAGES + 1):
+                time.sleep(0.01)
+            host.kill()
+            host.wait()
+            time.sleep(DOWNTIME)
+            host = dispense(workdir, port, 'output%d' % (i + 1),
+                os.path.join(workdir, 'output%d' % i))
+            restarts.append(time.time())
+        host.wait()
+        elapsed = time.time() - start
+        client.kill()
+        client.wait()
+
+        log = computed(workdir)
+        crash = float(open(os.path.join(workdir, 'crashed')).read())
+        recomputed = min([ t for t, work in log if work == CRASH_UNIT ])
+        reconnects = [ min([ t for t, _ in log if t > restart ]) - restart
+                       for restart in restarts ]
+        return (recomputed - crash, sum(reconnects) / len(reconnects),
+                elapsed)
+    finally:
+        shutil.rmtree(workdir)
+
+
+#
+# Application entry point
+#
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+if __name__ == '__main__':
+
+    enact = os.path.join(root, 'enact.py')
+    if len(sys.argv) > 1:
+        enact = os.path.abspath(sys.argv[1])
+
+    print '%i work units of 10 ms; the application crashes once and the ' \
+        'host is down %i times for %.1f s' % (UNITS, OUTAGES, DOWNTIME)
+    print '%-16s %20s %20s %10s' % ('client', 'crash recovery (s)',
+        'reconnection (s)', 'total (s)')
+    for name, options in CONFIGS:
+        print '%-16s %20.3f %20.3f %10.2f' % ((name,) + run(enact, options))
+
+
+# EOF
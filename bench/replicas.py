@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+#
+# Imported modules
+#
+
+import heapq, os, random, sys
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import common, dispense, straggler
+
+
+#
+# Global constants
+#
+
+POLICIES = [
+    # name, replicas, quorum, verify_every
+    ('no verification',     1, None, 1),
+    ('2 replicas',          2, None, 1),
+    ('3 replicas',          3, None, 1),
+    ('3 replicas, 1 in 10', 3, None, 10),
+]
+
+SPEEDS = straggler.SPEEDS   # seconds per work unit, one host each
+FAULTY = 2                  # number of hosts returning wrong results
+ERROR_RATE = 0.2            # fraction of wrong results of faulty hosts
+
+
+#
+# Definitions
+#
+
+class _Output:
+    'Output file that counts the wrong results written to it.'
+
+    def __init__(self):
+        self.work  = None
+        self.wrong = 0
+
+    def write(self, data):
+        for line in data.splitlines():
+            if line.startswith('>'):
+                self.work = line[1:]
+            elif line.startswith('<') and (line[1:] <> self.work):
+                self.wrong += 1
+
+    def flush(self):
+        pass
+
+
+def make_project(units):
+    """Returns a new dispense.Project serving 'units' work units, which counts
+the wrong results written."""
+
+    project = common.make_project(units)
+    project.output = _Output()
+    return project
+
+
+def simulate(units, replicas, quorum, every, seed):
+    """Simulates serving 'units' work units to a host per speed in SPEEDS.
+
+Each host computes one work unit at a time, taking its speed times a random
+factor between 0.5 and 1.5. The first FAULTY hosts return a wrong result for
+ERROR_RATE of their work units. Returns the time until all work units are
+completed, the number of work units dispatched, the number of wrong results
+written and the number of disagreements found."""
+
+    random.seed(seed)
+    project = make_project(units)
+    clock = dispense.time = common.Clock()
+    project.replicas     = replicas
+    project.quorum       = quorum
+    project.verify_every = every
+    clients = [ (dispense.Client(project, 'host%d' % i), speed, i < FAULTY)
+                for i, speed in enumerate(SPEEDS) ]
+    idle = deque(clients)
+    events = []
+    dispatched = 0
+    while True:
+        # Serve idle clients
+        for _ in xrange(len(idle)):
+            client, speed, faulty = idle.popleft()
+            work = project.get_work(client)
+            if work is None:
+                idle.append((client, speed, faulty))
+                continue
+            dispatched += 1
+            duration = speed * random.uniform(0.5, 1.5)
+            heapq.heappush(events, (clock.now + duration, dispatched,
+                                    client, speed, faulty, work))
+        if project.is_done():
+            break
+
+        # Advance to the next completion, or the next deadline
+        deadline = project.next_deadline()
+        if idle and (deadline is not None) and (clock.now < deadline) and \
+           ((not events) or (deadline < events[0][0])):
+            clock.now = deadline
+            continue
+        clock.now, _, client, speed, faulty, work = heapq.heappop(events)
+        result = work
+        if faulty and (random.random() < ERROR_RATE):
+            result = 'wrong %f' % random.random()
+        client.completed(work, clock.now)
+        project.put_work(('localhost', 0), work, [ result ], client)
+        idle.append((client, speed, faulty))
+    return (clock.now, dispatched, project.output.wrong,
+            project.work_disagreements)
+
+
+#
+# Application entry point
+#
+
+if __name__ == '__main__':
+
+    units, runs = 2000, 5
+    if len(sys.argv) > 1:
+        units = int(sys.argv[1])
+
+    ideal = units / sum([ 1 / speed for speed in SPEEDS ])
+    print '%i work units, %i hosts, %i faulty (ideal makespan: %.0f s)' % \
+        (units, len(SPEEDS), FAULTY, ideal)
+    print '%-20s %13s %11s %8s %14s' % ('policy', 'makespan (s)',
+        'dispatched', 'wrong', 'disagreements')
+    sys.stderr = common.NullOutput()    # warnings of unverified units
+    for name, replicas, quorum, every in POLICIES:
+        totals = [ 0 ] * 4
+        for seed in xrange(runs):
+            for i, value in enumerate(simulate(units, replicas, quorum,
+                                               every, seed)):
+                totals[i] += value
+        print '%-20s %13.1f %11.1f %8.1f %14.1f' % ((name,) +
+            tuple([ float(total) / runs for total in totals ]))
+
+
+# EOF
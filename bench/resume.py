@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+#
+# Imported modules
+#
+
+import os, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import common, dispense
+
+
+#
+# Definitions
+#
+
+def generate(units, width):
+    """Creates a synthetic input file and a file with results for half of it.
+
+Work units are 'width' characters long. Results are given for every other work
+unit, in an order that differs from the input order.
+"""
+
+    input   = tempfile.TemporaryFile()
+    results = tempfile.TemporaryFile()
+    for i in xrange(units):
+        input.write('%0*d\n' % (width, i))
+    for i in xrange(0, units, 2):
+        j = (i + 1000) % units & ~1     # shifted, so not in input order
+        results.write('[Thu Jan  1 00:00:00 1970] localhost:1234\n')
+        results.write('>%0*d\n<result\n' % (width, j))
+    input.seek(0)
+    results.seek(0)
+    return input, results
+
+
+#
+# Application entry point
+#
+
+if __name__ == '__main__':
+
+    units, width = 5000000, 32
+    if len(sys.argv) > 1:
+        units = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        width = int(sys.argv[2])
+
+    input, results = generate(units, width)
+    print 'Input: %d work units of %d characters' % (units, width)
+    print 'Peak RSS before resuming: %8.1f MB' % common.peak_rss()
+
+    start = time.time()
+    project = dispense.Project()
+    project.input = input
+    project.input_offsets = False
+    project.resume_from_file(results)
+    print 'Indexing results:         %8.1f s' % (time.time() - start)
+
+    start = time.time()
+    remaining = 0
+    while project._read_input()[0] is not None:
+        remaining += 1
+    print 'Streaming remaining input: %7.1f s (%d work units)' % \
+        (time.time() - start, remaining)
+    print 'Peak RSS after resuming:  %8.1f MB' % common.peak_rss()
+
+
+# EOF
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+#
+# Imported modules
+#
+
+import os, random, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import stats
+
+
+#
+# Definitions
+#
+
+def generate(path, records, clients = 200, duplicates = 0.05):
+    """Writes a text output file with 'records' results from 'clients' clients,
+of which a fraction 'duplicates' are for work units completed before."""
+
+    f = file(path, 'w')
+    now = time.time() - records / 100.0
+    for i in xrange(records):
+        work = i
+        if random.random() < duplicates:
+            work = random.randrange(i + 1)
+        f.write('[%s] 10.0.%d.%d:%d\n>unit-%012d\n<result-%012d\n' % (
+            time.ctime(now + i / 100.0), i % clients / 250, i % clients % 250,
+            40000 + i % clients, work, work))
+    f.close()
+
+
+def read_lines(path):
+    'Reads the lines of the file at \'path\' without processing them.'
+
+    for line in file(path):
+        pass
+
+
+#
+# Application entry point
+#
+
+if __name__ == '__main__':
+
+    records = 2000000
+    if len(sys.argv) > 1:
+        records = int(sys.argv[1])
+
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        generate(path, records)
+        size = os.path.getsize(path) / 1048576.0
+        print 'Output: %d results, %.0f MB' % (records, size)
+        print '%-24s %10s %10s' % ('pass', 'time (s)', 'MB/s')
+        passes = [ ('read lines only', lambda: read_lines(path)),
+                   ('exact, -j1', lambda: stats.read_text_file(
+                       stats.Statistics(exact = True), path, 1)) ]
+        jobs = 1
+        while jobs <= stats.cpu_count():
+            passes.append(('estimated, -j%d' % jobs,
+                lambda jobs = jobs: stats.read_text_file(
+                    stats.Statistics(exact = False), path, jobs)))
+            jobs *= 2
+        for name, run in passes:
+            start = time.time()
+            run()
+            elapsed = time.time() - start
+            print '%-24s %10.2f %10.1f' % (name, elapsed, size / elapsed)
+    finally:
+        os.remove(path)
+
+
+# EOF
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+#
+# Imported modules
+#
+
+import heapq, os, random, sys
+from collections import deque
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import common, dispense, straggler
+
+
+#
+# Global constants
+#
+
+POLICIES = [
+    # name, costs, announce
+    ('input order',         False, False),
+    ('by cost',             True,  False),
+    ('by cost, announced',  True,  True),
+]
+
+SPEEDS = straggler.SPEEDS   # seconds per unit of cost, one client each
+
+
+#
+# Definitions
+#
+
+def make_project(units):
+    """Returns a new dispense.Project serving 'units' work units.
+
+The cost of the work units follows a Pareto distribution, so that a few work
+units cost much more than the others."""
+
+    project = common.make_project(units)
+    project.input = StringIO(''.join([ '%.3f %d\n' %
+        (random.paretovariate(1.5), i) for i in xrange(units) ]))
+    return project
+
+
+def simulate(units, costs, announce, seed):
+    """Simulates serving 'units' work units to clients with SPEEDS.
+
+Each client computes one work unit at a time, taking the cost of the work unit
+times its speed times a random factor between 0.8 and 1.2. If 'announce' is
+set, the clients announce their speed when they connect. Returns the time
+until all work units are completed and the total cost of the work units."""
+
+    random.seed(seed)
+    project = make_project(units)
+    clock = dispense.time = common.Clock()
+    project.costs          = costs
+    project.max_copies     = 1
+    project.deadline_slack = 2.0
+    clients = []
+    for speed in SPEEDS:
+        client = dispense.Client(project)
+        if announce:
+            client.announce({ 'speed': str(1.0 / speed) })
+        clients.append((client, speed))
+    total = sum([ dispense._cost(line)
+                  for line in project.input.getvalue().splitlines() ])
+    idle = deque(clients)
+    events = []
+    dispatched = 0
+    while True:
+        # Serve idle clients
+        for _ in xrange(len(idle)):
+            client, speed = idle.popleft()
+            work = project.get_work(client)
+            if work is None:
+                idle.append((client, speed))
+                continue
+            dispatched += 1
+            duration = dispense._cost(work) * speed * random.uniform(0.8, 1.2)
+            heapq.heappush(events, (clock.now + duration, dispatched,
+                                    client, speed, work))
+        if project.is_done():
+            break
+
+        # Advance to the next completion, or the next deadline
+        deadline = project.next_deadline()
+        if idle and (deadline is not None) and (clock.now < deadline) and \
+           ((not events) or (deadline < events[0][0])):
+            clock.now = deadline
+            continue
+        clock.now, _, client, speed, work = heapq.heappop(events)
+        client.completed(work, clock.now)
+        project.put_work(('localhost', 0), work, ['result'], client)
+        idle.append((client, speed))
+    return clock.now, total
+
+
+#
+# Application entry point
+#
+
+if __name__ == '__main__':
+
+    units, runs = 2000, 5
+    if len(sys.argv) > 1:
+        units = int(sys.argv[1])
+
+    print '%i work units, %i clients, lookahead %i' % (units, len(SPEEDS),
+        dispense.Project().lookahead)
+    print '%-20s %14s %14s' % ('policy', 'makespan (s)', 'ideal (s)')
+    for name, costs, announce in POLICIES:
+        makespan = ideal = 0
+        for seed in xrange(runs):
+            result = simulate(units, costs, announce, seed)
+            makespan += result[0]
+            ideal += result[1] / sum([ 1 / speed for speed in SPEEDS ])
+        print '%-20s %14.1f %14.1f' % (name, makespan / runs, ideal / runs)
+
+
+# EOF
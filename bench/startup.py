@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+#
+# Imported modules
+#
+
+import BaseHTTPServer, SocketServer, os, random, shutil, sys, tempfile
+import threading, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import project, update
+
+
+#
+# Global constants
+#
+
+FILES = 16                  # number of project files
+FILE_SIZE = 1 << 20         # bytes per project file
+RATE = 8 << 20              # bytes per second per connection
+
+
+#
+# Definitions
+#
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    'HTTP server that handles each request in a separate thread.'
+
+    daemon_threads = True
+
+
+def publish(directory, url):
+    'Writes FILES project files and a project description to \'directory\'.'
+
+    elements = []
+    for i in xrange(FILES):
+        name = 'file%02i.dat' % i
+        f = file(os.path.join(directory, name), 'wb')
+        f.write(os.urandom(FILE_SIZE))
+        f.close()
+        elements.append('<file md5="%s" name="%s">%s/%s</file>' %
+            (project.md5_file_string(os.path.join(directory, name)), name,
+             url, name))
+    f = file(os.path.join(directory, 'project.xml'), 'w')
+    f.write('<project id="bench" name="bench" url="%s"><client>'
+        '<platform>any</platform><command>true</command>%s</client>'
+        '<results>single</results><server><host>localhost</host>'
+        '<port>3450</port><input>in</input><output>out</output>'
+        '</server></project>' % (url, ''.join(elements)))
+    f.close()
+
+
+def interrupt(served, workdir):
+    """Leaves half-finished downloads of all files in 'workdir', as if the
+previous start was interrupted."""
+
+    for name in os.listdir(served):
+        if name.startswith('file'):
+            data = file(os.path.join(served, name), 'rb').read()
+            part = file(os.path.join(workdir, '%s.%s.part' % (name,
+                project.md5_file_string(os.path.join(served, name)))), 'wb')
+            part.write(data[:len(data) / 2])
+            part.close()
+            os.remove(os.path.join(workdir, name))
+
+
+def start(served, workdir, downloads):
+    """Updates the project files in 'workdir' like participate.py does.
+
+Returns the number of bytes sent by the server and the time taken."""
+
+    start, sent = time.time(), update._Handler.sent
+    p = project.Project(os.path.join(served, 'project.xml'))
+    p.select_client('any')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        p.update(downloads = downloads)
+    finally:
+        os.chdir(cwd)
+    return update._Handler.sent - sent, time.time() - start
+
+
+#
+# Application entry point
+#
+
+if __name__ == '__main__':
+
+    random.seed(1)
+    root = tempfile.mkdtemp()
+    served = os.path.join(root, 'served')
+    os.mkdir(served)
+    update._Handler.root = served
+    update._Handler.rate = RATE
+    server = _Server(('127.0.0.1', 0), update._Handler)
+    thread = threading.Thread(target = server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    try:
+        publish(served, 'http://127.0.0.1:%i' % server.server_port)
+        print '%i files of %.1f MB, served at %.1f MB/s per connection' % \
+            (FILES, FILE_SIZE / 1048576.0, RATE / 1048576.0)
+        print '%-40s %14s %10s' % ('start', 'bytes sent', 'time (s)')
+        for downloads in (1, project.DOWNLOADS):
+            workdir = os.path.join(root, 'work%i' % downloads)
+            os.mkdir(workdir)
+
+            def run(name):
+                sent, elapsed = start(served, workdir, downloads)
+                print '%-40s %14i %10.2f' % ('%s, %i at a time' %
+                    (name, downloads), sent, elapsed)
+
+            run('cold')
+            run('warm')
+            os.remove(os.path.join(workdir, project.DIGESTS_NAME))
+            run('warm, no recorded digests')
+            interrupt(served, workdir)
+            run('resumed')
+    finally:
+        server.shutdown()
+        shutil.rmtree(root)
+
+
+# EOF
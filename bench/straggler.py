@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+#
+# Imported modules
+#
+
+import heapq, os, random, sys
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import common, dispense
+
+
+#
+# Global constants
+#
+
+POLICIES = [
+    # name, max_copies, deadline_slack
+    ('no re-dispatch',      1, 2.0),
+    ('oldest to idle',      0, 0.0),    # like dispense did before
+    ('overdue, 2 copies',   2, 2.0),
+    ('overdue, 3 copies',   3, 2.0),
+]
+
+SPEEDS = [ 1.0 ] * 12 + [ 2.0 ] * 3 + [ 8.0 ]   # seconds per work unit
+
+
+#
+# Definitions
+#
+
+def simulate(units, copies, slack, seed):
+    """Simulates serving 'units' work units to clients with SPEEDS.
+
+Each client computes one work unit at a time, taking its speed times a random
+factor between 0.5 and 1.5 (and, for one in 50 work units, 5 times as long).
+Returns the time until all work units are completed and the number of work
+units computed more than once."""
+
+    random.seed(seed)
+    project = common.make_project(units)
+    clock = dispense.time = common.Clock()
+    project.max_copies     = copies
+    project.deadline_slack = slack
+    clients = [ (dispense.Client(project), speed) for speed in SPEEDS ]
+    idle = deque(clients)
+    events = []
+    dispatched = 0
+    while True:
+        # Serve idle clients
+        for _ in xrange(len(idle)):
+            client, speed = idle.popleft()
+            work = project.get_work(client)
+            if work is None:
+                idle.append((client, speed))
+                continue
+            dispatched += 1
+            duration = speed * random.uniform(0.5, 1.5)
+            if random.random() < 0.02:
+                duration *= 5
+            heapq.heappush(events, (clock.now + duration, dispatched,
+                                    client, speed, work))
+        if project.is_done():
+            break
+
+        # Advance to the next completion, or the next deadline
+        deadline = project.next_deadline()
+        if idle and (deadline is not None) and (clock.now < deadline) and \
+           ((not events) or (deadline < events[0][0])):
+            clock.now = deadline
+            continue
+        clock.now, _, client, speed, work = heapq.heappop(events)
+        client.completed(work, clock.now)
+        project.put_work(('localhost', 0), work, ['result'], client)
+        idle.append((client, speed))
+    return clock.now, dispatched - units
+
+
+#
+# Application entry point
+#
+
+if __name__ == '__main__':
+
+    units, runs = 2000, 5
+    if len(sys.argv) > 1:
+        units = int(sys.argv[1])
+
+    ideal = units / sum([ 1 / speed for speed in SPEEDS ])
+    print '%i work units, %i clients (ideal makespan: %.0f s)' % (units,
+        len(SPEEDS), ideal)
+    print '%-20s %14s %14s' % ('policy', 'makespan (s)', 'duplicates')
+    for name, copies, slack in POLICIES:
+        makespan = duplicates = 0
+        for seed in xrange(runs):
+            result = simulate(units, copies, slack, seed)
+            makespan += result[0]
+            duplicates += result[1]
+        print '%-20s %14.1f %14.1f' % (name, makespan / runs,
+            float(duplicates) / runs)
+
+
+# EOF
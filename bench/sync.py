@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+#
+# Imported modules
+#
+
+import os, subprocess, sys, tempfile, threading, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import common, enact
+
+
+#
+# Global constants
+#
+
+POLICIES = [
+    ('flush every result',  []),
+    ('sync every result',   ['-s1']),
+    ('sync every 100',      ['-s100']),
+    ('sync every 10 ms',    ['-t10']),
+    ('sync every 100/10ms', ['-s100', '-t10']),
+]
+
+
+#
+# Definitions
+#
+
+def client(port, batch):
+    'Processes work units until the host exits, by reversing them.'
+
+    while True:
+        try:
+            conn = enact.Connection(('localhost', port), False, batch)
+            break
+        except enact.ConnectionFailure:
+            time.sleep(0.05)
+    try:
+        while True:
+            work = conn.get_work()
+            if not work:
+                break
+            conn.put_results([work[::-1]])
+    except enact.ConnectionFailure:
+        pass
+
+
+def bench(units, clients, batch, options):
+    """Serves 'units' trivial work units to 'clients' clients over loopback.
+
+The host writes its results to a file in the current directory, so that syncs
+actually reach the disk, using the sync policy given by the dispense command
+line 'options'. Returns the number of work units processed per second."""
+
+    port = common.free_port()
+    script = os.path.join(os.path.dirname(__file__), os.pardir, 'dispense.py')
+    input = tempfile.TemporaryFile()
+    input.write(''.join([ '%d\n' % i for i in xrange(units) ]))
+    input.seek(0)
+    output = tempfile.NamedTemporaryFile(dir = os.curdir)
+    start = time.time()
+    host = subprocess.Popen([sys.executable, script, '-p%d' % port] + options,
+        stdin = input, stdout = output)
+    threads = [ threading.Thread(target = client, args = (port, batch))
+                for _ in range(clients) ]
+    for thread in threads:
+        thread.setDaemon(True)
+        thread.start()
+    host.wait()
+    elapsed = time.time() - start
+    output.close()
+    return units / elapsed
+
+
+#
+# Application entry point
+#
+
+if __name__ == '__main__':
+
+    units = 20000
+    if len(sys.argv) > 1:
+        units = int(sys.argv[1])
+
+    print '%-20s %12s %12s' % ('policy', '1 client', '8 clients')
+    for name, options in POLICIES:
+        print '%-20s %12.0f %12.0f' % (name, bench(units, 1, 16, options),
+            bench(units, 8, 16, options))
+
+
+# EOF
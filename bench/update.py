@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+#
+# Imported modules
+#
+
+import BaseHTTPServer, SimpleHTTPServer, os, random, shutil, subprocess
+import sys, tempfile, threading, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import project
+
+script = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir,
+                                      'project.py'))
+
+
+#
+# Definitions
+#
+
+class _Handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """Request handler that serves single byte ranges and counts the bytes of
+the files it sends.
+
+If 'rate' is set, each response is sent at 'rate' bytes per second at most."""
+
+    sent = 0
+    root = None
+    rate = None
+
+    def do_GET(self):
+        path = os.path.join(self.root, os.path.basename(self.path))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        f = file(path, 'rb')
+        size = os.fstat(f.fileno()).st_size
+        start, end = 0, size
+        byte_range = self.headers.getheader('Range')
+        if byte_range and byte_range.startswith('bytes='):
+            first, last = byte_range[6:].split('-')
+            start, end = int(first), min(size, int(last or size - 1) + 1)
+            self.send_response(206)
+            self.send_header('Content-Range',
+                'bytes %i-%i/%i' % (start, end - 1, size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start))
+        self.end_headers()
+        f.seek(start)
+        while start < end:
+            data = f.read(min(end - start, 65536))
+            if self.rate:
+                time.sleep(float(len(data)) / self.rate)
+            self.wfile.write(data)
+            start += len(data)
+            _Handler.sent += len(data)
+        f.close()
+
+    def log_message(self, *args):
+        pass
+
+
+def generate(path, size):
+    'Writes a file of \'size\' bytes that compresses about as well as code.'
+
+    words = [ ''.join([ chr(random.randint(97, 122))
+                        for _ in xrange(random.randint(2, 9)) ])
+              for _ in xrange(2000) ]
+    f = file(path, 'wb')
+    written = 0
+    while written < size:
+        line = ' '.join(random.sample(words, 8)) + '\n'
+        f.write(line)
+        written += len(line)
+    f.close()
+
+
+def modify(path, changes):
+    'Overwrites \'changes\' short stretches of the file at \'path\'.'
+
+    f = file(path, 'r+b')
+    size = os.path.getsize(path)
+    for _ in xrange(changes):
+        f.seek(random.randrange(size - 100))
+        f.write('%-100s' % random.random())
+    f.close()
+
+
+def publish(directory, url, options):
+    'Prepares the file in \'directory\' and writes a project description.'
+
+    element = subprocess.Popen([sys.executable, script] + options +
+        [url, os.path.join(directory, 'app.dat')],
+        stdout = subprocess.PIPE).communicate()[0]
+    f = file(os.path.join(directory, 'project.xml'), 'w')
+    f.write('<project id="bench" name="bench" url="%s"><client>'
+        '<platform>any</platform><command>true</command>%s</client>'
+        '<results>single</results><server><host>localhost</host>'
+        '<port>3450</port><input>in</input><output>out</output>'
+        '</server></project>' % (url, element))
+    f.close()
+
+
+def update(directory, workdir, cache = None):
+    """Updates the project files in 'workdir'.
+
+Returns the number of bytes sent by the server and the time taken."""
+
+    start, sent = time.time(), _Handler.sent
+    p = project.Project(os.path.join(directory, 'project.xml'))
+    p.select_client('any')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        p.update(cache = cache)
+    finally:
+        os.chdir(cwd)
+    return _Handler.sent - sent, time.time() - start
+
+
+#
+# Application entry point
+#
+
+if __name__ == '__main__':
+
+    size = 8 << 20
+    if len(sys.argv) > 1:
+        size = int(sys.argv[1]) << 20
+
+    random.seed(1)
+    root = tempfile.mkdtemp()
+    served = os.path.join(root, 'served')
+    os.mkdir(served)
+    _Handler.root = served
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target = server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    url = 'http://127.0.0.1:%i' % server.server_port
+    try:
+        generate(os.path.join(served, 'app.dat'), size)
+        print 'Project file: %.1f MB' % (size / 1048576.0)
+        print '%-36s %14s %10s' % ('update', 'bytes sent', 'time (s)')
+
+        def run(name, workdir, cache = None):
+            if not os.path.isdir(workdir):
+                os.mkdir(workdir)
+            sent, elapsed = update(served, workdir, cache)
+            print '%-36s %14i %10.2f' % (name, sent, elapsed)
+
+        cache = os.path.join(root, 'cache')
+        plain, packed = os.path.join(root, 'a'), os.path.join(root, 'b')
+        publish(served, url, [])
+        run('first download', plain)
+        publish(served, url, [ '-z', 'gzip', '-b', '64' ])
+        run('first download, gzip', packed, cache)
+        run('other project, shared cache', os.path.join(root, 'c'), cache)
+
+        modify(os.path.join(served, 'app.dat'), 10)
+        publish(served, url, [])
+        run('10 changes, whole file', plain)
+        publish(served, url, [ '-z', 'gzip', '-b', '64' ])
+        run('10 changes, 64 KB blocks', packed)
+        modify(os.path.join(served, 'app.dat'), 10)
+        publish(served, url, [ '-z', 'gzip', '-b', '8' ])
+        run('10 more changes, 8 KB blocks', packed)
+    finally:
+        server.shutdown()
+        shutil.rmtree(root)
+
+
+# EOF
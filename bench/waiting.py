@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+#
+# Imported modules
+#
+
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import common, dispense
+
+
+#
+# Definitions
+#
+
+class _Session:
+    'Stand-in for a session that waits for a work unit for \'client\'.'
+
+    def __init__(self, project, client):
+        self.project = project
+        self.client  = client
+        self.work    = None
+        self.run_deferred()
+
+    def run_deferred(self):
+        self.work = self.project.get_work(self.client)
+        if self.work is None:
+            self.project.work_waiting.append(self)
+
+
+def check(units = 10):
+    """Returns the poll timeouts of a host whose only client waits for work.
+
+The client computes all work units but the last one, a second apart, and then
+asks for another work unit while it computes the last one, as enact does when
+it fetches work units ahead. Once that work unit is overdue, it cannot be
+given to the client that holds it, so the host should not stop waiting for
+events. Returns the poll timeout at that point, and the poll timeout and the
+work unit that are given to a second client that connects then."""
+
+    clock = dispense.time = common.Clock()
+    project = common.make_project(units)
+    client = dispense.Client(project)
+    for _ in xrange(units - 1):
+        work = project.get_work(client)
+        clock.now += 1
+        client.completed(work, clock.now)
+        project.put_work(('localhost', 0), work, ['result'], client)
+    project.get_work(client)
+    _Session(project, client)
+    clock.now += 100
+    project.after_poll(project.work_written)
+    held = project.poll_timeout(clock.now)
+
+    other = _Session(project, dispense.Client(project))
+    return held, project.poll_timeout(clock.now), other.work
+
+
+#
+# Application entry point
+#
+
+if __name__ == '__main__':
+
+    held, timeout, work = check()
+    print 'poll timeout while the overdue unit is held:  %g s' % held
+    print 'poll timeout once another client received it: %g s' % timeout
+    print 'work unit received by the other client:       %s' % work
+    if held <= 0:
+        sys.stderr.write('Error: the host does not wait for events while '
+            'the only overdue work unit cannot be served.\n')
+        sys.exit(1)
+    if work is None:
+        sys.stderr.write('Error: the overdue work unit was not served to '
+            'another client.\n')
+        sys.exit(1)
+
+
+# EOF
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+#
+# Imported modules
+#
+
+import os, subprocess, sys, tempfile, time
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import common, dispense
+
+
+#
+# Definitions
+#
+
+def generate(path, size_mb, width):
+    'Writes about \'size_mb\' megabytes of work units of \'width\' bytes.'
+
+    f = file(path, 'w')
+    for i in xrange(size_mb * 1048576 / (width + 1)):
+        f.write('%0*d\n' % (width, i))
+    f.close()
+
+
+def simulate(path, offsets, inflight = 1000, lost = 10):
+    """Dispenses all work units in the file at 'path' to simulated clients.
+
+Results are returned 'inflight' work units after they were dispensed, except
+for one in 'lost' work units, whose clients disappear; these stay outstanding
+until the input is exhausted and are then served again. If 'offsets' is False,
+outstanding work units are kept in memory instead of being located by offset.
+"""
+
+    project = dispense.Project()
+    project.input  = file(path, 'r')
+    project.output = common.NullOutput()
+    project.input_offsets = offsets
+    clients = deque()
+    lost_once = set()
+    count = 0
+    while True:
+        work = project.get_work()
+        if work is None:
+            break
+        count += 1
+        i = int(work)
+        if (i % lost == 0) and (i not in lost_once):
+            lost_once.add(i)
+        else:
+            clients.append(work)
+        if len(clients) >= inflight:
+            project.put_work(('localhost', 0), clients.popleft(), ['result'])
+    return count
+
+
+#
+# Application entry point
+#
+
+if __name__ == '__main__':
+
+    if sys.argv[1:2] == ['--run']:
+        path, offsets = sys.argv[2], sys.argv[3] == 'offsets'
+        start = time.time()
+        count = simulate(path, offsets)
+        print '%-8s %10d %10.1f %12.1f' % (sys.argv[3], count,
+            time.time() - start, common.peak_rss())
+        sys.exit(0)
+
+    size_mb, width = 2048, 4096
+    if len(sys.argv) > 1:
+        size_mb = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        width = int(sys.argv[2])
+
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        generate(path, size_mb, width)
+        print 'Input: %d MB of %d-byte work units' % (size_mb, width)
+        print '%-8s %10s %10s %12s' % ('mode', 'dispensed', 'time (s)',
+            'peak RSS (MB)')
+        sys.stdout.flush()
+        for mode in ('offsets', 'strings'):
+            subprocess.call([sys.executable, __file__, '--run', path, mode])
+    finally:
+        os.remove(path)
+
+
+# EOF
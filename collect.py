@@ -5,7 +5,17 @@
 #
 
 import getopt
+import heapq
+import marshal
+import os
+import shutil
 import sys
+import tempfile
+import resultlog
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
 
 #
 # Global constants
@@ -22,10 +32,25 @@ output_verbose    = False
 output_remaining  = False
 multiple_results  = False
 input_file        = None
+log_file          = None
+window_limit      = None
+jobs              = 1
+digest_keys       = False
 
 processed         = {}
 ordered_workunits = []
 
+window_input      = None    # input file, read while results are written
+window_next       = None    # next work unit in the input
+window_buffer     = {}      # work unit -> (results, annotations) or offset
+window_size       = 0       # total size of results buffered in memory
+window_memory     = {}      # work unit -> size of its results in memory
+window_spill      = None    # temporary file holding spilled results
+                            # (in window mode, or in digest mode with -i)
+
+warning_file      = None    # file to which a parallel job writes warnings
+warning_key       = None    # position in the results of the warnings written
+
 
 #
 # Definitions
@@ -34,18 +59,33 @@ ordered_workunits = []
 def usage(code = 0):
     'Displays command line usage information.'
 
-    print 'Usage:\n    %s [<options>]' % sys.argv[0]
+    print 'Usage:\n    %s [<options>] [<results-file> ...]' % sys.argv[0]
     print """
 Required arguments:
     None.
 
+Optional arguments:
+    <results-file>      a file with results in the format produced by the
+                        dispense tool (default: standard input)
+
 Available options:
+    -d, --digest:       identify work units by a digest and keep only a digest
+                        of their results in memory
     -h, --help:         show this description
     -i<file>, --input=<file>
                         use <file> as the input file containing work units
+    -j<n>, --jobs=<n>:  collect the results in <n> processes (requires
+                        results files or -l, excludes -w; default: 1)
+    -l<file>, --log=<file>
+                        read results from the binary result log <file>
+                        instead of standard input
     -m, --multiple:     expect multiple computation results per work unit
     -r, --remaining     write remaining work units (requires -i, excludes -v)
     -v, --verbose       write verbose output format (excludes -r)
+    -w<n>, --window=<n> write results in input order while they are read,
+                        buffering at most <n> megabytes of results that
+                        arrive out of order in memory (requires -i,
+                        excludes -r)
 
 
 The collect tool collects the computation results from the input provided in
@@ -60,43 +100,488 @@ When an input file is provided (with the -i option), the following additional
 actions are performed:
     - warn for and remove results for non-existent work units
     - order results according to order of work units in the input file
+
+With -j, the results files are split into parts that are read in parallel, and
+the results are partitioned by work unit, so that the results for each
+partition are verified in parallel as well; the output is the same as that of
+a single process. Temporary files about the size of the results are written.
+
+With -d, work units are identified by a 16-byte digest rather than by their
+text, and only a digest of the results is kept to detect non-matching
+duplicates, which saves memory when work units are long. Without -w, results
+that have to be written in input order are kept in a temporary file, and the
+input file is read a second time to write them.
 """
     sys.exit(code)
 
 
-def process_results(workunit, results, annotations):
-    'Collects the results for a single work unit'
-    
+def warn(message):
+    'Writes a warning, or records it with its position in a parallel job.'
+
+    if warning_file <> None:
+        marshal.dump((warning_key, message), warning_file)
+    else:
+        sys.stderr.write(message)
+
+
+def parse_results(lines):
+    """Parses results in the format produced by the dispense tool.
+
+Yields a tuple (workunit, results, annotations) for each work unit in the
+iterable 'lines', and None for each result line not preceded by a work unit."""
+
+    last_workunit    = None
+    last_results     = []
+    last_annotations = []
+    for line in lines:
+        line = line.rstrip('\n')
+        if line == '':
+            continue
+        if line[0] == '>':              # Output (workunit)
+            if last_workunit <> None:
+                yield last_workunit, last_results, last_annotations
+                last_results = []
+                last_annotations = []
+            last_workunit = line[1:]
+        elif line[0] == '<':            # Input (result)
+            if last_workunit == None:
+                yield None
+            else:
+                last_results.append(line[1:])
+        else:                           # Annotation
+            if last_workunit <> None:
+                yield last_workunit, last_results, last_annotations
+                last_results = []
+                last_annotations = []
+                last_workunit = None
+            last_annotations.append(line)
+    if last_workunit <> None:
+        yield last_workunit, last_results, last_annotations
+
+
+def truncate_results(workunit, results):
+    'Sorts the results for a work unit, keeping one in single result mode.'
+
     if (not multiple_results) and (len(results) > 1):
-        sys.stderr.write('Warning: multiple results for workunit "%s" '
+        warn('Warning: multiple results for workunit "%s" '
             'in single result mode encountered.\n' % workunit)
         results[:] = results[0:1]   # truncate list to 1 element
     results.sort()
 
-    if (input_file <> None) and (not processed.has_key(workunit)):
-        sys.stderr.write('Warning: result encountered for workunit "%s" '
+
+def store_results(workunit, results, annotations):
+    """Verifies the results for a work unit and stores them in 'processed'.
+
+Returns whether the results were stored, which they are if they are the first
+valid results for the work unit."""
+
+    key = unit_key(workunit)
+    if (input_file <> None) and (not processed.has_key(key)):
+        warn('Warning: result encountered for workunit "%s" '
             'which does not occur in the input file.\n' % workunit)
     elif (not multiple_results) and (results == []):
+        warn('Warning: zero results for workunit "%s" '
+            'in single result mode encountered.\n' % workunit)
+    elif (processed.has_key(key)) and (processed[key] <> None):
+        if digest_keys:
+            match = processed[key][0] == results_digest(results)
+        else:
+            match = processed[key][0] == results
+        if not match:
+            warn('Warning: duplicate result for workunit "%s" '
+                'does not match result encountered before.\n' % workunit)
+    elif not digest_keys:
+        processed[key] = (results, annotations)
+        return True
+    elif input_file <> None:
+        processed[key] = (results_digest(results),
+                          spill(workunit, results, annotations))
+        return True
+    else:
+        processed[key] = (results_digest(results), None)
+        return True
+    return False
+
+
+def load_entry(entry):
+    """Returns the results and annotations of an entry in 'processed'.
+
+In digest mode, these are read back from the spill file."""
+
+    if (entry == None) or (not digest_keys):
+        return entry
+    _, results, annotations = unspill(entry[1])
+    return results, annotations
+
+
+def write_results(workunit, results, annotations):
+    'Writes the results for a single work unit without an input file.'
+
+    if output_verbose:
+        for annotation in annotations:
+            sys.stdout.write('%s\n' % annotation)
+        sys.stdout.write('>%s\n' % workunit)
+        for result in results:
+            sys.stdout.write('<%s\n' % result)
+    else:
+        for result in results:
+            sys.stdout.write('%s\n' % result)
+        if multiple_results:
+            sys.stdout.write('\n')
+
+
+def process_results(workunit, results, annotations):
+    'Collects the results for a single work unit'
+    
+    truncate_results(workunit, results)
+    if window_limit <> None:
+        window_results(workunit, results, annotations)
+    elif store_results(workunit, results, annotations) and not input_file:
+        write_results(workunit, results, annotations)
+
+
+def write_ordered(workunit, results, annotations):
+    'Writes the results for a single work unit in input order.'
+
+    if output_verbose:
+        for annotation in annotations:
+            sys.stderr.write('%s\n' % annotation)
+        sys.stdout.write('>%s\n' % workunit)
+        for result in results:
+            sys.stdout.write('<%s\n' % result)
+    else:
+        for result in results:
+            sys.stdout.write('%s\n' % result)
+        if multiple_results:
+            sys.stdout.write('\n')
+
+
+def write_input_result(workunit, entry):
+    'Writes the processed entry for a work unit from the input file.'
+
+    if (entry == None) and output_remaining:
+        sys.stdout.write('%s\n' % workunit)
+    if (entry <> None) and (not output_remaining):
+        results, annotations = entry
+        write_ordered(workunit, results, annotations)
+
+
+def log_results(path):
+    'Yields a tuple (workunit, results, annotations) for each log record.'
+
+    for _, timestamp, addr, workunit, results in \
+            resultlog.read_records(open(path, 'rb')):
+        yield workunit, results, [ resultlog.annotation(timestamp, addr) ]
+
+
+def results_digest(results):
+    'Returns a digest of a (sorted) list of results.'
+
+    return md5('\n'.join(results)).digest()
+
+
+def unit_key(workunit):
+    """Returns the key of 'workunit' in 'processed' and 'window_buffer'.
+
+This is the work unit itself, or in digest mode, a digest of it."""
+
+    if digest_keys:
+        return md5(workunit).digest()
+    return workunit
+
+
+def spill(workunit, results, annotations):
+    'Writes results to the spill file and returns their offset in it.'
+
+    global window_spill
+    if window_spill == None:
+        window_spill = tempfile.TemporaryFile()
+    window_spill.seek(0, 2)
+    offset = window_spill.tell()
+    window_spill.write('%d %d\n%s\n' %
+        (len(results), len(annotations), workunit))
+    for line in results + annotations:
+        window_spill.write('%s\n' % line)
+    return offset
+
+
+def unspill(offset):
+    'Returns the work unit, results and annotations spilled at \'offset\'.'
+
+    window_spill.seek(offset)
+    counts = window_spill.readline().split()
+    workunit = window_spill.readline()[:-1]
+    lines = [ window_spill.readline()[:-1]
+              for _ in range(int(counts[0]) + int(counts[1])) ]
+    return workunit, lines[:int(counts[0])], lines[int(counts[0]):]
+
+
+def window_load(key):
+    'Returns the buffered work unit, results and annotations for \'key\'.'
+
+    entry = window_buffer[key]
+    if type(entry) is tuple:
+        return entry
+    return unspill(entry)
+
+
+def window_spill_all():
+    """Moves all buffered results from memory to the spill file.
+
+Only the offset of each entry in the file is kept in memory."""
+
+    global window_size
+    for key in window_memory:
+        window_buffer[key] = spill(*window_buffer[key])
+    window_memory.clear()
+    window_size = 0
+
+
+def window_read_input():
+    """Reads the next work unit from the input file into 'window_next'.
+
+Duplicate work units are skipped with a warning. At the end of the input,
+'window_next' is set to None."""
+
+    global window_next
+    while True:
+        line = window_input.readline()
+        if line == '':
+            window_next = None
+            return
+        workunit = line.rstrip('\n')
+        if processed.has_key(unit_key(workunit)):
+            sys.stderr.write('Warning: '
+                'input file contains duplicate workunit "%s".\n' % workunit)
+        else:
+            window_next = workunit
+            return
+
+
+def window_advance():
+    'Writes buffered results for as long as the next work unit has results.'
+
+    global window_size
+    while (window_next <> None) and \
+            window_buffer.has_key(unit_key(window_next)):
+        key = unit_key(window_next)
+        _, results, annotations = window_load(key)
+        del window_buffer[key]
+        if window_memory.has_key(key):
+            window_size -= window_memory.pop(key)
+        processed[key] = results_digest(results)
+        write_ordered(window_next, results, annotations)
+        window_read_input()
+
+
+def window_results(workunit, results, annotations):
+    """Collects the results for a single work unit in window mode.
+
+The results are written immediately if the work unit is the next one in the
+input file, and are buffered otherwise. Of results already written, only a
+digest is kept, to check that duplicate results match."""
+
+    global window_size
+    key = unit_key(workunit)
+    if (not multiple_results) and (results == []):
         sys.stderr.write('Warning: zero results for workunit "%s" '
             'in single result mode encountered.\n' % workunit)
-    elif (processed.has_key(workunit)) and (processed[workunit] <> None):
-        if (processed[workunit][0] <> results):
+    elif processed.has_key(key) or window_buffer.has_key(key):
+        if processed.has_key(key):
+            match = processed[key] == results_digest(results)
+        else:
+            match = window_load(key)[1] == results
+        if not match:
             sys.stderr.write('Warning: duplicate result for workunit "%s" '
                 'does not match result encountered before.\n' % workunit)
     else:
-        processed[workunit] = (results, annotations)
-        if not input_file:
-            if output_verbose:
-                for annotation in annotations:
-                    sys.stdout.write('%s\n' % annotation)
-                sys.stdout.write('>%s\n' % workunit)
-                for result in results:
-                    sys.stdout.write('<%s\n' % result)
-            else:
-                for result in results:
-                    sys.stdout.write('%s\n' % result)
-                if multiple_results:
-                    sys.stdout.write('\n')
+        window_buffer[key] = (workunit, results, annotations)
+        window_advance()
+        if window_buffer.has_key(key):
+            size = sum([ len(line) for line in results + annotations ])
+            window_memory[key] = size
+            window_size += size
+            if window_size > window_limit:
+                window_spill_all()
+
+
+def window_finish():
+    """Writes the remaining buffered results after all results have been read.
+
+Work units without results are skipped; results that remain buffered do not
+belong to any work unit in the input file."""
+
+    while window_next <> None:
+        if not window_buffer.has_key(unit_key(window_next)):
+            processed[unit_key(window_next)] = None
+            window_read_input()
+        window_advance()
+    for key in window_buffer.keys():
+        workunit = window_load(key)[0]
+        sys.stderr.write('Warning: result encountered for workunit "%s" '
+            'which does not occur in the input file.\n' % workunit)
+
+
+def _load(path):
+    'Yields the values marshalled to the file at \'path\'.'
+
+    f = open(path, 'rb')
+    try:
+        while True:
+            try:
+                yield marshal.load(f)
+            except EOFError:
+                break
+    finally:
+        f.close()
+
+
+def _init_job(options):
+    'Sets the options of the main process in a parallel job.'
+
+    global multiple_results, input_file, digest_keys
+    multiple_results, input_file, digest_keys = options
+
+
+def read_input(partition = 0, partitions = 1):
+    """Yields the line index and work unit of each line of the input file.
+
+Only the work units in partition 'partition' of 'partitions' are yielded (see
+collect_part())."""
+
+    for index, line in enumerate(open(input_file, 'rt')):
+        workunit = line.rstrip('\n')
+        if (partitions == 1) or (hash(workunit) % partitions == partition):
+            yield index, workunit
+
+
+def collect_part((task, path, start, end, directory, partitions)):
+    """Reads the results from the part of a results file from 'start' to 'end'.
+
+The results are partitioned by work unit into 'partitions' files in
+'directory', each with a tuple (index, workunit, results, annotations) per
+work unit, in order; if 'start' is None, 'path' is a binary result log which
+is read as a whole."""
+
+    global warning_file, warning_key
+    warning_file = open(os.path.join(directory, 'warnings-%d' % task), 'wb')
+    outputs = [ open(os.path.join(directory, 'part-%d-%d' % (task, i)), 'wb')
+                for i in range(partitions) ]
+    try:
+        if start == None:
+            records = log_results(path)
+        else:
+            records = parse_results(resultlog.text_lines(path, start, end))
+        for index, record in enumerate(records):
+            if record == None:
+                warning_key = (1, task, index, 0)
+                warn('Warning: results without '
+                    'corresponding workunit encountered.\n')
+                continue
+            workunit, results, annotations = record
+            warning_key = (1, task, index, 1)
+            truncate_results(workunit, results)
+            marshal.dump((index, workunit, results, annotations),
+                outputs[hash(workunit) % partitions])
+    finally:
+        for output in outputs:
+            output.close()
+        warning_file.close()
+
+
+def collect_partition((partition, tasks, directory, partitions)):
+    """Verifies the results of a partition written by collect_part().
+
+The results that are stored are written to a file in 'directory' as tuples
+(key, workunit, results, annotations), ordered by key; with an input file,
+a tuple (index, workunit, entry) is written for each work unit of the
+partition in the input file instead, where entry is None or the results and
+annotations."""
+
+    global warning_file, warning_key, window_spill
+    processed.clear()
+    window_spill = None
+    warning_file = open(os.path.join(directory,
+        'warnings-partition-%d' % partition), 'wb')
+    output = open(os.path.join(directory, 'output-%d' % partition), 'wb')
+    try:
+        if input_file <> None:
+            for index, workunit in read_input(partition, partitions):
+                if processed.has_key(unit_key(workunit)):
+                    warning_key = (0, index, 0, 0)
+                    warn('Warning: input file contains '
+                        'duplicate workunit "%s".\n' % workunit)
+                else:
+                    processed[unit_key(workunit)] = None
+
+        for task in range(tasks):
+            for index, workunit, results, annotations in _load(os.path.join(
+                    directory, 'part-%d-%d' % (task, partition))):
+                warning_key = (1, task, index, 2)
+                if store_results(workunit, results, annotations) and \
+                        (input_file == None):
+                    marshal.dump(((task, index), workunit, results,
+                        annotations), output)
+
+        if input_file <> None:
+            for index, workunit in read_input(partition, partitions):
+                key = unit_key(workunit)
+                if processed.has_key(key):     # not a duplicate
+                    marshal.dump((index, workunit,
+                        load_entry(processed.pop(key))), output)
+    finally:
+        output.close()
+        warning_file.close()
+
+
+def collect_parallel(paths):
+    """Collects the results from the results files at 'paths' in parallel.
+
+Each file is split into parts (see resultlog.text_parts()) that are read by
+collect_part(); the results are then verified per partition by
+collect_partition(), and the warnings and output of all jobs are merged in the
+order in which a single process would write them. If 'paths' is None, the
+binary result log 'log_file' is read instead, by a single job."""
+
+    import multiprocessing
+    directory = tempfile.mkdtemp(prefix = 'collect-')
+    try:
+        if paths == None:
+            tasks = [ (0, log_file, None, None, directory, jobs) ]
+        else:
+            tasks = []
+            for path in paths:
+                for start, end in resultlog.text_parts(path, jobs):
+                    tasks.append((len(tasks), path, start, end, directory,
+                        jobs))
+
+        pool = multiprocessing.Pool(jobs, _init_job,
+            ((multiple_results, input_file, digest_keys),))
+        try:
+            pool.map(collect_part, tasks, 1)
+            pool.map(collect_partition, [ (partition, len(tasks), directory,
+                jobs) for partition in range(jobs) ], 1)
+        finally:
+            pool.terminate()
+
+        warnings = [ os.path.join(directory, 'warnings-%d' % task)
+                     for task in range(len(tasks)) ] + \
+                   [ os.path.join(directory, 'warnings-partition-%d' % i)
+                     for i in range(jobs) ]
+        for _, message in heapq.merge(*map(_load, warnings)):
+            sys.stderr.write(message)
+
+        outputs = heapq.merge(*[ _load(os.path.join(directory,
+            'output-%d' % partition)) for partition in range(jobs) ])
+        if input_file <> None:
+            for _, workunit, entry in outputs:
+                write_input_result(workunit, entry)
+        else:
+            for _, workunit, results, annotations in outputs:
+                write_results(workunit, results, annotations)
+    finally:
+        shutil.rmtree(directory, True)
+
 
 #
 # Application entry point
@@ -106,24 +591,42 @@ if __name__ == '__main__':
 
     # Parse command line arguments
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'hi:mrv',
-            ['help', 'input', 'multiple', 'remaining', 'verbose'])
+        opts, args = getopt.getopt(sys.argv[1:], 'dhi:j:l:mrvw:',
+            ['digest', 'help', 'input', 'jobs=', 'log=', 'multiple',
+             'remaining', 'verbose', 'window='])
     except getopt.GetoptError, message:
         sys.stderr.write('Error: %s.\n' % str(message))
         usage(2)
     for opt, arg in opts:
+        if opt in ('-d', '--digest'):
+            digest_keys = True
         if opt in ('-h', '--help'):
             usage()
         if opt in ('-i', '--input'):
             input_file = arg
+        if opt in ('-j', '--jobs'):
+            try:
+                jobs = max(1, int(arg))
+            except ValueError:
+                sys.stderr.write('Warning: invalid jobs argument; '
+                    'ignored.\n')
+        if opt in ('-l', '--log'):
+            log_file = arg
         if opt in ('-m', '--multiple'):
             multiple_results = True
         if opt in ('-r', '--remaining'):
             output_remaining = True
         if opt in ('-v', '--verbose'):
             output_verbose = True
-    if len(args) <> 0:
-        sys.stderr.write('Error: exactly zero arguments required.\n')
+        if opt in ('-w', '--window'):
+            try:
+                window_limit = int(arg) * 1048576
+            except ValueError:
+                sys.stderr.write('Warning: invalid window argument; '
+                    'ignored.\n')
+    if (len(args) <> 0) and (log_file <> None):
+        sys.stderr.write('Error: '
+            'results files and option -l may not both be supplied.\n')
         usage(2)
     if output_remaining and output_verbose:
         sys.stderr.write('Error: '
@@ -134,8 +637,51 @@ if __name__ == '__main__':
             'option -r requires option -i to be supplied.\n')
         usage(2)
 
+    if output_remaining and (window_limit <> None):
+        sys.stderr.write('Error: '
+            'only one option of -r and -w may be supplied.\n')
+        usage(2)
+    if (window_limit <> None) and (input_file == None):
+        sys.stderr.write('Error: '
+            'option -w requires option -i to be supplied.\n')
+        usage(2)
+
+    if (jobs > 1) and (window_limit <> None):
+        sys.stderr.write('Error: '
+            'only one option of -j and -w may be supplied.\n')
+        usage(2)
+    if (jobs > 1) and (len(args) == 0) and (log_file == None):
+        sys.stderr.write('Error: '
+            'option -j requires results files or option -l.\n')
+        usage(2)
+    for path in args:
+        if not os.path.isfile(path):
+            sys.stderr.write('Error: "%s" is not a file!\n' % path)
+            sys.exit(2)
+
+    # Collect results in parallel
+    if jobs > 1:
+        if log_file <> None:
+            if not resultlog.is_result_log(log_file):
+                sys.stderr.write('Error: "%s" is not a result log!\n' %
+                    log_file)
+                sys.exit(2)
+            collect_parallel(None)
+        else:
+            collect_parallel(args)
+        sys.exit(0)
+
+    # Open input file to be read while processing results
+    if window_limit <> None:
+        try:
+            window_input = open(input_file, 'rt')
+        except IOError, (_, message):
+            sys.stderr.write('Error: %s!\n' % message)
+            sys.exit(2)
+        window_read_input()
+
     # Read in input file
-    if input_file <> None:
+    elif input_file <> None:
         try:
             file = open(input_file, 'rt')
         except IOError, (_, message):
@@ -147,64 +693,43 @@ if __name__ == '__main__':
             if line == '':
                 break
             workunit = line.rstrip('\n')
-            if processed.has_key(workunit):
-                sys.stderr.write('Warning: '
-                    'input file contains duplicate workunit "%s".\n' % workunit)
+            if processed.has_key(unit_key(workunit)):
+                sys.stderr.write('Warning: input file contains '
+                    'duplicate workunit "%s".\n' % workunit)
             else:
-                processed[workunit] = None
-                ordered_workunits.append(workunit)
+                processed[unit_key(workunit)] = None
+                if not digest_keys:
+                    ordered_workunits.append(workunit)
         file.close()
 
+    # Process results from a binary result log
+    if log_file <> None:
+        if not resultlog.is_result_log(log_file):
+            sys.stderr.write('Error: "%s" is not a result log!\n' % log_file)
+            sys.exit(2)
+        for workunit, results, annotations in log_results(log_file):
+            process_results(workunit, results, annotations)
+
     # Process input
-    last_workunit    = None
-    last_results     = []
-    last_annotations = []
-    while True:
-        line = sys.stdin.readline()
-        if line == '':
-            if last_workunit <> None:
-                process_results(last_workunit, last_results, last_annotations)
-            break
-        line = line.rstrip('\n')
-        if line == '':
-            continue
-        if line[0] == '>':              # Output (workunit)
-            if last_workunit <> None:
-                process_results(last_workunit, last_results, last_annotations)
-                last_results = []
-                last_annotations = []
-            last_workunit = line[1:]
-        elif line[0] == '<':            # Input (result)
-            if last_workunit == None:
-                sys.stderr.write('Warning: '
-                    'results without corresponding workunit encountered.\n')
-            else:
-                last_results.append(line[1:])
-        else:                           # Annotation
-            if last_workunit <> None:
-                process_results(last_workunit, last_results, last_annotations)
-                last_results = []
-                last_annotations = []
-                last_workunit = None
-            last_annotations.append(line)
+    else:
+        for f in map(open, args) or [ sys.stdin ]:
+            for record in parse_results(iter(f.readline, '')):
+                if record == None:
+                    sys.stderr.write('Warning: results without '
+                        'corresponding workunit encountered.\n')
+                else:
+                    process_results(*record)
 
     # Generate output with input file
-    if input_file:
+    if window_limit <> None:
+        window_finish()
+    elif digest_keys and input_file:
+        for _, workunit in read_input():
+            key = unit_key(workunit)
+            if processed.has_key(key):          # not a duplicate
+                write_input_result(workunit, load_entry(processed.pop(key)))
+    elif input_file:
         for workunit in ordered_workunits:
-            if (processed[workunit] == None) and (output_remaining):
-                sys.stdout.write('%s\n' % workunit)
-            if (processed[workunit] <> None) and (not output_remaining):
-                results, annotations = processed[workunit]
-                if output_verbose:
-                    for annotation in annotations:
-                        sys.stderr.write('%s\n' % annotation)
-                    sys.stdout.write('>%s\n' % workunit)
-                    for result in results:
-                        sys.stdout.write('<%s\n' % result)
-                else:
-                    for result in results:
-                        sys.stdout.write('%s\n' % result)
-                    if multiple_results:
-                        sys.stdout.write('\n')
+            write_input_result(workunit, processed[workunit])
 
 # EOF
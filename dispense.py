@@ -4,17 +4,54 @@
 # Imported modules
 #
 
-import asynchat, asyncore, getopt, time, socket, sys
+import array, asynchat, asyncore, bisect, errno, getopt, heapq, os, select
+import struct, time, socket, sys
+from collections import deque
+import resultlog
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+
+#
+# Global constants
+#
+
+COMMAND = '!'               # prefix of protocol commands from clients
+HELLO   = COMMAND + 'hello' # first line sent by a negotiating client
+PING    = COMMAND + 'ping'  # heartbeat sent by a negotiating client
+RETURN  = COMMAND + 'return'    # hands back an unprocessed work unit
+
+BACKLOG = 65535             # connections queued for accept (the OS may limit)
+ACCEPTS = 256               # maximum connections accepted per loop round
+
+RATE_WEIGHT = 0.1           # weight of a new sample in time per unit estimates
+REPLICA_SCAN = 64           # work units needing replicas skipped per request
+FASTEST_AGE = 1.0           # seconds after which the fastest speed is updated
+
+LATENCY_BOUNDS = (0.01, 0.03, 0.1, 0.3, 1, 3, 10, 30, 100, 300, 1000, 3600,
+                  10800, 36000, 86400)  # seconds, for result latencies
+
+DIGEST_TYPE   = 'd'         # array type code of work unit digests
+DIGEST_BITS   = 53          # bits of a digest, stored exactly in a double
+DIGEST_STRUCT = struct.Struct('<HQ')    # bucket index, digest bits
+
 
 
 #
 # Global variables
 #
 
-work_buffered = []
-work_pending  = []
-input         = sys.stdin
-output        = sys.stdout
+projects      = []         # Projects hosted (see run())
+line_limit    = 64 << 20   # maximum length of a line received from a client
+group_limit   = 256 << 20  # maximum total size of the results for a work unit
+metrics_port  = None       # port on which metrics are served, if any
+started       = None       # time at which run() was called
+
+poller        = None       # epoll or poll object used by poll(), if any
+poller_flags  = {}         # file descriptor -> flags registered with poller
+poller_dirty  = set()      # file descriptors whose flags may have changed
 
 
 #
@@ -33,13 +70,94 @@ Available options:
     -h, --help:             show this description
     -p<n>, --port=<n>:      listen on port <n> (default: 3450)
     -m, --multiple:         expect multiple computation results per work unit
+    -b<n>, --batch=<n>:     serve at most <n> work units per client request
+                            (default: 100)
+    -l<f>, --log=<f>:       append results to the binary result log <f>
+                            instead of writing them to standard output
     -r<f>, --resume=<f>:    resume previous session, taking partial results
-                            from file <f>
+                            from file <f> (a text output or result log)
+    -s<n>, --sync=<n>:      write results to disk after every <n> results
+    -t<n>, --sync-interval=<n>:
+                            write results to disk at least every <n>
+                            milliseconds (default with -s: 1000)
+    -w<n>, --window=<n>:    keep at most <n> work units outstanding; when the
+                            window is full, only overdue work units are served
+                            again instead of new input (default: unlimited)
+    -c<n>, --copies=<n>:    serve a work unit to at most <n> clients at a time
+                            (0: unlimited; default: 2)
+    -L<n>, --max-line=<n>:  disconnect clients that send lines longer than <n>
+                            megabytes (default: 64)
+    -G<n>, --max-group=<n>: disconnect clients that send results for a work
+                            unit larger than <n> megabytes (default: 256)
+    -M<n>, --metrics=<n>:   serve metrics in the Prometheus text format on
+                            port <n>
+    -i<n>, --idle-timeout=<n>:
+                            disconnect clients holding work units from which
+                            nothing was received for <n> seconds
+    -u<n>, --unit-timeout=<n>:
+                            disconnect clients that have not completed a work
+                            unit within <n> seconds
+    -k<n>, --replicas=<n>:  verify work units by computing them on <n>
+                            different hosts (default: 1, no verification)
+    -q<n>, --quorum=<n>:    complete a verified work unit when <n> hosts
+                            returned the same results (default: a majority)
+    -e<n>, --every=<n>:     verify every <n>th work unit only (default: 1)
+    -C, --costs:            work units start with a number estimating their
+                            cost; serve costly work units first, to fast
+                            clients
+    -A<n>, --lookahead=<n>: with -C, choose from the next <n> work units of
+                            the input (default: 1000)
+    -P<id>, --project=<id>: serve only clients that select the project <id>
+                            (default: any)
 
 The dispense tool binds on a TCP port and accepts all incoming connections from
 enacting applications. Results are output as they become available, in no
 predetermined order. The output may contain duplicate results.
 
+When there is no new input to serve, work units are served again to other
+clients once they are overdue: when the clients computing them take more than
+twice as long as expected from the rate at which they have returned results.
+Results for work units that were completed elsewhere first are skipped. A
+binary result log can be converted to the text output format with the
+resultlog tool.
+
+With -i or -u, clients that appear to be dead are disconnected, and the work
+units they held are served to other clients first. Clients that negotiate
+batched operation can send heartbeats while computing (see enact -H); other
+clients must return each result within the idle timeout.
+
+With -k, work units are computed by several hosts, at different addresses, and
+are complete as soon as the quorum of them returned the same results, which
+are then written once. Hosts that return other results are counted in the
+metrics. If the hosts disagree, the work unit is computed by more hosts, up to
+twice as many; the most common results are then written with a warning. The
+replicas of a work unit are served before new input, and there must be at
+least as many hosts as replicas.
+
+With -C, the first word of each work unit is a number that estimates the cost
+of computing it (the computing application receives the whole line). Of the
+work units read ahead (see -A), the most costly are served to the fastest
+clients, and cheaper ones to slower clients, so that the costly work units are
+done early and cheap ones are left for the end. The speed of a client is
+measured from the costs of the work units it completes; until then, the speed
+the client announced is used (see enact -S).
+
+Clients that negotiate batched operation may select the project they compute
+by its identifier (see enact -P). With -P, the connections of clients that
+select another project are closed. To serve several projects from a single
+process, use the host tool.
+
+With -M, the host serves counters of work units and results, the numbers of
+outstanding work units and connected clients, and the time from dispatch to
+result, in total and for each client, over HTTP (or to any client that sends a
+line) on the given port.
+
+By default, results are flushed as soon as they arrive, but are not written to
+disk. With -s or -t, results are written to disk in groups: after <n> results,
+after the given interval, or whenever no more results are arriving. Clients are
+not sent new work units until the results they returned have been written, so
+no result that has been acknowledged is lost when the host crashes.
+
 To improve the structure of the output, consider processing the output with the
 collect tool, which can filter out data and order the results according to the
 original input.
@@ -47,81 +165,1373 @@ original input.
     sys.exit(code)
 
 
-def run(address, multiple_results = False):
-    "Runs a project host on the given 'address'."
+def run(hosted, max_batch = 100):
+    """Runs a project host for the Projects in 'hosted'.
+
+A Dispenser is bound on the address of each project, and is shared by all
+projects with that address. The projects are served by a single event loop,
+which stops once all of them are done."""
 
-    server = Dispenser(address, multiple_results)
+    global started
+    started = time.time()
+    projects[:] = hosted
+    _raise_file_limit()
+    addresses = []
+    for project in projects:
+        if project.address not in addresses:
+            addresses.append(project.address)
+            Dispenser(project.address, [ other for other in projects
+                if other.address == project.address ], max_batch)
+    if metrics_port:
+        MetricsListener((addresses[0][0], metrics_port))
+    timeouts = [ project for project in projects
+                 if project.idle_timeout or project.unit_timeout ]
+    checked = time.time()
     try:
-        asyncore.loop(timeout=1)
-    except asyncore.ExitNow:
-        pass
-
-def resume_from_file(results):
-    """Removes processed work units in 'results' from the input
-
-    For each line starting with '>' in the 'results' file, lines are read
-    from input until the matching work unit is found (or a warning is issused);
-    afterwards, all lines read from input but not matched with a result, are
-    moved into 'work_buffered' to be served by get_work()."""
-    pending = { }
-    while True:
-        line = results.readline()
-        if not line:
-            break
-        if line[0] <> ">":
+        try:
+            while asyncore.socket_map:
+                timeout = min([ project.poll_timeout(time.time())
+                                for project in projects ])
+                written = [ project.work_written for project in projects ]
+                poll(timeout)
+                if timeouts and (time.time() >= checked + 1):
+                    checked = time.time()
+                    check_timeouts(checked)
+                for project, count in zip(projects, written):
+                    project.after_poll(count)
+        except asyncore.ExitNow:
+            pass
+    finally:
+        for project in projects:
+            project._sync_output()
+
+
+def all_done():
+    'Returns whether all hosted projects have been processed.'
+
+    for project in projects:
+        if not project.is_done():
+            return False
+    return True
+
+
+def select_project(candidates, client):
+    """Returns the project of 'candidates' that 'client' should compute.
+
+This is the project with the least computing capacity connected relative to
+its share, once 'client' is connected to it. The capacity is the number of work
+units that the clients of the project compute at a time (see
+Client.announce()), so that clients that can compute several projects are
+divided among them in proportion to their shares. Of projects with the same
+load, the first is returned."""
+
+    loads = [ (sum([ other.cores for other in project.clients.itervalues()
+                     if other is not client ], client.cores) / project.share,
+               index, project) for index, project in enumerate(candidates) ]
+    return min(loads)[2]
+
+
+def check_timeouts(now):
+    """Disconnects clients that hold work units but appear to be dead.
+
+A client is considered dead if nothing was received from it for the idle
+timeout of its project since it was last sent work units, or if it has not
+completed a work unit within the unit timeout of its project. The work units it
+held are released (see Project.release())."""
+
+    for session in asyncore.socket_map.values():
+        if not isinstance(session, _DispenseSession):
             continue
-        done = line[1:-1]
-        while done not in pending:
-            line = input.readline()
+        outstanding = session.client.outstanding
+        if not outstanding:
+            continue
+        idle_timeout = session.project.idle_timeout
+        unit_timeout = session.project.unit_timeout
+        if idle_timeout and (now - session.last_seen > idle_timeout):
+            sys.stderr.write('Warning: nothing received from %s:%i for %g '
+                'seconds; closing connection.\n' % (session.addr +
+                (idle_timeout,)))
+            session.close()
+        elif unit_timeout and (now - min(outstanding.values()) >
+                               unit_timeout):
+            sys.stderr.write('Warning: work unit not completed by %s:%i in '
+                '%g seconds; closing connection.\n' % (session.addr +
+                (unit_timeout,)))
+            session.close()
+
+
+def _raise_file_limit():
+    'Raises the limit on open files as far as allowed, to accept more clients.'
+
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft <> hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, resource.error):
+            pass
+
+
+def poll(timeout):
+    """Runs one round of the event loop, waiting at most 'timeout' seconds.
+
+Uses epoll where available, or else poll or (like asyncore.loop()) select.
+Unlike asyncore.poll2(), which registers every channel again in every round,
+poller flags are only updated for channels in poller_dirty: channels that were
+added, that were pushed data, or that have handled an event, since only these
+can have changed their readable() or writable() state. This keeps the cost of
+a round proportional to the number of active clients, not of all clients."""
+
+    global poller
+    if poller is None:
+        if hasattr(select, 'epoll'):
+            poller = select.epoll()
+        elif hasattr(select, 'poll'):
+            poller = select.poll()
+        else:
+            asyncore.poll(timeout)
+            return
+
+    for fd in poller_dirty:
+        obj = asyncore.socket_map.get(fd)
+        if obj is None:
+            continue
+        flags = 0
+        if obj.readable():
+            flags |= select.POLLIN | select.POLLPRI
+        if obj.writable() and not obj.accepting:
+            flags |= select.POLLOUT
+        if poller_flags.get(fd) <> flags:
+            try:
+                poller.modify(fd, flags)
+            except (IOError, OSError, KeyError, select.error):
+                # Not registered (file descriptors of closed channels are
+                # removed from epoll by the kernel and may be reused)
+                poller.register(fd, flags)
+            poller_flags[fd] = flags
+    poller_dirty.clear()
+
+    if not hasattr(select, 'epoll'):
+        timeout = int(timeout * 1000)   # poll() takes milliseconds
+    try:
+        events = poller.poll(timeout)
+    except (IOError, select.error), e:
+        if e.args[0] <> errno.EINTR:
+            raise
+        events = []
+    for fd, flags in events:
+        obj = asyncore.socket_map.get(fd)
+        if obj is None:
+            continue
+        asyncore.readwrite(obj, flags)
+        poller_dirty.add(fd)
+
+
+def _watch(fd):
+    'Marks the channel with file descriptor \'fd\' for poll() to update.'
+
+    if fd is not None:
+        poller_dirty.add(fd)
+
+
+def _unwatch(fd):
+    'Removes the channel with file descriptor \'fd\' from the poller.'
+
+    poller_dirty.discard(fd)
+    if poller_flags.pop(fd, None) is not None:
+        try:
+            poller.unregister(fd)
+        except (IOError, OSError, KeyError, ValueError, select.error):
+            pass
+
+
+def _seekable(file):
+    'Returns whether the position in \'file\' can be changed.'
+
+    try:
+        file.seek(file.tell())
+        return True
+    except (AttributeError, IOError):
+        return False
+
+
+def _cost(work):
+    """Returns the cost of the work unit 'work', given by its first word.
+
+Work units that do not start with a number have cost 1."""
+
+    try:
+        return max(0.0, float(work.split(None, 1)[0]))
+    except (ValueError, IndexError):
+        return 1.0
+
+
+def metrics_text(now):
+    """Returns the metrics of the project host in the Prometheus text format.
+
+Besides the totals, the number of results, the work units outstanding, the
+estimated time per work unit and the time from dispatch to result are given for
+each connected client, labelled with its address. With replicas, verified work
+units and disagreeing results are counted, in total and for each client. All
+metrics but the uptime are labelled with the project, if it has an identifier
+(see _labels())."""
+
+    sessions = [ session for session in asyncore.socket_map.values()
+                 if isinstance(session, _DispenseSession) ]
+    totals = [ (_labels(project), project) for project in projects ]
+    verified = [ (labels, project) for labels, project in totals
+                 if project.replicas > 1 ]
+    lines = []
+    _metric(lines, 'dispense_uptime_seconds', 'gauge',
+        'Seconds since the host was started.', [ ('', now - started) ])
+    _metric(lines, 'dispense_units_dispatched_total', 'counter',
+        'Work units dispatched to clients.',
+        [ (labels, project.work_dispatched) for labels, project in totals ])
+    _metric(lines, 'dispense_units_redispatched_total', 'counter',
+        'Work units dispatched again because they were overdue.',
+        [ (labels, project.work_redispatched) for labels, project in totals ])
+    _metric(lines, 'dispense_results_total', 'counter',
+        'Work units for which results were written.',
+        [ (labels, project.work_written) for labels, project in totals ])
+    _metric(lines, 'dispense_results_skipped_total', 'counter',
+        'Results skipped because the work unit was completed elsewhere.',
+        [ (labels, project.work_skipped) for labels, project in totals ])
+    if verified:
+        _metric(lines, 'dispense_units_verified_total', 'counter',
+            'Verified work units completed by a quorum of hosts.',
+            [ (labels, project.work_verified)
+              for labels, project in verified ])
+        _metric(lines, 'dispense_units_unverified_total', 'counter',
+            'Verified work units written without a quorum of hosts.',
+            [ (labels, project.work_unverified)
+              for labels, project in verified ])
+        _metric(lines, 'dispense_disagreements_total', 'counter',
+            'Results that differed from those written for a work unit.',
+            [ (labels, project.work_disagreements)
+              for labels, project in verified ])
+        _metric(lines, 'dispense_units_verifying', 'gauge',
+            'Verified work units not yet completed by a quorum.',
+            [ (labels, len([ votes for votes in project.work_votes.itervalues()
+                             if votes.digest is None ]))
+              for labels, project in verified ])
+    _metric(lines, 'dispense_units_outstanding', 'gauge',
+        'Work units dispatched but not completed.',
+        [ (labels, len(project.work_pending)) for labels, project in totals ])
+    _metric(lines, 'dispense_units_queued', 'gauge',
+        'Work units returned by clients, to be served first.',
+        [ (labels, len(project.work_buffered)) for labels, project in totals ])
+    _metric(lines, 'dispense_input_done', 'gauge',
+        'Whether all input has been read.',
+        [ (labels, int(project.input_done)) for labels, project in totals ])
+    _metric(lines, 'dispense_clients_connected', 'gauge',
+        'Connected clients.',
+        [ (labels, len([ session for session in sessions
+                         if session.project is project ]))
+          for labels, project in totals ])
+    _metric(lines, 'dispense_clients_waiting', 'gauge',
+        'Clients waiting for work units to become available.',
+        [ (labels, len(project.work_waiting)) for labels, project in totals ])
+    _metric(lines, 'dispense_unit_seconds', 'gauge',
+        'Estimated seconds per work unit over all clients.',
+        [ (labels, project.work_unit_time) for labels, project in totals
+          if project.work_unit_time is not None ])
+
+    name = 'dispense_result_latency_seconds'
+    lines.append('# HELP %s Seconds from dispatch to result.' % name)
+    lines.append('# TYPE %s histogram' % name)
+    for labels, project in totals:
+        count = 0
+        for bound, bucket in zip(LATENCY_BOUNDS + ('+Inf',),
+                                 project.latency_counts):
+            count += bucket
+            lines.append('%s_bucket%s %d' % (name,
+                _labels(project, ('le', bound)), count))
+        lines.append('%s_sum%s %r' % (name, labels, project.latency_sum))
+        lines.append('%s_count%s %d' % (name, labels, count))
+
+    clients = [ (_labels(session.project, ('client', '%s:%i' % session.addr)),
+                 session.client) for session in sessions ]
+    _metric(lines, 'dispense_client_results_total', 'counter',
+        'Work units for which results were written, per client.',
+        [ (labels, client.results) for labels, client in clients ])
+    _metric(lines, 'dispense_client_units_outstanding', 'gauge',
+        'Work units dispatched but not completed, per client.',
+        [ (labels, len(client.outstanding)) for labels, client in clients ])
+    if verified:
+        _metric(lines, 'dispense_client_disagreements_total', 'counter',
+            'Results that differed from those written, per client.',
+            [ (labels, client.disagreements) for labels, client in clients
+              if client.project.replicas > 1 ])
+    _metric(lines, 'dispense_client_unit_seconds', 'gauge',
+        'Estimated seconds per work unit, per client.',
+        [ (labels, client.unit_time) for labels, client in clients
+          if client.unit_time is not None ])
+    _metric(lines, 'dispense_client_cores', 'gauge',
+        'Work units computed at a time, as announced, per client.',
+        [ (_labels(session.project, ('client', '%s:%i' % session.addr),
+                   ('platform', session.client.platform or '')),
+           session.client.cores) for session in sessions ])
+    if [ project for project in projects if project.costs ]:
+        _metric(lines, 'dispense_client_speed', 'gauge',
+            'Estimated speed relative to a typical client, per client.',
+            [ (labels, float(client.relative_speed()))
+              for labels, client in clients if client.project.costs ])
+    name = 'dispense_client_result_latency_seconds'
+    lines.append('# HELP %s Seconds from dispatch to result, per client.' %
+        name)
+    lines.append('# TYPE %s summary' % name)
+    for labels, client in clients:
+        lines.append('%s_sum%s %r' % (name, labels, client.latency))
+        lines.append('%s_count%s %d' % (name, labels, client.completions))
+    lines.append('')
+    return '\n'.join(lines)
+
+
+def _metric(lines, name, type, help, samples):
+    'Appends a metric with (labels, value) \'samples\' to \'lines\'.'
+
+    lines.append('# HELP %s %s' % (name, help))
+    lines.append('# TYPE %s %s' % (name, type))
+    for labels, value in samples:
+        if isinstance(value, float):
+            lines.append('%s%s %r' % (name, labels, value))
+        else:
+            lines.append('%s%s %d' % (name, labels, value))
+
+
+def _labels(project, *pairs):
+    """Returns the labels of a sample of 'project', with the (name, value)
+'pairs' of further labels, in the Prometheus text format.
+
+Projects without an identifier, as served by the dispense tool itself, are not
+labelled, so that the metrics of a single project keep their labels."""
+
+    if project.id:
+        pairs = (('project', project.id),) + pairs
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join([ '%s="%s"' % pair for pair in pairs ])
+
+
+
+class Project:
+    """Dispensing state of a project, served by a project host (see run()).
+
+Work units are read from 'input', and results are written to 'output', or
+appended to 'result_log' if it is set. The project is served to the clients
+that connect to 'address', unless they select another project served there by
+its identifier (see _DispenseSession); a client that can compute several
+projects is connected to one of them in proportion to their 'share' (see
+select_project()). The other options are set as attributes as well, before the
+project is served; the rest of the attributes are the state of the work units,
+clients and output of the project, and the counters of its metrics.
+"""
+
+    def __init__(self, id = ''):
+        self.id             = id        # identifier by which clients select it
+        self.address        = ('', 3450)    # address to serve the project on
+        self.input          = sys.stdin
+        self.output         = sys.stdout
+        self.result_log     = None      # ResultLog for results, if any
+        self.multiple_results = False   # whether clients return several
+                                        # results per work unit
+        self.share          = 1.0       # share of clients computing several
+                                        # projects
+        self.costs          = False     # whether work units start with their
+                                        # cost
+        self.lookahead      = 1000      # number of work units read ahead with
+                                        # costs
+        self.max_copies     = 2         # maximum number of clients computing a
+                                        # work unit
+        self.deadline_slack = 2.0       # factor applied to expected
+                                        # completion times
+        self.replicas       = 1         # number of hosts that compute a
+                                        # verified work unit
+        self.quorum         = None      # number of matching results that
+                                        # complete a verified work unit
+                                        # (default: a majority)
+        self.verify_every   = 1         # interval of verified work units in
+                                        # the input
+        self.window         = 0         # maximum number of outstanding work
+                                        # units, if any
+        self.idle_timeout   = None      # seconds after which silent clients
+                                        # holding work units are disconnected
+        self.unit_timeout   = None      # seconds after which clients that have
+                                        # not completed a work unit are
+                                        # disconnected
+        self.sync_count     = None      # results after which output is synced
+        self.sync_interval  = None      # seconds after which output is synced
+        self.work_done      = None      # DigestSet of processed work units
+                                        # when resuming
+
+        self.work_buffered  = deque()   # locations of work units to be served
+                                        # first
+        self.work_pending   = {}        # key of outstanding work unit ->
+                                        # [sequence, location,
+                                        #  {client id: deadline}]
+        self.work_deadlines = []        # heap of (deadline, sequence, key)
+        self.work_sequence  = 0
+        self.work_beaten    = {}        # key of completed work unit -> ids of
+                                        # clients still computing it
+        self.work_served    = None      # time at which waiting sessions were
+                                        # last retried
+        self.work_waiting   = deque()   # sessions waiting for work units to
+                                        # become due
+        self.work_votes     = {}        # key of work unit being verified ->
+                                        # Votes
+        self.work_replicas  = deque()   # keys of verified work units needing
+                                        # more hosts
+        self.work_read      = 0         # number of work units read from input
+        self.work_read_ahead = 0        # number of work units read into
+                                        # work_lookahead
+        self.work_lookahead = []        # sorted (cost, -sequence, location) of
+                                        # work units read ahead with costs
+        self.work_unit_time = None      # estimated time per work unit over all
+                                        # clients
+        self.work_unit_cost = None      # average cost of completed work units
+        self.work_cost_latency = None   # average seconds per unit of cost over
+                                        # all clients
+        self.clients        = {}        # client id -> Client, for connected
+                                        # clients
+        self.fastest        = None      # (time, highest relative speed of
+                                        # clients)
+        self.input_done     = False     # whether the input has been read
+                                        # completely
+        self.input_offsets  = None      # whether work units are located by
+                                        # input offset
+        self.sync_deadline  = None      # time at which unsynced results must
+                                        # be synced
+        self.sync_serial    = 0         # number of times output has been
+                                        # synced
+        self.sync_waiting   = []        # sessions with replies deferred until
+                                        # the sync
+        self.work_unsynced  = 0         # number of results written since the
+                                        # last sync
+        self.work_written   = 0         # number of results written
+        self.work_skipped   = 0         # number of results skipped as
+                                        # duplicates
+        self.work_dispatched = 0        # number of work units dispatched
+        self.work_redispatched = 0      # number of those dispatched again
+                                        # while overdue
+        self.work_verified  = 0         # number of work units completed by a
+                                        # quorum
+        self.work_unverified = 0        # number of verified work units without
+                                        # a quorum
+        self.work_disagreements = 0     # number of results that disagreed with
+                                        # the quorum
+        self.latency_counts = [ 0 ] * (len(LATENCY_BOUNDS) + 1)
+                                        # work units completed per
+                                        # LATENCY_BOUNDS bucket
+        self.latency_sum    = 0.0       # total seconds from dispatch to result
+
+
+    def poll_timeout(self, now):
+        """Returns how long the event loop may wait, at most a second.
+
+It does not wait while replies are deferred until a sync, nor beyond the time
+unsynced results must be synced, or, while clients wait for work units, the
+next deadline of a work unit. Work units that were already due when the waiting
+clients were last retried could not be given to any of them, and only become
+available again when a client returns or drops them, so their deadlines are
+not waited for."""
+
+        timeout = 1
+        if self.sync_waiting:
+            timeout = 0
+        elif self.work_unsynced:
+            timeout = max(0, min(1, self.sync_deadline - now))
+        if self.work_waiting:
+            deadline = self.next_deadline(self.work_served)
+            if deadline is not None:
+                timeout = max(0, min(timeout, deadline - now))
+        return timeout
+
+
+    def after_poll(self, written):
+        """Serves waiting clients and syncs the output after a round of the
+event loop, before which 'work_written' was 'written'."""
+
+        if self.work_waiting and self.is_available(time.time()):
+            self._serve_waiting()
+        # Sync when due, or when clients are waiting for the sync and no more
+        # results have arrived
+        if self.work_unsynced and ((time.time() >= self.sync_deadline) or
+                (self.sync_waiting and (self.work_written == written))):
+            self.sync()
+
+
+    def _serve_waiting(self):
+        'Retries the requests of sessions waiting for work units.'
+
+        self.work_served = time.time()
+        for _ in xrange(len(self.work_waiting)):
+            session = self.work_waiting.popleft()
+            session.waiting = False
+            session.run_deferred()
+            if not self.is_available(time.time()):
+                break
+
+
+    def resume_from_file(self, results):
+        """Removes processed work units in 'results' from the input
+
+For each line starting with '>' in the 'results' file, the work unit is added
+to a DigestSet of processed work units; get_work() skips the corresponding
+lines when it reads them from input, and at the end of the input warns about
+processed work units that did not appear in it. Neither the input nor the
+results are held in memory."""
+
+        done = DigestSet()
+        for line in results:
+            if line[0] == ">":
+                done.add(line[1:-1])
+        done.freeze()
+        self.work_done = done
+
+
+    def resume_from_log(self, log):
+        """Removes processed work units in the result log 'log' from the input
+
+Like resume_from_file(), but reads the work unit digests from the records of
+an (open) result log, without hashing the work units again."""
+
+        done = DigestSet()
+        for record in resultlog.read_records(log):
+            done.add_digest(record[0])
+        done.freeze()
+        self.work_done = done
+
+
+    def _key(self, work):
+        """Returns the key that identifies 'work' in 'work_pending'.
+
+When work units are located by offset, only a digest of each outstanding work
+unit is kept in memory."""
+
+        if self.input_offsets:
+            return md5(work).digest()
+        return work
+
+
+    def _fetch(self, location):
+        '''Returns the work unit at 'location', which is either the work unit
+itself or the offset of the line in the input that contains it.'''
+
+        if isinstance(location, str):
+            return location
+        position = self.input.tell()
+        self.input.seek(location)
+        line = self.input.readline()
+        self.input.seek(position)
+        return line.rstrip('\n')
+
+
+    def _read_input(self):
+        """Reads the next unprocessed work unit from input.
+
+Returns a tuple of the work unit and its location, or (None, None) if the
+input is exhausted."""
+
+        while True:
+            if self.input_offsets:
+                location = self.input.tell()
+            line = self.input.readline()
             if not line:
+                if (self.work_done is not None) and not self.input_done:
+                    missing = self.work_done.unmatched()
+                    if missing:
+                        sys.stderr.write('Warning: %i processed work units do '
+                            'not appear in the input.\n' % missing)
+                self.input_done = True
+                return None, None
+            work = line.rstrip('\n')
+            if not work:
+                continue    # empty lines cannot be dispensed
+            if (self.work_done is None) or not self.work_done.match(work):
+                if not self.input_offsets:
+                    location = work
+                return work, location
+
+
+    def _read_costed(self, client, now):
+        """Reads the next work unit to dispatch to 'client', by cost.
+
+Up to 'lookahead' work units are read ahead and kept sorted by cost. The
+fastest clients are served the most costly of these, and slower clients work
+units that are cheaper in proportion to their speed relative to the fastest
+connected client (see Client.relative_speed()), so that costly work units are
+computed early and by fast clients, and the cheap ones are left for the end.
+Work units of the same cost are served in input order. Returns a tuple of the
+work unit and its location, or (None, None) if no work units are left."""
+
+        lookahead = self.work_lookahead
+        while (len(lookahead) < self.lookahead) and not self.input_done:
+            work, location = self._read_input()
+            if work is None:
                 break
-            work = line[:-1]
-            pending[work] = None
-        if done in pending:
-            del pending[done]
+            self.work_read_ahead += 1
+            bisect.insort(lookahead,
+                (_cost(work), -self.work_read_ahead, location))
+        if not lookahead:
+            return None, None
+        index = len(lookahead) - 1
+        if client is not None:
+            speed = min(1.0, client.relative_speed() / self._fastest(now))
+            index -= int((1.0 - speed) * index)
+        location = lookahead.pop(index)[2]
+        return self._fetch(location), location
+
+
+    def _fastest(self, now):
+        """Returns the highest relative speed of the connected clients.
+
+The value is computed again at most every FASTEST_AGE seconds."""
+
+        if (self.fastest is None) or (now - self.fastest[0] > FASTEST_AGE):
+            speeds = [ client.relative_speed()
+                       for client in self.clients.itervalues() ]
+            self.fastest = (now, max(speeds + [ 1e-9 ]))
+        return self.fastest[1]
+
+
+    def _dispatch(self, key, location, holders, client, now, work = None):
+        """Marks a work unit as outstanding at 'client' (which may be None).
+
+'holders' maps the ids of the clients the work unit is outstanding at to the
+time by which they are expected to complete it (with costs, in proportion to
+the cost of the work unit 'work'). Each dispatch gets a new
+sequence number, and an entry with the latest of these deadlines is pushed
+onto 'work_deadlines'; entries whose sequence number no longer matches
+'work_pending' are stale and are skipped (and eventually discarded) instead of
+being searched for and removed."""
+
+        if client is None:
+            holders[0] = now
+        else:
+            cost = None
+            if self.costs and (work is not None):
+                cost = _cost(work)
+            holders[client.id] = client.deadline(now, cost)
+        self._requeue(key, location, holders)
+
+
+    def _requeue(self, key, location, holders):
+        'Updates the sequence number and deadline of an outstanding work unit.'
+
+        self.work_sequence += 1
+        self.work_pending[key] = [ self.work_sequence, location, holders ]
+        deadline = 0
+        if holders:
+            deadline = max(holders.values())
+        heapq.heappush(self.work_deadlines,
+                       (deadline, self.work_sequence, key))
+
+
+    def _is_live(self, entry):
+        'Returns whether an entry of \'work_deadlines\' is not stale.'
+
+        _, sequence, key = entry
+        pending = self.work_pending.get(key)
+        return (pending is not None) and (pending[0] == sequence)
+
+
+    def _compact(self):
+        'Discards stale entries of \'work_deadlines\' if there are many.'
+
+        if len(self.work_deadlines) > 2*len(self.work_pending) + 1024:
+            self.work_deadlines[:] = [ entry for entry in self.work_deadlines
+                                       if self._is_live(entry) ]
+            heapq.heapify(self.work_deadlines)
+
+
+    def _overdue(self, client, now):
+        """Returns the key of a work unit to dispatch again, or None.
+
+This is the work unit with the earliest deadline that has passed, among those
+not outstanding at 'client' and outstanding at fewer than max_copies clients.
+Work units at max_copies clients are dropped from 'work_deadlines' until one of
+these clients completes them or disconnects. Verified work units may be
+outstanding at max_copies clients on top of their replicas, but not at the
+host of 'client' if they already are."""
+
+        deadlines = self.work_deadlines
+        skipped = []
+        try:
+            while deadlines and (deadlines[0][0] <= now):
+                entry = heapq.heappop(deadlines)
+                if not self._is_live(entry):
+                    continue
+                key = entry[2]
+                holders = self.work_pending[key][2]
+                votes = self.work_votes.get(key)
+                copies = self.max_copies
+                if copies and (votes is not None):
+                    copies += votes.needed - 1
+                if copies and (len(holders) >= copies):
+                    continue
+                if (client is not None) and ((client.id in holders) or
+                        ((votes is not None) and votes.has_host(client.host))):
+                    skipped.append(entry)
+                    continue
+                return key
+            return None
+        finally:
+            for entry in skipped:
+                heapq.heappush(deadlines, entry)
+
+
+    def _replica(self, client):
+        """Returns the key of a verified work unit for 'client', or None.
+
+This is the first work unit in 'work_replicas' that should be computed by
+another host, and that is not outstanding at or completed by the host of
+'client'. Entries for work units that no longer need other hosts are discarded;
+entries for the host of 'client' are skipped, up to REPLICA_SCAN of them."""
+
+        host = (client is not None) and client.host or None
+        replicas = self.work_replicas
+        skipped = []
+        try:
+            while replicas and (len(skipped) < REPLICA_SCAN):
+                key = replicas[0]
+                votes = self.work_votes.get(key)
+                if (votes is None) or not votes.wanted():
+                    replicas.popleft()
+                elif votes.has_host(host):
+                    skipped.append(replicas.popleft())
+                else:
+                    return key
+            return None
+        finally:
+            replicas.extendleft(reversed(skipped))
+
+
+    def _hold(self, key, client):
+        'Records that a verified work unit was dispatched to \'client\'.'
+
+        votes = self.work_votes.get(key)
+        if votes is None:
+            return
+        if client is None:
+            votes.holding[0] = None
+        else:
+            votes.holding[client.id] = client.host
+
+
+    def _unhold(self, key, votes, holder):
+        """Records that the client with id 'holder' no longer computes a
+verified work unit, without having returned results for it."""
+
+        votes.holding.pop(holder, None)
+        pending = self.work_pending.get(key)
+        if (pending is not None) and (holder in pending[2]):
+            del pending[2][holder]
+            self._requeue(key, pending[1], pending[2])
+        if votes.digest is not None:
+            if not votes.holding:
+                del self.work_votes[key]
+        elif votes.wanted():
+            self.work_replicas.append(key)
+
+
+    def _vote(self, key, votes, work, results, client):
+        """Adds the results returned by 'client' for a verified work unit.
+
+Returns the results to write if the work unit is now complete, or else None.
+Results that differ from those written are counted as disagreements."""
+
+        holder = (client is not None) and client.id or 0
+        host = (client is not None) and client.host or None
+        votes.holding.pop(holder, None)
+        digest = md5('\n'.join(sorted(results))).digest()
+        if votes.digest is not None:
+            if not votes.holding:
+                del self.work_votes[key]
+            if digest <> votes.digest:
+                self._disagree(client)
+            self.work_skipped += 1
+            return None
+
+        sequence, location, holders = self.work_pending[key]
+        holders.pop(holder, None)
+        if host in votes.voted:
+            self._requeue(key, location, holders)
+            self.work_skipped += 1      # each host has a single vote
+            return None
+        votes.voted.add(host)
+        group = votes.groups.setdefault(digest, [ results, [] ])
+        group[1].append(client)
+        if len(group[1]) >= self._quorum():
+            self.work_verified += 1
+        elif votes.holding or votes.wanted():
+            self._requeue(key, location, holders)
+            return None
+        elif votes.needed < 2 * max(self.replicas, self._quorum()):
+            votes.needed += 1           # no quorum yet; ask another host
+            self.work_replicas.append(key)
+            self._requeue(key, location, holders)
+            return None
+        else:
+            digest, group = max(votes.groups.items(),
+                                key = lambda item: len(item[1][1]))
+            self.work_unverified += 1
+            sys.stderr.write('Warning: no quorum for work unit "%s" after %i '
+                'hosts; writing the most common results.\n' %
+                (work, len(votes.voted)))
+
+        votes.digest = digest
+        for other, (_, clients) in votes.groups.items():
+            if other <> digest:
+                for other_client in clients:
+                    self._disagree(other_client)
+        votes.groups.clear()
+        del self.work_pending[key]
+        self._compact()
+        if not votes.holding:
+            del self.work_votes[key]
+        return group[0]
+
+
+    def _disagree(self, client):
+        'Counts results of \'client\' that differ from those of the quorum.'
+
+        self.work_disagreements += 1
+        if client is not None:
+            client.disagreements += 1
+
+
+    def _quorum(self):
+        'Returns the number of matching results that complete a verified unit.'
+
+        return self.quorum or (self.replicas // 2 + 1)
+
+
+    def get_work(self, client = None):
+        """Provides an unprocessed work unit for 'client' (a Client, or None).
+
+This first tries to read a new line of input from the input file. If no such
+line is available, or the window of outstanding work units is full, it instead
+returns a work unit that has been dispatched before, but that its clients are
+expected to have completed by now, based on how fast they return results (see
+Client). If no such work unit exists, None is returned; if is_done() then
+returns True, all input has been processed.
+
+If possible, outstanding work units are kept track of by their offset in the
+input file and read again when they are needed, so that memory usage does not
+depend on the size of the work units.
+
+Work units that are verified (see Votes) are served to other hosts before any
+new input is read, until enough hosts compute them. With costs, new input is
+served by cost instead of in input order (see _read_costed())."""
+
+        if self.input_offsets is None:
+            self.input_offsets = _seekable(self.input)
+
+        now = time.time()
+        work = location = None
+        verify = False
+        if self.work_buffered:
+            location = self.work_buffered.popleft()
+            work = self._fetch(location)
         else:
-            sys.stderr.write( 'Warning: processed work unit "%s" '
-                ' does not appear in the input.\n' % work )
-    global work_buffered
-    work_buffered = pending.keys()
-
-
-def get_work():
-    """Provides an unprocessed work unit.
-
-    This first tries to read a new line of input from the input file. If no
-    such line is available, it instead returns a line of input for which no
-    result has been returned yet. If no such line exists either, None is
-    returned, to indicate that all input has been processed."""
-
-    if work_buffered:
-        work = work_buffered.pop(0)
-    else:
-        line = input.readline()
-        if line:
-            work = line[:-1]
+            key = self.work_replicas and self._replica(client)
+            if key:
+                location = self.work_pending[key][1]
+                work = self._fetch(location)
+            elif (not self.window) or (len(self.work_pending) < self.window):
+                if self.costs:
+                    work, location = self._read_costed(client, now)
+                else:
+                    work, location = self._read_input()
+                if work is not None:
+                    self.work_read += 1
+                    verify = (self.replicas > 1) and \
+                             ((self.work_read - 1) % self.verify_every == 0)
+
+        if work is not None:
+            key = self._key(work)
+            pending = self.work_pending.get(key)
+            if pending is not None:
+                holders = pending[2]    # returned while others compute it
+            else:
+                holders = {}
+            if verify and not self.work_votes.has_key(key):
+                self.work_votes[key] = Votes(max(self.replicas,
+                                                 self._quorum()))
+                self.work_replicas.append(key)
+            self._dispatch(key, location, holders, client, now, work)
+            if self.work_votes:
+                self._hold(key, client)
         else:
-            work = None
+            key = self._overdue(client, now)
+            if key is not None:
+                _, location, holders = self.work_pending[key]
+                work = self._fetch(location)
+                self._dispatch(key, location, holders, client, now, work)
+                if self.work_votes:
+                    self._hold(key, client)
+                self.work_redispatched += 1
+        if work is not None:
+            self.work_dispatched += 1
+            if client is not None:
+                client.outstanding[work] = now
+        return work
+
+
+    def is_done(self):
+        'Returns whether all work units have been processed.'
+
+        return self.input_done and not (self.work_buffered or
+                                        self.work_pending or
+                                        self.work_lookahead)
+
+
+    def is_available(self, now):
+        """Returns whether get_work() may have a work unit at 'now', or whether
+is_done()."""
+
+        return (self.work_buffered or self.work_replicas or self.is_done() or
+                ((self.work_lookahead or not self.input_done) and
+                 ((not self.window) or
+                  (len(self.work_pending) < self.window))) or
+                (self.work_deadlines and (self.work_deadlines[0][0] <= now)))
+
+
+    def next_deadline(self, after = None):
+        """Returns the earliest time a work unit may become due, or None.
+
+If 'after' is given, only deadlines later than 'after' are considered. Since
+'work_deadlines' is a heap, only the entries due by then and their children
+are visited."""
+
+        deadlines = self.work_deadlines
+        if after is None:
+            if deadlines:
+                return deadlines[0][0]
+            return None
+        earliest = None
+        indices = [ 0 ]
+        while indices:
+            index = indices.pop()
+            if index >= len(deadlines):
+                continue
+            deadline = deadlines[index][0]
+            if deadline > after:
+                if (earliest is None) or (deadline < earliest):
+                    earliest = deadline
+            else:
+                indices.extend((2*index + 1, 2*index + 2))
+        return earliest
+
+
+    def return_work(self, work, client = None):
+        """Returns a dispensed but unprocessed work unit.
+
+The work unit is no longer considered to be pending at 'client'; unless it is
+still outstanding at other clients, it is the first work unit to be served by
+get_work() again."""
+
+        key = self._key(work)
+        pending = self.work_pending.get(key)
+        if client is not None:
+            client.outstanding.pop(work, None)
+        votes = self.work_votes.get(key)
+        if votes is not None:
+            self._unhold(key, votes, (client is not None) and client.id or 0)
+        elif pending is not None:
+            holders = pending[2]
+            holders.pop((client is not None) and client.id or 0, None)
+            if holders:
+                self._requeue(key, pending[1], holders)
+                return
+            del self.work_pending[key]
+            self.work_buffered.appendleft(pending[1])
+        else:
+            self.work_buffered.appendleft(work)
+
+
+    def release(self, client):
+        """Releases the work units outstanding at 'client', which disconnected.
+
+Work units that are no longer outstanding at any client are the first to be
+served by get_work() again."""
+
+        self.clients.pop(client.id, None)
+
+        for work in client.outstanding:
+            key = self._key(work)
+            votes = self.work_votes.get(key)
+            if votes is not None:
+                self._unhold(key, votes, client.id)
+                continue
+            beaten = self.work_beaten.get(key)
+            if beaten is not None:
+                beaten.discard(client.id)
+                if not beaten:
+                    del self.work_beaten[key]
+            pending = self.work_pending.get(key)
+            if (pending is not None) and (client.id in pending[2]):
+                holders = pending[2]
+                del holders[client.id]
+                if holders:
+                    self._requeue(key, pending[1], holders)
+                else:
+                    del self.work_pending[key]
+                    self.work_buffered.appendleft(pending[1])
+        client.outstanding.clear()
+
+
+    def put_work(self, addr, work, results, client = None):
+        """Stores a processed work unit and it's associated result or results.
+
+Results for a work unit that has already been completed by another client, to
+which it was dispatched again (see get_work()), are skipped. Results for a
+verified work unit are only written once a quorum of hosts agrees on them."""
+
+        key = self._key(work)
+        holder = (client is not None) and client.id or 0
+        votes = self.work_votes.get(key)
+        if votes is not None:
+            results = self._vote(key, votes, work, results, client)
+            if results is None:
+                return
+        elif self.work_pending.has_key(key):
+            holders = self.work_pending.pop(key)[2]
+            holders.pop(holder, None)
+            if holders:
+                self.work_beaten[key] = set(holders)
+            self._compact()
+        else:
+            beaten = self.work_beaten.get(key)
+            if (beaten is not None) and (holder in beaten):
+                beaten.discard(holder)
+                if not beaten:
+                    del self.work_beaten[key]
+                self.work_skipped += 1
+                return
+        if self.result_log is not None:
+            self.result_log.append(addr, work, results)
+        else:
+            host, port = addr
+            output = self.output
+            output.write('[%s] %s:%i\n' % (time.ctime(), host, port))
+            output.write('>%s\n' % work)
+            for result in results:
+                output.write('<%s\n' % result)
+        self.work_written += 1
+        if client is not None:
+            client.results += 1
+        if self.sync_interval is None:
+            (self.result_log or self.output).flush()
+            return
+        if not self.work_unsynced:
+            self.sync_deadline = time.time() + self.sync_interval
+        self.work_unsynced += 1
+        if self.sync_count and (self.work_unsynced >= self.sync_count):
+            self.sync()
+
+
+    def is_synced(self):
+        'Returns whether all results written so far have been synced.'
+
+        return not self.work_unsynced
+
+
+    def _sync_output(self):
+        'Flushes the output and writes it to disk.'
+
+        out = self.result_log or self.output
+        out.flush()
+        if self.sync_interval is not None:
+            try:
+                if self.result_log is not None:
+                    self.result_log.sync()
+                else:
+                    os.fsync(out.fileno())
+            except OSError:
+                pass    # e.g. a pipe, which cannot be synced
+        self.work_unsynced = 0
+        self.sync_serial += 1
+
+
+    def sync(self):
+        """Flushes the output, writes it to disk and sends deferred replies.
+
+When a sync policy is set (with sync_count and sync_interval), results are
+written as they arrive, but replies to the clients that returned them are
+deferred until the results have been written to disk. run() syncs after every
+sync_count results, sync_interval seconds after the first unsynced result, or
+as soon as replies are deferred and no more results are arriving. Since a
+reply tells a client that its results have been received, results that have
+been acknowledged are never lost, even if the host crashes."""
+
+        self._sync_output()
+        waiting = self.sync_waiting[:]
+        del self.sync_waiting[:]
+        for session in waiting:
+            session.handle_synced()
+
+
+
+class Client:
+    """Scheduling state of a computing client of 'project'.
+
+Keeps the work units dispatched to the client, with the time they were
+dispatched, and estimates the time the client takes per work unit from the
+intervals between its results (or, for a client that has been idle, between
+the dispatch of a work unit and its result). For a client that computes several
+work units at a time, this is the inverse of its throughput. A work unit that
+is dispatched to a client is expected to be completed after all work units
+outstanding at the client, and is considered overdue after deadline_slack times
+that expected time.
+
+The number of results and the time from dispatch to result of the work units
+completed by the client are kept for the metrics (see metrics_text()), as is
+the number of results that disagreed with the quorum of a verified work unit.
+Clients with the same 'host' address are the same host for verification.
+
+With costs, the average cost of the completed work units is kept as well, and
+the time per work unit is scaled by the cost of a work unit relative to this
+average. Clients may announce the number of work units they compute at a time,
+their platform and a relative speed (see announce()).
+"""
+
+    serial = 0
+
+    def __init__(self, project, host = None):
+        Client.serial += 1
+        self.id          = Client.serial
+        self.project     = project
+        self.host        = host
+        self.outstanding = {}      # work unit -> time dispatched
+        self.unit_time   = None    # estimated seconds per work unit
+        self.last_result = 0
+        self.results     = 0       # number of results written
+        self.latency     = 0.0     # total seconds from dispatch to result
+        self.completions = 0       # number of work units completed
+        self.disagreements = 0     # number of results outvoted by a quorum
+        self.cores       = 1       # announced work units computed at a time
+        self.platform    = None    # announced platform identifier
+        self.speed       = 1.0     # announced speed relative to others
+        self.unit_cost   = None    # average cost of completed work units
+        self.cost_latency = None   # estimated seconds per unit of cost
+        project.clients[self.id] = self
+
+
+    def announce(self, capabilities):
+        """Records the capabilities announced by the client.
+
+'capabilities' maps 'cores' to the number of work units the client computes at
+a time, 'platform' to its platform identifier and 'speed' to its speed relative
+to a typical client. Invalid values are ignored."""
+
+        try:
+            self.cores = max(1, int(capabilities.get('cores', self.cores)))
+        except ValueError:
+            pass
+        try:
+            speed = float(capabilities.get('speed', self.speed))
+            if speed > 0:
+                self.speed = speed
+        except ValueError:
+            pass
+        platform = capabilities.get('platform', '')
+        if platform and platform.replace('_', '').replace('.', '') \
+                                .replace('-', '').isalnum():
+            self.platform = platform
+
+
+    def relative_speed(self):
+        """Returns the speed of the client relative to a typical client.
+
+Once the client has completed work units with costs, this is the average time
+per unit of cost over all clients divided by that of this client; until then,
+it is the announced speed."""
+
+        work_cost_latency = self.project.work_cost_latency
+        if (self.cost_latency is None) or (work_cost_latency is None):
+            return self.speed
+        return work_cost_latency / max(self.cost_latency, 1e-9)
+
+
+    def deadline(self, now, cost = None):
+        """Returns when a work unit dispatched at 'now' becomes overdue.
+
+If 'cost' is given, the expected time is scaled by the cost of the work unit
+relative to the average cost of the completed work units."""
+
+        unit_time = self.unit_time
+        if unit_time is None:
+            unit_time = self.project.work_unit_time
+        if unit_time is None:
+            return now
+        if cost is not None:
+            unit_cost = self.unit_cost
+            if unit_cost is None:
+                unit_cost = self.project.work_unit_cost
+            if unit_cost:
+                unit_time *= cost / unit_cost
+        queue = len(self.outstanding) + 1
+        return now + self.project.deadline_slack * queue * unit_time
+
+
+    def completed(self, work, now):
+        'Updates the time per work unit estimates for a completed work unit.'
+
+        project = self.project
+        sent = self.outstanding.pop(work, None)
+        if sent is None:
+            return
+        interval = now - max(sent, self.last_result)
+        self.last_result = now
+        self.latency += now - sent
+        self.completions += 1
+        project.latency_counts[bisect.bisect_left(LATENCY_BOUNDS,
+                                                  now - sent)] += 1
+        project.latency_sum += now - sent
+        self.unit_time = _average(self.unit_time, interval)
+        project.work_unit_time = _average(project.work_unit_time, interval)
+        if project.costs:
+            cost = _cost(work)
+            self.unit_cost = _average(self.unit_cost, cost)
+            project.work_unit_cost = _average(project.work_unit_cost, cost)
+            if cost > 0:
+                latency = interval * self.cores / cost
+                self.cost_latency = _average(self.cost_latency, latency)
+                project.work_cost_latency = \
+                    _average(project.work_cost_latency, latency)
+
+
+
+class Votes:
+    """Verification state of a work unit that is computed by several hosts.
+
+The work unit is dispatched to clients at 'needed' different hosts: at first
+the number of replicas, and one more each time all of them returned results
+without a quorum agreeing (see Project.put_work()). Results are grouped by a
+digest of the sorted results, together with the clients that returned them;
+once the work unit is complete, only the digest of the results written is kept,
+until the clients still computing the work unit return or disconnect.
+"""
+
+    def __init__(self, needed):
+        self.holding = {}          # client id -> host, of clients computing it
+        self.voted   = set()       # hosts that returned results
+        self.groups  = {}          # results digest -> [ results, clients ]
+        self.needed  = needed
+        self.digest  = None        # digest of the results written, if complete
+
+
+    def has_host(self, host):
+        'Returns whether \'host\' computes or computed the work unit.'
+
+        return (host in self.voted) or (host in self.holding.itervalues())
+
+
+    def wanted(self):
+        'Returns whether the work unit should be dispatched to another host.'
+
+        hosts = self.voted.union(self.holding.itervalues())
+        return (self.digest is None) and (len(hosts) < self.needed)
+
+
+
+def _average(average, sample):
+    'Returns the exponentially weighted moving \'average\' with \'sample\'.'
+
+    if average is None:
+        return sample
+    return average + RATE_WEIGHT * (sample - average)
+
+
+
+class DigestSet:
+    """Compact set of work units, stored as fixed-width digests.
+
+Work units are hashed with MD5; the first two bytes of the hash select one of
+65536 buckets, and the next DIGEST_BITS bits are stored in the bucket as a
+double, which holds them exactly and takes 8 bytes on every platform. This
+takes little over 9 bytes per work unit, regardless of the size of the work
+units. All work units must be added before freeze() sorts the buckets;
+afterwards, membership is tested with a binary search, and match() records
+which work units were found, so that unmatched() can count the others.
+"""
+
+    def __init__(self):
+        self.buckets = [ array.array(DIGEST_TYPE) for _ in range(65536) ]
+        self.offsets = None     # index of the first digest of each bucket
+        self.matched = None     # for each digest, whether it was matched
 
-    if work:
-        work_pending.append(work)
-    elif work_pending:
-        work = work_pending.pop(0)
-        work_pending.append(work)
-    return work
 
+    def add(self, work):
+        'Adds the work unit \'work\' to the set.'
 
-def put_work(addr, work, results):
-    'Stores a processed work unit and it\'s associated result or results.'
+        self.add_digest(md5(work).digest())
 
-    if work in work_pending:
-        work_pending.remove(work)
-    host, port = addr
-    output.write('[%s] %s:%i\n' % (time.ctime(), host, port))
-    output.write('>%s\n' % work)
-    for result in results:
-        output.write('<%s\n' % result)
-    output.flush()
+
+    def add_digest(self, hash):
+        'Adds the work unit with MD5 digest \'hash\' to the set.'
+
+        index, value = _split_digest(hash)
+        self.buckets[index].append(value)
+
+
+    def freeze(self):
+        'Sorts the buckets; no work units may be added afterwards.'
+
+        self.offsets = array.array('L')
+        total = 0
+        for bucket in self.buckets:
+            bucket[:] = array.array(DIGEST_TYPE, sorted(set(bucket)))
+            self.offsets.append(total)
+            total += len(bucket)
+        self.matched = bytearray(total)
+
+
+    def _find(self, work):
+        'Returns the index of \'work\' among all digests, or None.'
+
+        index, value = _split_digest(md5(work).digest())
+        bucket = self.buckets[index]
+        i = bisect.bisect_left(bucket, value)
+        if (i < len(bucket)) and (bucket[i] == value):
+            return self.offsets[index] + i
+        return None
+
+
+    def __contains__(self, work):
+        return self._find(work) is not None
+
+
+    def match(self, work):
+        'Returns whether \'work\' is in the set, recording that it was found.'
+
+        i = self._find(work)
+        if i is None:
+            return False
+        self.matched[i] = 1
+        return True
+
+
+    def unmatched(self):
+        'Returns the number of work units not found by match() so far.'
+
+        return self.matched.count('\x00')
+
+
+    def __len__(self):
+        return sum([ len(bucket) for bucket in self.buckets ])
+
+
+
+def _split_digest(hash):
+    'Returns the DigestSet bucket index and value for the MD5 digest \'hash\'.'
+
+    index, value = DIGEST_STRUCT.unpack_from(hash)
+    return index, float(value >> (64 - DIGEST_BITS))
 
 
 
@@ -130,68 +1540,465 @@ class Dispenser(asyncore.dispatcher):
 
 A listening socket is bound and all incoming connections are dispatched onto
 _DispenseSession objects, which handle the connections for the individual
-computing clients.
+computing clients, for one of 'projects': the first, unless the client selects
+another. Clients that request work units in batches are served at most
+'max_batch' work units per request.
 """
 
-    def __init__(self, addr = ('', 3450), multiple_results = False):
+    def __init__(self, addr, projects, max_batch = 100):
         "Binds a listening socket on the given address 'addr'."
 
         asyncore.dispatcher.__init__(self)
-        self.multiple_results = multiple_results
+        self.projects  = projects
+        self.max_batch = max_batch
         self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.bind(addr)
         self.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.listen(1)
+        self.bind(addr)
+        self.listen(BACKLOG)
+
+
+    def add_channel(self, map = None):
+        asyncore.dispatcher.add_channel(self, map)
+        _watch(self._fileno)
+
+
+    def del_channel(self, map = None):
+        _unwatch(self._fileno)
+        asyncore.dispatcher.del_channel(self, map)
 
 
     def handle_accept(self):
-        _DispenseSession(self.accept(), self.multiple_results)
+        # Accept all waiting connections, up to a limit to remain responsive
+        for _ in xrange(ACCEPTS):
+            pair = self.accept()
+            if pair is None:
+                break
+            _DispenseSession(pair, self.projects, self.max_batch)
 
 
 
 class _DispenseSession(asynchat.async_chat):
-    'Connection to a single computing client.'
+    """Connection to a single computing client.
+
+A new session is sent a single work unit of the first of 'projects', after
+which the client returns its result (or results, terminated by an empty line)
+and is sent the next work unit, and so on.
+
+Alternatively, the client may negotiate batched operation by sending a HELLO
+line instead of the results for the first work unit, which is then returned to
+the queue and must be discarded by the client (if no work unit was sent yet,
+an empty line is sent in its place). The host then sends a HELLO line itself,
+so that the client can tell it from a host that does not support batched
+operation, which takes the HELLO for results. The HELLO may be followed by the
+capabilities of the client, as words of the form name=value (see
+Client.announce()), and by the identifiers of the projects that the client can
+compute, each as a word project=<id> (see select()). Afterwards, the client
+sends "!get <n>" to request up to <n> work units, which are sent as a batch of
+lines terminated by an empty line, and returns results for any work unit as a
+group of lines: ">" followed by the work unit, "<" followed by each result, and
+an empty line. Such clients may also send PING lines as a heartbeat; like all
+data received, these show the client is alive (see check_timeouts()). A client
+that stops hands back the work units it will not process by sending RETURN, a
+space and the work unit, for each of them.
+
+Clients that send lines longer than line_limit bytes, or results for a single
+work unit totalling more than group_limit bytes, are disconnected."""
+
+    ac_in_buffer_size = 65536
 
-    def __init__(self, (conn, addr), multiple_results = False):
+    def __init__(self, (conn, addr), projects, max_batch = 100):
         asynchat.async_chat.__init__(self, conn)
         self.addr             = addr
-        self.multiple_results = multiple_results
-        self.buffer           = ''
+        self.projects         = projects
+        self.project          = projects[0]
+        self.max_batch        = max_batch
+        self.buffer           = bytearray()
+        self.scanned          = 0
         self.results          = []
-        self.set_terminator('\r\n')
-        self.send_work()
+        self.results_size     = 0
+        self.first_line       = True
+        self.negotiated       = False
+        self.client           = Client(self.project, addr[0])
+        self.input            = None
+        self.work             = None
+        self.written          = -1
+        self.deferred         = deque()
+        self.syncing          = False
+        self.waiting          = False
+        self.last_seen        = time.time()
+        self.reply(self.send_work)
 
-    def collect_incoming_data(self, data):
-        self.buffer = self.buffer + data
+    def add_channel(self, map = None):
+        asynchat.async_chat.add_channel(self, map)
+        _watch(self._fileno)
 
-    def found_terminator(self):
+
+    def del_channel(self, map = None):
+        _unwatch(self._fileno)
+        asynchat.async_chat.del_channel(self, map)
+
+
+    def push(self, data):
+        asynchat.async_chat.push(self, data)
+        _watch(self._fileno)
+
+
+    def close(self):
+        self.project.release(self.client)
+        asynchat.async_chat.close(self)
+
+
+    def handle_read(self):
+        """Reads data from the client and processes the complete lines in it.
+
+This replaces the line splitting of async_chat, which copies the data it
+receives several times. Data is appended to a bytearray, which is searched for
+the terminator only from where the previous search ended, and lines are copied
+out of it once, through a memoryview, so that long lines arriving in many
+small segments are received in linear time."""
+
+        try:
+            data = self.recv(self.ac_in_buffer_size)
+        except socket.error:
+            self.handle_error()
+            return
+        self.last_seen = time.time()
+        buffer = self.buffer
+        buffer.extend(data)
+        view = memoryview(buffer)
+        start = 0
+        while self.connected:
+            end = buffer.find('\r\n', max(start, self.scanned))
+            if end < 0:
+                break
+            if end - start > line_limit:
+                break
+            line = view[start:end].tobytes()
+            start = end + 2
+            self.handle_line(line)
+        del view
+        del buffer[:start]
+        self.scanned = max(0, len(buffer) - 1)
+        if self.connected and (len(buffer) > line_limit):
+            sys.stderr.write('Warning: line longer than %i bytes received '
+                'from %s:%i; closing connection.\n' % ((line_limit,) +
+                self.addr))
+            self.close()
+
+
+    def handle_line(self, result):
         'Process a line of output from the computing client.'
 
-        result = self.buffer
-        if self.multiple_results:
+        if self.first_line:
+            self.first_line = False
+            if result.startswith(HELLO):
+                self.negotiated = True
+                capabilities = [ word.split('=', 1)
+                    for word in result[len(HELLO):].split() if '=' in word ]
+                if self.input:
+                    self.project.return_work(self.input, self.client)
+                else:
+                    self.deferred.clear()   # no work unit sent yet
+                    self.push('\r\n')
+                self.input = None
+                self.client.announce(dict(capabilities))
+                ids = [ value for name, value in capabilities
+                        if name == 'project' ]
+                if ids:
+                    self.select(ids)
+                if self.connected:
+                    self.push(HELLO + '\r\n')
+                return
+        if self.negotiated:
+            self.process_line(result)
+        elif self.project.multiple_results:
             if not result:
                 # All of multiple results received; send a new work unit
-                put_work(self.addr, self.input, self.results)
-                self.results = []
-                self.send_work()
+                self.put_work(self.input, self.results)
+                self.results      = []
+                self.results_size = 0
+                self.reply(self.send_work)
             else:
                 # Store this result
-                self.results.append(result)
+                self.add_result(result)
         else:
             # Single result received; send a new work unit
-            put_work(self.addr, self.input, [result])
-            self.send_work()
-        self.buffer = ''
+            self.put_work(self.input, [result])
+            self.reply(self.send_work)
+
+
+    def process_line(self, line):
+        'Process a line of output from a client that negotiated batching.'
+
+        if line.startswith(COMMAND):
+            words = line[len(COMMAND):].split()
+            if words[:1] == ['get'] and len(words) == 2 and words[1].isdigit():
+                self.reply(self.send_batch, min(int(words[1]), self.max_batch))
+            elif line == PING:
+                pass
+            elif line.startswith(RETURN + ' '):
+                work = line[len(RETURN) + 1:]
+                if work in self.client.outstanding:
+                    self.project.return_work(work, self.client)
+            else:
+                sys.stderr.write('Warning: unknown command "%s" received '
+                    'from %s:%i.\n' % ((line,) + self.addr))
+        elif line.startswith('>'):
+            self.work         = line[1:]
+            self.results      = []
+            self.results_size = 0
+        elif line.startswith('<'):
+            self.add_result(line[1:])
+        elif (line == '') and (self.work is not None):
+            self.put_work(self.work, self.results)
+            self.work         = None
+            self.results      = []
+            self.results_size = 0
+        else:
+            sys.stderr.write('Warning: unexpected line "%s" received '
+                'from %s:%i.\n' % ((line,) + self.addr))
+
+
+    def add_result(self, result):
+        'Adds a result for the current work unit, unless they grow too large.'
+
+        self.results.append(result)
+        self.results_size += len(result)
+        if self.results_size > group_limit:
+            sys.stderr.write('Warning: results larger than %i bytes received '
+                'from %s:%i; closing connection.\n' % ((group_limit,) +
+                self.addr))
+            self.close()
+
+
+    def select(self, ids):
+        """Moves the session to a project that the client selected.
+
+'ids' are the identifiers of the projects that the client can compute. Of these
+projects that are served on the address of the session and not yet done, the
+session is moved to the one chosen by select_project(); a project without an
+identifier can be selected by any. If there is none, the connection is
+closed."""
+
+        candidates = [ project for project in self.projects
+                       if ((not project.id) or (project.id in ids)) and
+                          not project.is_done() ]
+        if not candidates:
+            sys.stderr.write('Warning: project "%s" selected by %s:%i is not '
+                'served; closing connection.\n' % (('", "'.join(ids),) +
+                self.addr))
+            self.close()
+            return
+        project = select_project(candidates, self.client)
+        if project is not self.project:
+            if self.waiting:
+                self.project.work_waiting.remove(self)
+                self.waiting = False
+            self.project.release(self.client)
+            self.project = project
+            self.client.project = project
+            project.clients[self.client.id] = self.client
+
+
+    def put_work(self, work, results):
+        'Stores the results for a work unit returned by the client.'
+
+        self.client.completed(work, time.time())
+        self.project.put_work(self.addr, work, results, self.client)
+        self.written = self.project.sync_serial
+
+
+    def reply(self, method, *args):
+        """Calls 'method' with 'args' once this client's results are synced.
+
+Replies are deferred while results received from this client have not been
+synced, or while no work units are available for it (see run_deferred()), and
+are sent in order."""
+
+        self.deferred.append((method, args))
+        if len(self.deferred) == 1:
+            self.run_deferred()
+
+
+    def run_deferred(self):
+        """Sends deferred replies, as far as possible.
+
+A reply method returns False if no work units are available for this client;
+the session is then added to 'work_waiting', to be retried when work units
+may have become available."""
+
+        while self.deferred and self.connected:
+            if (self.written == self.project.sync_serial) and \
+               not self.project.is_synced():
+                if not self.syncing:
+                    self.syncing = True
+                    self.project.sync_waiting.append(self)
+                return
+            method, args = self.deferred[0]
+            if not method(*args):
+                if not self.waiting:
+                    self.waiting = True
+                    self.project.work_waiting.append(self)
+                return
+            self.deferred.popleft()
+
+
+    def handle_synced(self):
+        'Sends the replies deferred until the last sync.'
+
+        self.syncing = False
+        self.run_deferred()
 
 
     def send_work(self):
-        'Sends a new work unit to the connected computing client.'
+        """Sends a new work unit to the connected computing client.
 
-        self.input = get_work()
+Returns False if no work unit is available yet."""
+
+        self.input = self.project.get_work(self.client)
         if self.input <> None:
             self.push('%s\r\n' % self.input)
-        else:
+            self.last_seen = time.time()
+            return True
+        if self.project.is_done():
+            return self.project_done()
+        return False
+
+
+    def send_batch(self, count):
+        """Sends up to 'count' work units, terminated by an empty line.
+
+Fewer work units are sent if no more are available for this client, but a
+request for work units is not answered until at least one is available, in
+which case False is returned. Since lines are processed in order, the reply
+also tells the client that all results sent before the request have been
+received."""
+
+        batch = []
+        while len(batch) < count:
+            work = self.project.get_work(self.client)
+            if work is None:
+                break
+            batch.append('%s\r\n' % work)
+        if (count > 0) and not batch:
+            if self.project.is_done():
+                return self.project_done()
+            return False
+        batch.append('\r\n')
+        self.push(''.join(batch))
+        if len(batch) > 1:
+            self.last_seen = time.time()
+        return True
+
+
+    def project_done(self):
+        """Handles the project of the session being done, and returns True.
+
+The host stops once all its projects are done (see all_done()). Until then,
+the connection is closed, so that the client can connect again to compute
+another project, unless it has not sent anything yet: it may still select
+another project (see select())."""
+
+        if all_done():
             raise asyncore.ExitNow()
+        if not self.first_line:
+            self.close()
+        return True
+
+
+
+class MetricsListener(asyncore.dispatcher):
+    """Network service that serves the metrics of the project host.
+
+Each connection is answered with the output of metrics_text() and closed. An
+HTTP GET request (as made by Prometheus or a web browser) is sent an HTTP
+response; any other line, such as an empty one, is sent just the metrics."""
+
+    def __init__(self, addr):
+        "Binds a listening socket on the given address 'addr'."
+
+        asyncore.dispatcher.__init__(self)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.bind(addr)
+        self.listen(5)
+
+
+    def add_channel(self, map = None):
+        asyncore.dispatcher.add_channel(self, map)
+        _watch(self._fileno)
+
+
+    def del_channel(self, map = None):
+        _unwatch(self._fileno)
+        asyncore.dispatcher.del_channel(self, map)
+
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            _MetricsSession(pair[0])
+
+
+
+class _MetricsSession(asynchat.async_chat):
+    'Connection to a client of the MetricsListener.'
+
+    def __init__(self, conn):
+        asynchat.async_chat.__init__(self, conn)
+        self.set_terminator('\n')
+        self.line    = []
+        self.request = None
+        self.done    = False
+
+
+    def add_channel(self, map = None):
+        asynchat.async_chat.add_channel(self, map)
+        _watch(self._fileno)
+
+
+    def del_channel(self, map = None):
+        _unwatch(self._fileno)
+        asynchat.async_chat.del_channel(self, map)
+
+
+    def push(self, data):
+        asynchat.async_chat.push(self, data)
+        _watch(self._fileno)
+
+
+    def collect_incoming_data(self, data):
+        self.line.append(data)
+        if sum([ len(part) for part in self.line ]) > 8192:
+            self.close()
+
+
+    def found_terminator(self):
+        line = ''.join(self.line).rstrip('\r')
+        self.line = []
+        if self.done:
+            return
+        if self.request is None:
+            self.request = line
+            words = line.split()
+            if words[:1] == ['GET'] and words[-1:][0].startswith('HTTP/'):
+                return      # the response follows the request headers
+            self.respond(False)
+        elif not line:
+            self.respond(True)
+
+
+    def respond(self, http):
+        'Sends the metrics (with an HTTP header if \'http\') and closes.'
+
+        body = metrics_text(time.time())
+        if http:
+            self.push('HTTP/1.0 200 OK\r\n'
+                'Content-Type: text/plain; version=0.0.4\r\n'
+                'Content-Length: %d\r\n\r\n' % len(body))
+        self.push(body)
+        self.close_when_done()
+        self.done = True
 
 
 
@@ -203,12 +2010,19 @@ if __name__ == '__main__':
 
     server_host = ''
     server_port = 3450
-    multiple_results = False
+    max_batch = 100
+    log_path = None
+    project = Project()
 
     # Parse command line arguments
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'hmp:r:',
-            ['help', 'multiple', 'port=', 'resume='])
+        opts, args = getopt.getopt(sys.argv[1:],
+            'hmb:c:e:i:k:l:p:q:r:s:t:u:w:A:CG:L:M:P:',
+            ['help', 'multiple', 'batch=', 'copies=', 'every=',
+             'idle-timeout=', 'log=', 'port=', 'quorum=', 'replicas=',
+             'resume=', 'sync=', 'sync-interval=', 'unit-timeout=',
+             'window=', 'lookahead=', 'costs', 'max-group=', 'max-line=',
+             'metrics=', 'project='])
     except getopt.GetoptError, message:
         sys.stderr.write('Error: %s.\n' % message)
         usage(2)
@@ -221,19 +2035,120 @@ if __name__ == '__main__':
             except ValueError:
                 sys.stderr.write('Warning: invalid port argument; ignored.\n')
         if opt in ('-m', '--multiple'):
-            multiple_results = True
+            project.multiple_results = True
+        if opt in ('-b', '--batch'):
+            try:
+                max_batch = max(1, int(arg))
+            except ValueError:
+                sys.stderr.write('Warning: invalid batch argument; ignored.\n')
+        if opt in ('-s', '--sync'):
+            try:
+                project.sync_count = max(1, int(arg))
+            except ValueError:
+                sys.stderr.write('Warning: invalid sync argument; ignored.\n')
+        if opt in ('-t', '--sync-interval'):
+            try:
+                project.sync_interval = max(0, int(arg)) / 1000.0
+            except ValueError:
+                sys.stderr.write('Warning: invalid sync interval argument; '
+                    'ignored.\n')
+        if opt in ('-w', '--window'):
+            try:
+                project.window = max(0, int(arg))
+            except ValueError:
+                sys.stderr.write('Warning: invalid window argument; '
+                    'ignored.\n')
+        if opt in ('-l', '--log'):
+            log_path = arg
+        if opt in ('-c', '--copies'):
+            try:
+                project.max_copies = max(0, int(arg))
+            except ValueError:
+                sys.stderr.write('Warning: invalid copies argument; '
+                    'ignored.\n')
+        if opt in ('-L', '--max-line'):
+            try:
+                line_limit = max(1, int(arg)) << 20
+            except ValueError:
+                sys.stderr.write('Warning: invalid maximum line length; '
+                    'ignored.\n')
+        if opt in ('-G', '--max-group'):
+            try:
+                group_limit = max(1, int(arg)) << 20
+            except ValueError:
+                sys.stderr.write('Warning: invalid maximum result size; '
+                    'ignored.\n')
+        if opt in ('-M', '--metrics'):
+            try:
+                metrics_port = int(arg)
+            except ValueError:
+                sys.stderr.write('Warning: invalid metrics port argument; '
+                    'ignored.\n')
+        if opt in ('-i', '--idle-timeout'):
+            try:
+                project.idle_timeout = max(0, float(arg)) or None
+            except ValueError:
+                sys.stderr.write('Warning: invalid idle timeout; ignored.\n')
+        if opt in ('-u', '--unit-timeout'):
+            try:
+                project.unit_timeout = max(0, float(arg)) or None
+            except ValueError:
+                sys.stderr.write('Warning: invalid unit timeout; ignored.\n')
+        if opt in ('-k', '--replicas'):
+            try:
+                project.replicas = max(1, int(arg))
+            except ValueError:
+                sys.stderr.write('Warning: invalid replicas argument; '
+                    'ignored.\n')
+        if opt in ('-q', '--quorum'):
+            try:
+                project.quorum = max(0, int(arg)) or None
+            except ValueError:
+                sys.stderr.write('Warning: invalid quorum argument; '
+                    'ignored.\n')
+        if opt in ('-e', '--every'):
+            try:
+                project.verify_every = max(1, int(arg))
+            except ValueError:
+                sys.stderr.write('Warning: invalid every argument; '
+                    'ignored.\n')
+        if opt in ('-C', '--costs'):
+            project.costs = True
+        if opt in ('-A', '--lookahead'):
+            try:
+                project.lookahead = max(1, int(arg))
+            except ValueError:
+                sys.stderr.write('Warning: invalid lookahead argument; '
+                    'ignored.\n')
+        if opt in ('-P', '--project'):
+            project.id = arg
         if opt in ('-r', '--resume'):
             try:
-                resume_from_file(file(arg))
+                if resultlog.is_result_log(arg):
+                    project.resume_from_log(file(arg, 'rb'))
+                else:
+                    project.resume_from_file(file(arg))
             except IOError, e:
-                sys.stderr.write('Could not read file "%s": %s.\n', arg, e)
+                sys.stderr.write('Could not read file "%s": %s.\n' % (arg, e))
                 sys.exit(2)
     if len(args) <> 0:
         sys.stderr.write('Error: exactly zero arguments required.\n')
         usage(2)
 
+    if (project.sync_count <> None) and (project.sync_interval is None):
+        project.sync_interval = 1.0
+
+    if log_path <> None:
+        try:
+            project.result_log = resultlog.ResultLog(log_path)
+        except IOError, e:
+            sys.stderr.write('Could not open result log "%s": %s.\n' %
+                (log_path, e))
+            sys.exit(2)
+
     # Start server
-    run((server_host, server_port), multiple_results)
+    project.address = (server_host, server_port)
+    run([ project ], max_batch)
 
 
 # EOF
@@ -4,11 +4,27 @@
 # Imported modules
 #
 
+import errno
 import getopt
 import os
+import random
 import socket
+import subprocess
 import sys
+import threading
 import time
+from collections import deque
+
+
+#
+# Global constants
+#
+
+IO_MODES  = ('pipe', 'pty', 'framed', 'python')    # see start_application()
+READ_SIZE = 65536           # bytes of application output read at a time
+
+RECONNECT_DELAY = 0.1       # seconds before reconnecting the first time
+RECONNECT_MAX   = 600       # maximum seconds between reconnection attempts
 
 
 #
@@ -28,8 +44,36 @@ Available options:
     -h, --help:         show this description
     -p<n>, --port=<n>:  connect to server on port <n> (default: 3450)
     -m, --multiple:     expect multiple computation results per work unit
+    -b<n>, --batch=<n>: request <n> work units at a time (default: 1)
+    -f<n>, --prefetch=<n>:
+                        fetch up to <n> work units ahead while computing
+                        (default: 0)
+    -j<n>, --jobs=<n>:  run <n> instances of the computing application
+                        (default: number of processors)
+    -H<n>, --heartbeat=<n>:
+                        send a heartbeat to the host after <n> seconds
+                        without other traffic (default: none)
+    -i<io>, --io=<io>:  communicate with the computing application through
+                        "pipe" (lines of text; the default), "pty" (lines
+                        of text, through a pseudo-terminal, for applications
+                        that do not flush their output), "framed"
+                        (length-prefixed frames) or "python" (<command> is
+                        a Python function, as module:function)
+    -S<n>, --speed=<n>: announce a speed of <n> times that of a typical
+                        client to the host
+    -P<id>, --project=<id>:
+                        compute the project <id> of a host that serves
+                        several projects; may be given more than once if
+                        the computing application computes several
     -n<n>, --nice=<n>:  set niceness level increment (default: 10)
     -v, --verbose:      be verbose
+
+With more than one instance of the computing application (the default on a
+system with several processors), or with -b, -f, -H, -S or -P, enact negotiates
+batched operation, which requires a host running the dispense tool of the same
+release as enact. Earlier hosts take the negotiation for the result of a work
+unit; enact then stops with an error naming that work unit, which must be
+computed again. Use -j 1 with such hosts.
 """
     sys.exit(code)
 
@@ -65,40 +109,226 @@ wether or not it makes sense to try to restart the application.
         self.retry = retry
         
     def __str__(self):
-        return `self.value`
+        return `self.value`
 
 
 
 class Connection:
-    'Represents a connection to a project host.'
+    """Represents a connection to a project host.
+
+If 'batch' is greater than one, batched operation is negotiated with the host:
+work units are requested 'batch' at a time, and the results for a batch are
+returned to the host in a single write, together with the next request.
+
+If 'heartbeat' is set, batched operation is negotiated as well, and a thread
+sends a heartbeat to the host whenever nothing else was sent for 'heartbeat'
+seconds, so that the host knows the client is alive while it is computing.
+
+If 'capabilities' is given, it is a list of (name, value) pairs that are
+announced to the host when batched operation is negotiated, such as the number
+of work units computed at a time ('cores'), the platform, the relative speed of
+the client and the projects it computes ('project', once for each). If it
+includes a speed or a project, batched operation is always negotiated.
+
+The methods negotiate(), request_work(), read_batch(), send_results() and
+flush() implement the batched protocol for callers (such as the Pipeline class)
+that need more control over when work units are requested.
+"""
     
-    def __init__(self, server_addr, multiple_results = False):
+    def __init__(self, server_addr, multiple_results = False, batch = 1,
+                 heartbeat = None, capabilities = None):
         "Initializes a connection to a project host on 'server_addr'."
         
         self.socket = None
         self.connection = None
         self.server_addr = server_addr
         self.multiple_results = multiple_results
+        self.batch = batch
+        self.capabilities = capabilities or []
+        self.work = []
+        self.current = None
+        self.negotiated = False
+        self.lock = threading.Lock()        # serializes writes
+        self.closed = threading.Event()
+        self.last_sent = time.time()
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect(self.server_addr)
             self.connection = self.socket.makefile('r+')
         except Exception, value:
             raise ConnectionFailure(value, True)
+        names = [ name for name, _ in self.capabilities ]
+        if (self.batch > 1) or heartbeat or ('speed' in names) or \
+           ('project' in names):
+            self.negotiate()
+        if heartbeat:
+            thread = threading.Thread(target = self._heartbeat,
+                args = (heartbeat,))
+            thread.setDaemon(True)
+            thread.start()
 
 
-    def get_work(self):
-        'Gets a new unit of work from the server (blocks if not available).'
+    def _readline(self):
+        'Reads a line sent by the host, without the line terminator.'
 
         try:
-            return self.connection.readline().rstrip('\r\n')
+            line = self.connection.readline()
         except Exception, value:
             raise ConnectionFailure(value, True)
+        if not line:
+            raise ConnectionFailure('connection closed by host', True)
+        return line.rstrip('\r\n')
+
+
+    def _write(self, data):
+        'Writes (buffered) data to the host.'
+
+        self.lock.acquire()
+        try:
+            try:
+                self.connection.write(data)
+            except Exception, value:
+                raise ConnectionFailure(value, True)
+        finally:
+            self.lock.release()
+
+
+    def _heartbeat(self, interval):
+        'Sends a heartbeat after \'interval\' seconds without other traffic.'
+
+        while not self.closed.isSet():
+            self.lock.acquire()
+            try:
+                delay = self.last_sent + interval - time.time()
+                if delay <= 0:
+                    try:
+                        self.connection.write('!ping\r\n')
+                        self.connection.flush()
+                    except Exception:
+                        return      # noticed by the reading thread
+                    self.last_sent = time.time()
+                    delay = interval
+            finally:
+                self.lock.release()
+            self.closed.wait(delay)
+
+
+    def negotiate(self):
+        """Negotiates batched operation with the host.
+
+A host that does not support batched operation takes the HELLO for the result
+of the first work unit; since continuing would write every request into its
+output as well, a ConnectionFailure is raised that is not retried."""
+
+        # The host sends a single work unit before it knows we want batches;
+        # it is put back in the queue, so we discard it.
+        self._write('!hello%s\r\n' % ''.join([ ' %s=%s' % capability
+            for capability in self.capabilities ]))
+        self.flush()
+        work = self._readline()
+        if self._readline() <> '!hello':
+            raise ConnectionFailure('host does not support batched '
+                'operation (see enact -h); it took the HELLO line for the '
+                'result of work unit "%s"' % work)
+        self.negotiated = True
+
+
+    def request_work(self, count):
+        'Requests up to \'count\' more work units from the host.'
+
+        self._write('!get %d\r\n' % count)
+
+
+    def read_batch(self):
+        'Reads a batch of work units sent by the host (blocks until received).'
+
+        batch = []
+        work = self._readline()
+        while work:
+            batch.append(work)
+            work = self._readline()
+        return batch
+
+
+    def send_results(self, work, results):
+        'Writes the results for the work unit \'work\' to the host.'
+
+        lines = [ '>%s\r\n' % work ]
+        lines.extend([ '<%s\r\n' % result for result in results ])
+        lines.append('\r\n')
+        self._write(''.join(lines))
+
+
+    def flush(self):
+        'Sends all buffered data to the host.'
+
+        self.lock.acquire()
+        try:
+            try:
+                self.connection.flush()
+            except Exception, value:
+                raise ConnectionFailure(value, True)
+            self.last_sent = time.time()
+        finally:
+            self.lock.release()
+
+
+    def hand_back(self, work = None, units = ()):
+        """Returns unprocessed work units to the host, before closing.
+
+The work unit 'work' (unless None), the work units in 'units' and those that
+were received but not processed yet are returned, if batched operation was
+negotiated; otherwise, the host takes them back when the connection is closed.
+Failures are ignored."""
+
+        if not self.negotiated:
+            return
+        units = list(units) + self.work
+        if work is not None:
+            units.insert(0, work)
+        self.work = []
+        try:
+            if units:
+                self._write(''.join([ '!return %s\r\n' % unit
+                                      for unit in units ]))
+            self.flush()
+        except ConnectionFailure:
+            pass
+
+
+    def close(self):
+        'Closes the connection, interrupting any threads blocked on it.'
+
+        self.closed.set()
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.socket.close()
+
+
+    def get_work(self):
+        'Gets a new unit of work from the server (blocks if not available).'
+
+        if not self.negotiated:
+            return self._readline()
+
+        while not self.work:
+            self.request_work(self.batch)
+            self.flush()
+            self.work = self.read_batch()
+        self.current = self.work.pop(0)
+        return self.current
 
 
     def put_results(self, results):
         'Returns the results for the last unit of work to the server.'
 
+        if self.negotiated:
+            # Written out together with the next request in get_work()
+            self.send_results(self.current, results)
+            return
+
         try:
             for result in results:
                 self.connection.write('%s\r\n' % result)
@@ -110,25 +340,293 @@ class Connection:
 
 
 
+class Pipeline:
+    """Fetches work units ahead of time and returns results in the background.
+
+A reader thread receives work units from the host while a writer thread
+returns results, so that up to 'depth' work units are queued locally while
+'workers' threads (each running a computing application) process others.
+Returned results are kept until the host has answered a request that was sent
+after them; if the connection fails before that, they are resubmitted when
+connect() is called again. Work units already received remain available while
+reconnecting. If 'heartbeat' is set, heartbeats are sent as by Connection, and
+'capabilities' are announced as by Connection. The delay before reconnecting
+is kept in 'delay', and is reset once a connection delivers work units.
+"""
+
+    def __init__(self, server_addr, multiple_results = False, depth = 1,
+                 workers = 1, heartbeat = None, capabilities = None):
+        self.server_addr      = server_addr
+        self.multiple_results = multiple_results
+        self.depth            = depth
+        self.workers          = workers
+        self.heartbeat        = heartbeat
+        self.capabilities     = capabilities
+        self.lock      = threading.Condition()
+        self.conn      = None
+        self.failure   = None
+        self.error     = None       # last error of a retired worker
+        self.work      = deque()    # received work units
+        self.results   = deque()    # (work, results) to be sent
+        self.unacked   = deque()    # (sequence, work, results) sent
+        self.requests  = deque()    # (count, sequence) of requests sent
+        self.sequence  = 0          # number of result groups sent
+        self.requested = 0          # number of work units requested
+        self.busy      = 0          # number of work units being processed
+        self.kick      = False      # writer must request work units
+        self.delay     = RECONNECT_DELAY    # see _reconnect_delay()
+
+
+    def connect(self):
+        'Connects to the host and starts the reader and writer threads.'
+
+        conn = Connection(self.server_addr, self.multiple_results,
+            heartbeat = self.heartbeat, capabilities = self.capabilities)
+        if not conn.negotiated:
+            conn.negotiate()
+        self.lock.acquire()
+        try:
+            self.conn    = conn
+            self.failure = None
+            while self.unacked:
+                _, work, results = self.unacked.pop()
+                self.results.appendleft((work, results))
+            self.requests.clear()
+            self.requested = 0
+            self.kick      = True
+            self.lock.notifyAll()
+        finally:
+            self.lock.release()
+        for target in (self._reader, self._writer):
+            thread = threading.Thread(target = target, args = (conn,))
+            thread.setDaemon(True)
+            thread.start()
+
+
+    def wait(self):
+        """Blocks until the connection fails and raises its ConnectionFailure.
+
+If all workers have retired instead, the error of the last one is raised."""
+
+        self.lock.acquire()
+        try:
+            while not (self.failure or (self.workers <= 0)):
+                self.lock.wait()
+            if self.workers <= 0:
+                raise self.error
+            raise self.failure
+        finally:
+            self.lock.release()
+
+
+    def close(self):
+        """Returns the results and unprocessed work units, and disconnects.
+
+Results that were not sent yet are sent first. Work units being processed are
+taken back by the host when the connection is closed."""
+
+        self.lock.acquire()
+        try:
+            conn      = self.conn
+            self.conn = None
+            results   = list(self.results)
+            units     = list(self.work)
+            self.results.clear()
+            self.work.clear()
+            self.lock.notifyAll()
+        finally:
+            self.lock.release()
+        if conn:
+            try:
+                for work, work_results in results:
+                    conn.send_results(work, work_results)
+            except ConnectionFailure:
+                pass
+            conn.hand_back(units = units)
+            conn.close()
+
+
+    def retire(self, error):
+        'Reports that a worker stopped working because of \'error\'.'
+
+        self.lock.acquire()
+        try:
+            self.workers -= 1
+            self.error    = error
+            self.lock.notifyAll()
+        finally:
+            self.lock.release()
+
+
+    def get_work(self):
+        """Gets a new unit of work (blocks if not available).
+
+While the connection is down, this keeps blocking until connect() succeeds
+and new work units are received."""
+
+        self.lock.acquire()
+        try:
+            while not self.work:
+                self.lock.wait()
+            self.busy += 1
+            return self.work.popleft()
+        finally:
+            self.lock.release()
+
+
+    def put_results(self, work, results):
+        'Queues the results for the work unit \'work\' to be returned.'
+
+        self.lock.acquire()
+        try:
+            self.busy -= 1
+            self.results.append((work, results))
+            self.lock.notifyAll()
+        finally:
+            self.lock.release()
+
+
+    def cancel(self, work):
+        'Puts back a work unit that could not be processed at the front.'
+
+        self.lock.acquire()
+        try:
+            self.busy -= 1
+            self.work.appendleft(work)
+        finally:
+            self.lock.release()
+
+
+    def _fail(self, conn, failure):
+        'Records a failure of the connection \'conn\' and closes it.'
+
+        self.lock.acquire()
+        try:
+            if conn is self.conn:
+                self.conn    = None
+                self.failure = failure
+                self.lock.notifyAll()
+        finally:
+            self.lock.release()
+        conn.close()
+
+
+    def _reader(self, conn):
+        'Receives work units from the host.'
+
+        try:
+            while True:
+                batch = conn.read_batch()
+                self.lock.acquire()
+                try:
+                    if conn is not self.conn:
+                        return
+                    count, sequence = self.requests.popleft()
+                    self.requested -= count
+                    while self.unacked and self.unacked[0][0] <= sequence:
+                        self.unacked.popleft()
+                    self.work.extend(batch)
+                    if batch:
+                        self.delay = RECONNECT_DELAY
+                    self.lock.notifyAll()
+                finally:
+                    self.lock.release()
+        except ConnectionFailure, e:
+            self._fail(conn, e)
+
+
+    def _writer(self, conn):
+        'Returns results to the host and requests new work units.'
+
+        try:
+            while True:
+                self.lock.acquire()
+                try:
+                    while (conn is self.conn) and \
+                          not (self.results or self.kick):
+                        self.lock.wait()
+                    if conn is not self.conn:
+                        return
+                    self.kick = False
+                    sent = list(self.results)
+                    self.results.clear()
+                    for work, results in sent:
+                        self.sequence += 1
+                        self.unacked.append((self.sequence, work, results))
+                    count = self.depth + self.workers - self.busy \
+                        - len(self.work) - self.requested
+                    count = max(count, 0)
+                    self.requests.append((count, self.sequence))
+                    self.requested += count
+                finally:
+                    self.lock.release()
+
+                # Even when no work units are needed, the request serves to
+                # have the host acknowledge the results sent before it.
+                for work, results in sent:
+                    conn.send_results(work, results)
+                conn.request_work(count)
+                conn.flush()
+        except ConnectionFailure, e:
+            self._fail(conn, e)
+
+
+
 class Application:
-    'Represents a running computing application.'
+    """Represents a running computing application.
 
-    def __init__(self, command, multiple_results = False):
+The application reads work units from its standard input and writes results to
+its standard output, according to 'io':
+    'pipe'      work units and results are lines of text, and the application
+                must flush its output after each work unit;
+    'pty'       as 'pipe', but the standard output of the application is a
+                pseudo-terminal, so that applications that use the C standard
+                library flush each line by themselves (not under Windows);
+    'framed'    work units and results are sent as frames: the length of the
+                data in bytes, a line feed and the data itself. With multiple
+                results, an empty frame follows the results of a work unit.
+The output is read from the pipe in blocks, as soon as it is available.
+"""
+
+    def __init__(self, command, multiple_results = False, io = 'pipe'):
         "Starts a process with the given 'command'."
         
+        if io not in ('pipe', 'pty', 'framed'):
+            raise ApplicationFailure('unknown application I/O "%s"' % io)
+        self.multiple_results = multiple_results
+        self.framed = (io == 'framed')
+        self.buffer = ''
+        self.pos    = 0
         try:
-            self.cmd_in, self.cmd_out = os.popen2(command, 't')
+            if io == 'pty':
+                import pty, tty
+                self.fd, slave = pty.openpty()
+                tty.setraw(slave)
+                try:
+                    self.process = subprocess.Popen(command, shell = True,
+                        stdin = subprocess.PIPE, stdout = slave,
+                        close_fds = True)
+                finally:
+                    os.close(slave)
+            else:
+                self.process = subprocess.Popen(command, shell = True,
+                    stdin = subprocess.PIPE, stdout = subprocess.PIPE,
+                    close_fds = (os.name == 'posix'))
+                self.fd = self.process.stdout.fileno()
         except Exception, value:
             raise ApplicationFailure(value)
-        self.multiple_results = multiple_results
 
 
     def put_work(self, work):
         'Sends a work unit to the computing application.'
         
+        if self.framed:
+            data = '%i\n%s' % (len(work), work)
+        else:
+            data = '%s\n' % work
         try:
-            self.cmd_in.write('%s\n' % work)
-            self.cmd_in.flush()
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
         except Exception, value:
             raise ApplicationFailure(value, True)
         
@@ -136,79 +634,424 @@ class Application:
     def get_results(self):
         'Gets the computation results from the computing application.'
         
-        line = self.cmd_out.readline()
-        result = line.rstrip('\n')
+        if self.framed:
+            read = self._read_frame
+        else:
+            read = self._read_line
+        result = read()
         if self.multiple_results:
             results = []
             while result:
                 results.append(result)
-                line = self.cmd_out.readline()
-                result = line.rstrip('\n')
+                result = read()
         else:
             results = [result]
-        if not line:
-            raise ApplicationFailure('computing application terminated', True)
         return results
 
 
+    def _fill(self):
+        """Reads the output that is available into the buffer.
+
+Returns False if the application closed its standard output."""
+
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except OSError, error:
+            if error.errno <> errno.EIO:    # EIO: pseudo-terminal closed
+                raise ApplicationFailure(error, True)
+            data = ''
+        if not data:
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+
+    def _read_line(self):
+        'Reads a line of output, without the line terminator.'
+
+        start = self.pos
+        end = self.buffer.find('\n', start)
+        while end < 0:
+            start = len(self.buffer) - self.pos
+            if not self._fill():
+                if self.pos >= len(self.buffer):
+                    raise ApplicationFailure(
+                        'computing application terminated', True)
+                end = len(self.buffer)      # last line without terminator
+                break
+            end = self.buffer.find('\n', start)
+        line = self.buffer[self.pos:end]
+        self.pos = end + 1
+        if line.endswith('\r'):
+            line = line[:-1]
+        return line
+
+
+    def _read_frame(self):
+        'Reads a frame of output.'
+
+        try:
+            size = int(self._read_line())
+        except ValueError:
+            raise ApplicationFailure('invalid frame length', True)
+        while len(self.buffer) - self.pos < size:
+            if not self._fill():
+                raise ApplicationFailure('computing application terminated',
+                    True)
+        data = self.buffer[self.pos:self.pos + size]
+        self.pos += size
+        if '\n' in data:
+            raise ApplicationFailure('line feed in result', True)
+        return data
+
+
+    def close(self):
+        'Closes the standard input and output of the computing application.'
+
+        try:
+            self.process.stdin.close()
+            if self.process.stdout:
+                self.process.stdout.close()
+            else:
+                os.close(self.fd)
+        except (IOError, OSError):
+            pass
+
+
+
+class Function:
+    """Represents a computing application that is a Python function.
+
+The command 'target' names the function as 'module:function'; the module is
+imported from the current directory or the Python path. The function is called
+with a work unit and returns its result, or a list of results when working
+with multiple results (empty results are left out). Exceptions raised by the
+function are raised as a retryable ApplicationFailure.
+
+If 'process' is set, the function is called by a separate worker process
+(see _serve()) instead of in this process, so that several functions can run
+in parallel.
+"""
+
+    def __init__(self, target, multiple_results = False, process = False):
+        "Imports the function 'target' and starts the worker process."
+
+        self.target = target
+        self.multiple_results = multiple_results
+        self.process = None
+        self.work = None
+        try:
+            self.function = _resolve(target)
+            if process:
+                import multiprocessing
+                self.conn, child_conn = multiprocessing.Pipe()
+                self.process = multiprocessing.Process(target = _serve,
+                    args = (target, child_conn))
+                self.process.daemon = True
+                self.process.start()
+                child_conn.close()
+        except Exception, value:
+            raise ApplicationFailure(value)
+
+
+    def put_work(self, work):
+        'Sends a work unit to the function.'
+
+        self.work = work
+        if self.process:
+            try:
+                self.conn.send(work)
+            except (IOError, OSError), value:
+                raise ApplicationFailure(value, True)
+
+
+    def get_results(self):
+        'Gets the results of the function for the work unit.'
+
+        if self.process:
+            try:
+                ok, value = self.conn.recv()
+            except (EOFError, IOError, OSError):
+                raise ApplicationFailure('computing application terminated',
+                    True)
+            if not ok:
+                raise ApplicationFailure(value, True)
+        else:
+            try:
+                value = self.function(self.work)
+            except Exception, value:
+                raise ApplicationFailure(value, True)
+        if self.multiple_results:
+            results = [ str(result) for result in value if result <> '' ]
+        else:
+            results = [ str(value) ]
+        for result in results:
+            if '\n' in result:
+                raise ApplicationFailure('line feed in result', True)
+        return results
+
+
+    def close(self):
+        'Stops the worker process, if any.'
+
+        if self.process:
+            self.conn.close()
+            self.process.join(1)
+            if self.process.is_alive():
+                self.process.terminate()
+
+
+
+_functions = {}             # 'module:function' -> function
+
+
+def _resolve(target):
+    "Imports and returns the function named by 'module:function'."
 
-def enact(command, server_addr, multiple_results = False, verbose = True, nice = 0):
+    if not _functions.has_key(target):
+        module_name, sep, function_name = target.partition(':')
+        if not (sep and module_name and function_name):
+            raise ValueError('"%s" is not of the form module:function' %
+                target)
+        if os.getcwd() not in sys.path:
+            sys.path.insert(0, os.getcwd())
+        module = __import__(module_name, {}, {}, [ function_name ])
+        _functions[target] = getattr(module, function_name)
+    return _functions[target]
+
+
+def _serve(target, conn):
+    """Calls the function 'target' for the work units received on 'conn'.
+
+For each work unit, (True, result) or (False, description of the exception) is
+sent back. Runs in a worker process until 'conn' is closed."""
+
+    function = _resolve(target)
+    while True:
+        try:
+            work = conn.recv()
+        except EOFError:
+            return
+        try:
+            result = function(work)
+            if hasattr(result, 'next'):
+                result = list(result)   # iterators cannot be pickled
+            conn.send((True, result))
+        except Exception, value:
+            conn.send((False, repr(value)))
+
+
+def start_application(command, multiple_results = False, io = 'pipe',
+                      process = False):
+    """Starts the computing application 'command' with input and output 'io'.
+
+Returns a Function if 'io' is 'python', or an Application otherwise. For a
+Function, 'process' is passed on."""
+
+    if io == 'python':
+        return Function(command, multiple_results, process)
+    return Application(command, multiple_results, io)
+
+
+def cpu_count():
+    'Returns the number of processors in the system, or 1 if unknown.'
+
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+def _record_failure(failure, app_delay, verbose):
+    """Applies the restart policy after the computing application failed.
+
+The ApplicationFailure 'failure' is raised again if the application should
+not be restarted, which is the case if it failed three times before in the
+past minute according to the failure times in 'app_delay'. Otherwise, the
+updated list of failure times is returned.
+"""
+
+    if verbose:
+        print 'Computing application terminated unexpectedly!'
+    if not failure.retry:
+        raise failure
+    now = time.time()
+    if (now - 60 < app_delay[0]):
+        if verbose:
+            print 'Over three failures in the past minute: ' \
+                'aborting computation.'
+        raise failure
+    return app_delay[1:] + [now]
+
+
+def _reconnect_delay(failure, conn_delay, verbose):
+    """Waits before reconnecting after the connection failed.
+
+The ConnectionFailure 'failure' is raised again if reconnecting makes no sense.
+Otherwise, this sleeps for a random time between half of 'conn_delay' and
+'conn_delay' seconds, so that clients that lost their connections at the same
+time do not all reconnect at once, and returns the delay to use after the next
+failure.
+"""
+
+    if not failure.retry:
+        if verbose:
+            print 'Connection to host failed!'
+        raise failure
+    delay = conn_delay * random.uniform(0.5, 1)
+    if verbose:
+        print 'Connection to host failed; reconnecting in %.1f seconds...' % \
+            delay
+    time.sleep(delay)
+    return min(2*conn_delay, RECONNECT_MAX)
+
+
+def _run_slot(command, multiple_results, pipeline, verbose, io = 'pipe',
+              process = False):
+    """Processes work units from 'pipeline' with a computing application.
+
+The application is restarted when it fails, subject to the same policy as in
+enact(); when it may not be restarted, the slot is retired from the pipeline.
+"""
+
+    app = None
+    app_delay = [ 0 ] * 3
+    while True:
+        try:
+            if not app:
+                app = start_application(command, multiple_results, io,
+                    process)
+            while True:
+                work = pipeline.get_work()
+                try:
+                    app.put_work(work)
+                    results = app.get_results()
+                except ApplicationFailure:
+                    pipeline.cancel(work)
+                    raise
+                pipeline.put_results(work, results)
+
+        except ApplicationFailure, e:
+            if app:
+                app.close()
+            app = None
+            try:
+                app_delay = _record_failure(e, app_delay, verbose)
+            except ApplicationFailure, e:
+                pipeline.retire(e)
+                return
+
+
+def enact(command, server_addr, multiple_results = False, verbose = True,
+          nice = 0, batch = 1, prefetch = 0, jobs = 1, heartbeat = None,
+          io = 'pipe', speed = None, projects = None):
     """Enact on a Dispense2 project.
     
 Starts a computing application with the given 'command' and connects to the
 project host at 'server_addr'. If 'verbose' is set, warnings are printed to
 standard output. If 'nice' is set to a different value than '0', the process
 will run with a different 'niceness' (relative process priority); niceness is
-not supported under Windows.
+not supported under Windows. If 'batch' is greater than one, work units are
+requested from the host in batches of 'batch' units.
+
+If 'jobs' is greater than one, that many instances of the computing application
+are run, each processing work units as soon as it is idle; a failing instance
+is restarted without affecting the others. If 'prefetch' is greater than zero,
+up to 'prefetch' work units are fetched while the computing applications are
+busy, and results are returned in the background. In both cases, 'batch' is
+ignored.
+
+If 'heartbeat' is set, a heartbeat is sent to the host whenever nothing else
+was sent to it for 'heartbeat' seconds, so that a host with an idle timeout
+does not take a client that is computing a long work unit for dead.
+
+The computing application is run with input and output 'io', which is 'pipe',
+'pty' or 'framed' (see the Application class), or 'python' if 'command' names
+a Python function (see the Function class). In the latter case, if 'jobs' is
+greater than one, each instance calls the function in a worker process.
+
+When batched operation is negotiated, the number of instances and the platform
+are announced to the host, together with 'speed' if it is set: the speed of
+this client relative to a typical client, which makes the host serve it more
+or less costly work units (see dispense -C). If 'projects' is given, it lists
+the identifiers of the projects that the computing application can compute, of
+which a host that serves several projects selects one. Setting 'speed' or
+'projects' makes the client negotiate batched operation in any case.
 """
 
     if nice and 'nice' in dir(os):
         os.nice(nice)
 
+    capabilities = [ ('cores', jobs), ('platform', sys.platform) ]
+    if speed:
+        capabilities.append(('speed', speed))
+    for project in projects or []:
+        capabilities.append(('project', project))
+
+    if (jobs > 1) or (prefetch > 0):
+        pipeline = Pipeline(server_addr, multiple_results, prefetch, jobs,
+            heartbeat, capabilities)
+        for _ in range(jobs):
+            thread = threading.Thread(target = _run_slot,
+                args = (command, multiple_results, pipeline, verbose, io,
+                        jobs > 1))
+            thread.setDaemon(True)
+            thread.start()
+        try:
+            while True:
+                try:
+                    pipeline.connect()
+                    pipeline.wait()
+                except ConnectionFailure, e:
+                    pipeline.delay = _reconnect_delay(e, pipeline.delay,
+                        verbose)
+        finally:
+            pipeline.close()
+
     app  = None
     conn = None
+    work = None                 # work unit being processed
     app_delay  = [ 0 ] * 3
-    conn_delay = 1
-    while True:
-        try:
-            if not app:
-                app = Application(command, multiple_results)
-            if not conn:
-                conn = Connection(server_addr, multiple_results)
+    conn_delay = RECONNECT_DELAY
+    try:
+        while True:
+            try:
+                if not app:
+                    app = start_application(command, multiple_results, io)
+                if not conn:
+                    conn = Connection(server_addr, multiple_results, batch,
+                        heartbeat, capabilities)
 
-            while True:
-                app.put_work(conn.get_work())
-                conn.put_results(app.get_results())
+                while True:
+                    if work is None:
+                        work = conn.get_work()
+                        conn_delay = RECONNECT_DELAY
+                    app.put_work(work)
+                    results = app.get_results()
+                    work = None
+                    conn.put_results(results)
 
-        except ApplicationFailure, e:
-            if verbose:
-                print 'Computing application terminated unexpectedly!'
-            app  = None
-            conn = None
-            if not e.retry:
-                raise
-            now = time.time()
-            if (now - 60 < app_delay[0]):
-                if verbose:
-                    print 'Over three failures in the past minute: ' \
-                        'aborting computation.'
-                raise
-            app_delay = app_delay[1:] + [now]
+            except ApplicationFailure, e:
+                # The connection is kept, and the work unit is sent to the
+                # restarted application.
+                if app:
+                    app.close()
+                app = None
+                app_delay = _record_failure(e, app_delay, verbose)
 
-        except ConnectionFailure, e:
-            if not e.retry:
-                if verbose:
-                    print 'Connection to host failed!'
-                raise
-            conn = None
-            if verbose:
-                print 'Connection to host failed; reconnecting at %s...' % \
-                    time.strftime('%H:%M:%S', time.localtime(time.time() + conn_delay))
-            for _ in range(conn_delay):
-                time.sleep(1)
-            conn_delay *= 2
-            if conn_delay > 600:
-                conn_delay = 600
+            except ConnectionFailure, e:
+                # The host takes back the work units of a lost connection.
+                if conn:
+                    conn.close()
+                conn = None
+                work = None
+                conn_delay = _reconnect_delay(e, conn_delay, verbose)
+    finally:
+        if conn:
+            conn.hand_back(work)
+            conn.close()
 
 
 #
@@ -222,11 +1065,19 @@ if __name__ == '__main__':
     multiple_results = False
     verbose          = False
     nice             = 10
+    batch            = 1
+    prefetch         = 0
+    jobs             = cpu_count()
+    heartbeat        = None
+    io               = 'pipe'
+    speed            = None
+    projects         = []
 
     # Parse command line arguments
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'hmp:n:v',
-            ['help', 'multiple', 'port=', 'nice=', 'verbose'])
+        opts, args = getopt.getopt(sys.argv[1:], 'hmb:f:j:p:i:n:vH:P:S:',
+            ['help', 'multiple', 'batch=', 'prefetch=', 'jobs=', 'port=',
+             'io=', 'nice=', 'verbose', 'heartbeat=', 'project=', 'speed='])
     except getopt.GetoptError, message:
         sys.stderr.write('Error: %s.\n' % str(message))
         usage(2)
@@ -240,6 +1091,28 @@ if __name__ == '__main__':
                 sys.stderr.write('Warning: invalid port argument; ignored.\n')
         if opt in ('-m', '--multiple'):
             multiple_results = True
+        if opt in ('-b', '--batch'):
+            try:
+                batch = max(1, int(arg))
+            except ValueError:
+                sys.stderr.write('Warning: invalid batch argument; ignored.\n')
+        if opt in ('-f', '--prefetch'):
+            try:
+                prefetch = max(0, int(arg))
+            except ValueError:
+                sys.stderr.write('Warning: invalid prefetch argument; '
+                    'ignored.\n')
+        if opt in ('-j', '--jobs'):
+            try:
+                jobs = max(1, int(arg))
+            except ValueError:
+                sys.stderr.write('Warning: invalid jobs argument; ignored.\n')
+        if opt in ('-i', '--io'):
+            if arg not in IO_MODES:
+                sys.stderr.write('Error: unknown application I/O "%s".\n'
+                    % arg)
+                usage(2)
+            io = arg
         if opt in ('-n', '--nice'):
             try:
                 nice = int(arg)
@@ -247,12 +1120,27 @@ if __name__ == '__main__':
                 sys.stderr.write('Warning: invalid nice argument; ignored.\n')
         if opt in ('-v', '--verbose'):
             verbose = True
+        if opt in ('-H', '--heartbeat'):
+            try:
+                heartbeat = max(0, float(arg)) or None
+            except ValueError:
+                sys.stderr.write('Warning: invalid heartbeat argument; '
+                    'ignored.\n')
+        if opt in ('-P', '--project'):
+            projects.append(arg)
+        if opt in ('-S', '--speed'):
+            try:
+                speed = max(0, float(arg)) or None
+            except ValueError:
+                sys.stderr.write('Warning: invalid speed argument; '
+                    'ignored.\n')
     if len(args) <> 2:
         sys.stderr.write('Error: exactly two arguments required.\n')
         usage(2)
     command, server_host = args
 
-    enact(command, (server_host, server_port), multiple_results, verbose, nice)
+    enact(command, (server_host, server_port), multiple_results, verbose, nice,
+        batch, prefetch, jobs, heartbeat, io, speed, projects)
 
 
 # EOF
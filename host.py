@@ -5,13 +5,15 @@
 #
 
 import getopt, os, sys
-import dispense, project
+import dispense, project, resultlog
 
 #
 # Global variables
 #
 
 verbose = False
+cache   = None
+downloads = project.DOWNLOADS
 
 
 #
@@ -21,18 +23,28 @@ verbose = False
 def usage(code = 0):
     'Displays command line usage information.'
 
-    print 'Usage:\n    %s [<options>] <project-url>' % sys.argv[0]
+    print 'Usage:\n    %s [<options>] <project-url> ...' % sys.argv[0]
     print """
 Required arguments:
-    <project-url>       the URL of the project description file
+    <project-url>       the URL of a project description file
 
 Available options:
     -h, --help:         show this description
+    -C<dir>, --cache=<dir>
+                        keep downloaded project files in the cache directory
+                        <dir>, which may be shared by several projects
+    -D<n>, --downloads=<n>
+                        download up to <n> project files at a time
+                        (default: 4)
     -v, --verbose:      be verbose
     
 
-Hosts a distributed computation project using the project description from the
-specified URL.
+Hosts one or more distributed computation projects using the project
+descriptions from the specified URLs. All projects are served by a single
+process; projects with the same server address share its port, and clients
+select the project they compute by its identifier (see enact -P). Clients that
+can compute several projects are divided among them in proportion to the share
+in their project descriptions.
 """
     sys.exit(code)
 
@@ -45,8 +57,8 @@ if __name__ == '__main__':
 
     # Parse command line arguments
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'hv',
-            ['help', 'verbose'])
+        opts, args = getopt.getopt(sys.argv[1:], 'hvC:D:',
+            ['help', 'verbose', 'cache=', 'downloads='])
     except getopt.GetoptError, message:
         sys.stderr.write('Error: %s.\n' % str(message))
         usage(2)
@@ -55,34 +67,73 @@ if __name__ == '__main__':
             usage()
         if opt in ('-v', '--verbose'):
             verbose = True
-    if len(args) <> 1:
-        sys.stderr.write('Error: exactly one argument required.\n')
+        if opt in ('-C', '--cache'):
+            cache = os.path.abspath(arg)
+        if opt in ('-D', '--downloads'):
+            try:
+                downloads = max(1, int(arg))
+            except ValueError:
+                sys.stderr.write('Warning: invalid downloads argument; '
+                    'ignored.\n')
+    if len(args) < 1:
+        sys.stderr.write('Error: at least one argument required.\n')
         usage(2)
-    project_url, = args
-
-    # Parse project file
-    if verbose:
-        print 'Project configuration URL: "%s"...' % project_url
-    project = project.Project(project_url)
-    if verbose:
-        print ('Project selected: "%s" (%s)' % (project.name, project.name))
-
-    # Change to project directory and synch files
-    if verbose:
-        print 'Changing to project directory...'
-    project.chdir()
-    if verbose:
-        print 'Updating project files...'
-    project.update(host = True)
-    
+
+    # Parse project files
+    descriptions = []
+    for project_url in args:
+        if verbose:
+            print 'Project configuration URL: "%s"...' % project_url
+        description = project.Project(project_url)
+        if verbose:
+            print 'Project selected: "%s" (%s)' % (description.name,
+                description.id)
+        if [ other for other in descriptions if other.id == description.id ]:
+            sys.stderr.write('Error: project "%s" given twice.\n' %
+                description.id)
+            sys.exit(2)
+        descriptions.append(description)
+
+    hosted = []
+    directory = os.getcwd()
+    for description in descriptions:
+        # Change to project directory and synch files
+        if verbose:
+            print 'Changing to project directory...'
+        os.chdir(directory)
+        description.chdir()
+        if verbose:
+            print 'Updating project files...'
+        description.update(host = True, cache = cache,
+            downloads = downloads)
+
+        # Open the input and output of the project, in its directory
+        if verbose:
+            print 'Hosting project on "%s:%s"...' % \
+                description.server_address
+            print 'Work units are read from "%s".' % \
+                description.server_input
+            print 'Results are written to "%s".' % \
+                description.server_output
+        served = dispense.Project(description.id)
+        served.address = description.server_address
+        served.input   = file(description.server_input,  'r')
+        if description.server_output_format == 'binary':
+            served.result_log = \
+                resultlog.ResultLog(description.server_output)
+        else:
+            served.output = file(description.server_output, 'a')
+        served.multiple_results = description.multiple_results
+        served.share        = description.server_share
+        served.idle_timeout = description.server_idle_timeout
+        served.unit_timeout = description.server_unit_timeout
+        served.replicas     = description.server_replicas
+        served.quorum       = description.server_quorum
+        served.verify_every = description.server_verify_every
+        hosted.append(served)
+
     # Our distribution is complete; start hosting!
-    if verbose:
-        print 'Hosting project on "%s:%s"...' % project.server_address
-        print 'Work units are read from "%s".' % project.server_input
-        print 'Results are written to "%s".'  % project.server_output
-    dispense.input  = file(project.server_input,  'r')
-    dispense.output = file(project.server_output, 'a')
-    dispense.run(project.server_address, project.multiple_results)
+    dispense.run(hosted)
 
 
 # EOF
@@ -4,7 +4,7 @@
 # Imported modules
 #
 
-import getopt, sys
+import getopt, os, sys
 import enact, project
 
 #
@@ -28,12 +28,32 @@ Required arguments:
 
 Available options:
     -h, --help:         show this description
+    -C<dir>, --cache=<dir>
+                        keep downloaded project files in the cache directory
+                        <dir>, which may be shared by several projects
+    -D<n>, --downloads=<n>
+                        download up to <n> project files at a time
+                        (default: 4)
     -n<n>, --nice=<n>:  set niceness level increment (default: 10)
+    -b<n>, --batch=<n>: request <n> work units at a time (default: 1)
+    -f<n>, --prefetch=<n>:
+                        fetch up to <n> work units ahead while computing
+                        (default: 0)
+    -j<n>, --jobs=<n>:  run <n> instances of the computing application
+                        (default: number of processors)
+    -H<n>, --heartbeat=<n>:
+                        send a heartbeat to the host after <n> seconds
+                        without other traffic (default: a third of the idle
+                        timeout of the project host, if any)
+    -S<n>, --speed=<n>: announce a speed of <n> times that of a typical
+                        client to the project host
     -v, --verbose:      be verbose
 
 
 Joins a distributed computation project using the project description from the
-specified URL.
+specified URL. The project is selected by its identifier when connecting to the
+project host (see enact -P), which requires a host running the host tool of the
+same release as participate; enact stops with an error otherwise.
 """
     sys.exit(code)
 
@@ -45,12 +65,20 @@ specified URL.
 
 if __name__ == '__main__':
 
-    nice = 10
+    nice     = 10
+    batch    = 1
+    prefetch = 0
+    jobs     = enact.cpu_count()
+    heartbeat = None
+    cache    = None
+    downloads = project.DOWNLOADS
+    speed    = None
 
     # Parse command line arguments
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'hvn',
-            ['help', 'verbose', 'nice'])
+        opts, args = getopt.getopt(sys.argv[1:], 'hvn:b:f:j:C:D:H:S:',
+            ['help', 'verbose', 'nice=', 'batch=', 'prefetch=', 'jobs=',
+             'cache=', 'downloads=', 'heartbeat=', 'speed='])
     except getopt.GetoptError, message:
         sys.stderr.write('Error: %s.\n' % str(message))
         usage(2)
@@ -64,6 +92,42 @@ if __name__ == '__main__':
                 nice = int(arg)
             except ValueError:
                 sys.stderr.write('Warning: invalid nice argument; ignored.\n')
+        if opt in ('-b', '--batch'):
+            try:
+                batch = max(1, int(arg))
+            except ValueError:
+                sys.stderr.write('Warning: invalid batch argument; ignored.\n')
+        if opt in ('-f', '--prefetch'):
+            try:
+                prefetch = max(0, int(arg))
+            except ValueError:
+                sys.stderr.write('Warning: invalid prefetch argument; '
+                    'ignored.\n')
+        if opt in ('-j', '--jobs'):
+            try:
+                jobs = max(1, int(arg))
+            except ValueError:
+                sys.stderr.write('Warning: invalid jobs argument; ignored.\n')
+        if opt in ('-C', '--cache'):
+            cache = os.path.abspath(arg)
+        if opt in ('-D', '--downloads'):
+            try:
+                downloads = max(1, int(arg))
+            except ValueError:
+                sys.stderr.write('Warning: invalid downloads argument; '
+                    'ignored.\n')
+        if opt in ('-H', '--heartbeat'):
+            try:
+                heartbeat = max(0, float(arg))
+            except ValueError:
+                sys.stderr.write('Warning: invalid heartbeat argument; '
+                    'ignored.\n')
+        if opt in ('-S', '--speed'):
+            try:
+                speed = max(0, float(arg)) or None
+            except ValueError:
+                sys.stderr.write('Warning: invalid speed argument; '
+                    'ignored.\n')
     if len(args) <> 1:
         sys.stderr.write('Error: exactly one argument required.\n')
         usage(2)
@@ -75,6 +139,8 @@ if __name__ == '__main__':
     project = project.Project(project_url)
     if verbose:
         print ('Project selected: "%s" (%s)' % (project.name, project.name))
+    if (heartbeat is None) and project.server_idle_timeout:
+        heartbeat = project.server_idle_timeout / 3
             
     # Locate the client element for our platform
     if verbose:
@@ -90,14 +156,15 @@ if __name__ == '__main__':
     project.chdir()
     if verbose:
         print 'Updating project files...'
-    project.update()
+    project.update(cache = cache, downloads = downloads)
 
     # Our distribution is complete; start working!
     if verbose:
         print 'Enacting on \"%s:%i\"' % project.server_address, \
             'with command \"%s\"...' % project.command
     enact.enact(project.command, project.server_address,
-        project.multiple_results, verbose, nice)
+        project.multiple_results, verbose, nice, batch, prefetch, jobs,
+        heartbeat or None, project.command_io, speed, [ project.id ])
 
 
 # EOF
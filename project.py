@@ -4,7 +4,26 @@
 # Imported modules
 #
 
-import md5, os, urllib, xml.dom.minidom
+import getopt, httplib, md5, os, Queue, re, shutil, sys, tempfile
+import threading, urllib, urllib2, zlib
+import xml.dom.minidom
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None         # xz compressed files are not downloaded
+
+
+#
+# Global constants
+#
+
+BLOCK_SIZE = 65536          # default size of the blocks of delta updates
+COPY_SIZE  = 65536          # number of bytes copied at a time
+DOWNLOADS  = 4              # default number of files downloaded at a time
+DIGESTS_NAME = '.digests'   # file with the sizes, times and hash codes
 
 
 #
@@ -32,6 +51,39 @@ lower-case hexadecimal characters is returned.
         return None
 
         
+def md5_block_strings(filepath, block_size):
+    'Returns the MD5 hash codes of the consecutive blocks of a file.'
+
+    digests = []
+    f = file(filepath, 'rb')
+    try:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digests.append(md5.new(block).hexdigest())
+    finally:
+        f.close()
+    return digests
+
+
+def _open_range(url, start, end = None):
+    """Opens 'url' to read the bytes from 'start' to 'end' (or to the end).
+
+Raises IOError if the server does not return the range."""
+
+    request = urllib2.Request(url)
+    if end is None:
+        request.add_header('Range', 'bytes=%i-' % start)
+    else:
+        request.add_header('Range', 'bytes=%i-%i' % (start, end - 1))
+    response = urllib2.urlopen(request)
+    if getattr(response, 'code', None) <> 206:
+        response.close()
+        raise IOError('byte ranges not supported for "%s"' % url)
+    return response
+
+
 def _get_flat_elem(elem, name):
     """Returns the text contained in a DOM child element.
     
@@ -66,9 +118,36 @@ class Project:
         self.server_address = server_host, server_port
         self.server_input  = _get_flat_elem(self.server_elem, 'input')
         self.server_output = _get_flat_elem(self.server_elem, 'output')
+        output_elem, = self.server_elem.getElementsByTagName('output')
+        self.server_output_format = \
+            output_elem.getAttribute('format') or 'text'
+        self.server_idle_timeout = None
+        self.server_unit_timeout = None
+        for timeout_elem in self.server_elem.getElementsByTagName('timeout'):
+            if timeout_elem.getAttribute('idle'):
+                self.server_idle_timeout = \
+                    float(timeout_elem.getAttribute('idle'))
+            if timeout_elem.getAttribute('unit'):
+                self.server_unit_timeout = \
+                    float(timeout_elem.getAttribute('unit'))
+        self.server_replicas     = 1
+        self.server_quorum       = None
+        self.server_verify_every = 1
+        for verify_elem in self.server_elem.getElementsByTagName('verify'):
+            self.server_replicas = \
+                int(verify_elem.getAttribute('replicas') or 3)
+            if verify_elem.getAttribute('quorum'):
+                self.server_quorum = int(verify_elem.getAttribute('quorum'))
+            self.server_verify_every = \
+                int(verify_elem.getAttribute('every') or 1)
+        self.server_share = \
+            float(_get_flat_elem(self.server_elem, 'share') or 1)
 
         self.client_elems = self.elem.getElementsByTagName('client')
         self.client_elem  = None
+        self.transferred  = 0       # bytes of project files downloaded
+        self.digests      = {}      # file name -> (size, mtime, MD5)
+        self.lock = threading.Lock()    # serializes downloading threads
 
         if _get_flat_elem(self.elem, 'results') == 'multiple':
             self.multiple_results = True
@@ -82,7 +161,9 @@ class Project:
 The platform identifier 'platform' is used to select a suitable client
 element which is stored in the 'client_elem' attribute. In addition,
 the 'platform' and 'command' attributes are set to the platform
-identifier and the computing application command respectively.
+identifier and the computing application command respectively, and the
+'command_io' attribute to the way of communicating with the computing
+application (see enact.Application).
 """
                 
         for client_elem in self.client_elems:
@@ -91,6 +172,10 @@ identifier and the computing application command respectively.
                     self.platform    = platform
                     self.client_elem = client_elem
                     self.command     = _get_flat_elem(client_elem, 'command')
+                    command_elem, = client_elem.getElementsByTagName(
+                        'command')
+                    self.command_io  = command_elem.getAttribute('io') or \
+                        'pipe'
                     return True
         return False
 
@@ -111,55 +196,440 @@ subdirectory.
         os.chdir(self.id)
 
 
-    def update(self, host = False):
-        'Updates all files required for the project.' 
+    def update(self, host = False, cache = None, downloads = DOWNLOADS):
+        """Updates all files required for the project.
+
+If 'cache' is given, it is the path of a directory in which the files are kept
+by their MD5 hash code, so that they are downloaded only once for all projects
+that use them. Up to 'downloads' files are updated at a time."""
         
         if host:
-            self._update(self.server_elem)
+            self._update(self.server_elem, cache, downloads)
         else:
-            self._update(self.client_elem)
+            self._update(self.client_elem, cache, downloads)
+
 
+    def _update(self, elem, cache = None, downloads = DOWNLOADS):
+        """Updates all files which are specified under the given DOM element.
 
-    def _update(self, elem):
-        'Updates all files which are specified under the given DOM element.'
+The files are updated by 'downloads' threads (see _update_file()). The sizes,
+modification times and MD5 hash codes of the files are kept in the file
+DIGESTS_NAME, so that files that did not change since are not read again. If
+updating a file fails, the first exception is raised once the other threads
+have finished."""
         
-        # Download and verify required files
+        if cache and not os.path.isdir(cache):
+            os.makedirs(cache)
+        self._load_digests()
+
+        pending = Queue.Queue()
         for file_elem in elem.getElementsByTagName('file'):
-            file_url  = file_elem.firstChild.nodeValue
-            file_name = file_elem.getAttribute('name')
-            file_md   = file_elem.getAttribute('md5').lower()
-            file_mode = file_elem.getAttribute('mode')
-    
-            # Check for existing files
-            local_md = md5_file_string(file_name)
-            if file_md == local_md:
-                continue                # Local file is up to date
-            else:
-                try:                    # Backup old file                    
+            pending.put(file_elem)
+        errors = []
+        threads = []
+        for _ in xrange(max(1, min(downloads, pending.qsize()))):
+            thread = threading.Thread(target = self._update_files,
+                args = (pending, cache, errors))
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        self._save_digests()
+        urllib.urlcleanup()             # Purge urllib caches
+        if errors:
+            error_type, error, traceback = errors[0]
+            raise error_type, error, traceback
+
+
+    def _update_files(self, pending, cache, errors):
+        """Updates the files of the file elements in the queue 'pending'.
+
+Stops at the first exception, which is appended to 'errors' (as returned by
+sys.exc_info()), or as soon as another thread appended one."""
+
+        while not errors:
+            try:
+                file_elem = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                self._update_file(file_elem, cache)
+            except:
+                errors.append(sys.exc_info())
+
+
+    def _update_file(self, file_elem, cache = None):
+        """Updates the file specified by the given file element.
+
+A file that is not up to date is taken from the cache, if possible. Otherwise,
+if the file element has a 'blocks' attribute and there is a previous version
+of the file, only the blocks that changed are downloaded (see _patch()); or
+else the whole file is downloaded, compressed if the file element has an 'xz'
+or 'gzip' attribute (see _fetch())."""
+
+        file_url  = file_elem.firstChild.nodeValue
+        file_name = file_elem.getAttribute('name')
+        file_md   = file_elem.getAttribute('md5').lower()
+        file_mode = file_elem.getAttribute('mode')
+        blocks_url = file_elem.getAttribute('blocks')
+
+        # Check for existing files
+        local_md = self._md5(file_name)
+        if file_md == local_md:
+            return                      # Local file is up to date
+        elif local_md <> None:
+            try:                        # Backup old file
+                if os.path.exists(file_name+'.old'):
                     os.remove(file_name+'.old')
-                    os.rename(file_name, file_name+'.old')
-                except OSError:
-                    pass                # Backup failed; ignore.
-    
-            # Retrieve remote file
-            urllib.urlretrieve(file_url, file_name)
-    
-            # Verify integrity
-            local_md = md5_file_string(file_name)
+                os.rename(file_name, file_name+'.old')
+            except OSError:
+                pass                    # Backup failed; ignore.
+        local_md = None
+
+        # Copy the file from the cache
+        cache_name = cache and os.path.join(cache, file_md)
+        if cache and os.path.exists(cache_name):
+            shutil.copyfile(cache_name, file_name)
+            local_md = self._md5(file_name)
             if local_md <> file_md:
-                raise 'File "%s" failed MD5 checksum!\n' \
-                    '\tLocal file:   %s\n\tProject file: %s\n' % \
-                    (file_name, local_md, file_md)
-                
-            # Set file mode
-            if file_mode:
-                try:
-                    os.chmod(file_name, int(file_mode, 8))
-                except OSError, error:
-                    raise 'Unable to change mode of file "%s" to "%s"!\n' \
-                        '%s\n' % (file_name, file_mode, error)
-                        
-        urllib.urlcleanup()             # Purge urllib caches
+                os.remove(cache_name)   # Corrupt; download again.
+
+        # Retrieve changed blocks of the remote file
+        if (local_md <> file_md) and blocks_url and \
+                os.path.exists(file_name+'.old'):
+            try:
+                self._patch(file_url, blocks_url, file_name,
+                    file_name+'.old')
+                local_md = self._md5(file_name)
+            except (IOError, ValueError, httplib.HTTPException):
+                pass                    # Retrieve the whole file instead.
+
+        # Retrieve remote file, resuming an interrupted download
+        if local_md <> file_md:
+            part_name = '%s.%s.part' % (file_name, file_md)
+            directory, base_name = os.path.split(file_name)
+            old_part = re.compile(r'%s\.[0-9a-f]{32}\.part$' %
+                re.escape(base_name))
+            for name in os.listdir(directory or os.curdir):
+                if old_part.match(name) and \
+                        (name <> os.path.basename(part_name)):
+                    os.remove(os.path.join(directory, name))   # Old version
+            if lzma and file_elem.getAttribute('xz'):
+                self._fetch(file_elem.getAttribute('xz'), file_name,
+                    part_name, lzma.LZMADecompressor())
+            elif file_elem.getAttribute('gzip'):
+                self._fetch(file_elem.getAttribute('gzip'), file_name,
+                    part_name, zlib.decompressobj(16 + zlib.MAX_WBITS))
+            else:
+                self._fetch(file_url, file_name, part_name)
+            local_md = self._md5(file_name)
+
+        # Verify integrity
+        if local_md <> file_md:
+            raise 'File "%s" failed MD5 checksum!\n' \
+                '\tLocal file:   %s\n\tProject file: %s\n' % \
+                (file_name, local_md, file_md)
+
+        # Set file mode
+        if file_mode:
+            try:
+                os.chmod(file_name, int(file_mode, 8))
+            except OSError, error:
+                raise 'Unable to change mode of file "%s" to "%s"!\n' \
+                    '%s\n' % (file_name, file_mode, error)
+
+        # Keep a copy in the cache
+        if cache and not os.path.exists(cache_name):
+            fd, temp_name = tempfile.mkstemp(dir = cache)
+            os.close(fd)
+            shutil.copyfile(file_name, temp_name)
+            os.rename(temp_name, cache_name)
+
+
+    def _md5(self, file_name):
+        """Returns the MD5 hash code of a local file, or None if it is missing.
+
+The hash code is only computed if the size or modification time of the file
+differ from those recorded in 'digests'."""
+
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            return None
+        entry = self.digests.get(file_name)
+        if entry and (entry[:2] == (stat.st_size, stat.st_mtime)):
+            return entry[2]
+        digest = md5_file_string(file_name)
+        if digest:
+            self.digests[file_name] = (stat.st_size, stat.st_mtime, digest)
+        return digest
+
+
+    def _load_digests(self):
+        'Reads the recorded hash codes of local files from DIGESTS_NAME.'
+
+        self.digests = {}
+        try:
+            f = file(DIGESTS_NAME)
+        except IOError:
+            return
+        for line in f:
+            try:
+                name, size, mtime, digest = line.rstrip('\n').split('\t')
+                self.digests[name] = (int(size), float(mtime), digest)
+            except ValueError:
+                pass                    # Hash code computed again
+        f.close()
+
+
+    def _save_digests(self):
+        'Writes the recorded hash codes of the local files to DIGESTS_NAME.'
+
+        try:
+            f = file(DIGESTS_NAME + '.new', 'w')
+            for name, (size, mtime, digest) in self.digests.items():
+                if os.path.exists(name):
+                    f.write('%s\t%i\t%r\t%s\n' % (name, size, mtime, digest))
+            f.close()
+            if os.path.exists(DIGESTS_NAME):
+                os.remove(DIGESTS_NAME)
+            os.rename(DIGESTS_NAME + '.new', DIGESTS_NAME)
+        except (IOError, OSError):
+            pass                        # Hash codes computed again
+
+
+    def _count(self, size):
+        'Adds \'size\' bytes to the number of bytes transferred.'
+
+        self.lock.acquire()
+        try:
+            self.transferred += size
+        finally:
+            self.lock.release()
+
+
+    def _fetch(self, url, file_name, part_name, decompressor = None):
+        """Downloads the file at 'url', decompressing it if necessary.
+
+The data is downloaded to the file 'part_name' first. If that file exists, the
+download is resumed at its end with an HTTP range request, or started again
+if the server does not support these. The file is removed when the download
+is complete."""
+
+        offset = 0
+        if os.path.exists(part_name):
+            offset = os.path.getsize(part_name)
+        response = None
+        if offset:
+            try:
+                response = _open_range(url, offset)
+            except (IOError, httplib.HTTPException):
+                offset = 0              # Download the whole file again.
+        if not response:
+            response = urllib2.urlopen(url)
+        f = file(part_name, offset and 'ab' or 'wb')
+        try:
+            while True:
+                data = response.read(COPY_SIZE)
+                if not data:
+                    break
+                self._count(len(data))
+                f.write(data)
+        finally:
+            f.close()
+            response.close()
+
+        if os.path.exists(file_name):
+            os.remove(file_name)
+        if not decompressor:
+            os.rename(part_name, file_name)
+            return
+        part = file(part_name, 'rb')
+        f = file(file_name, 'wb')
+        try:
+            while True:
+                data = part.read(COPY_SIZE)
+                if not data:
+                    break
+                f.write(decompressor.decompress(data))
+            if hasattr(decompressor, 'flush'):
+                f.write(decompressor.flush())
+        finally:
+            f.close()
+            part.close()
+        os.remove(part_name)
+
+
+    def _patch(self, url, blocks_url, file_name, old_name):
+        """Builds the file at 'url' from the blocks of a previous version.
+
+The file at 'blocks_url' lists the block size on the first line, followed by
+the MD5 hash code of each block of the file at 'url' (see make_blocks()).
+Blocks that occur in the file 'old_name' at any multiple of the block size are
+copied from it; the other blocks are downloaded with HTTP range requests, one
+for each run of consecutive blocks."""
+
+        response = urllib2.urlopen(blocks_url)
+        lines = response.read().split()
+        response.close()
+        self._count(sum([ len(line) + 1 for line in lines ]))
+        block_size, digests = int(lines[0]), lines[1:]
+        if block_size <= 0:
+            raise ValueError('invalid block size')
+
+        offsets = {}
+        for i, digest in enumerate(md5_block_strings(old_name, block_size)):
+            offsets.setdefault(digest, i * block_size)
+
+        old = file(old_name, 'rb')
+        f = file(file_name, 'wb')
+        try:
+            i = 0
+            while i < len(digests):
+                if offsets.has_key(digests[i]):
+                    old.seek(offsets[digests[i]])
+                    f.write(old.read(block_size))
+                    i += 1
+                    continue
+                start = i
+                while (i < len(digests)) and not offsets.has_key(digests[i]):
+                    i += 1
+                response = _open_range(url, start * block_size,
+                                       i * block_size)
+                while True:
+                    data = response.read(COPY_SIZE)
+                    if not data:
+                        break
+                    self._count(len(data))
+                    f.write(data)
+                response.close()
+        finally:
+            f.close()
+            old.close()
+
+
+def make_blocks(filepath, block_size = BLOCK_SIZE):
+    """Writes the block list of a file, for delta updates (see _patch()).
+
+The list is written to a file with '.blocks' appended to the name."""
+
+    f = file(filepath + '.blocks', 'w')
+    f.write('%i\n' % block_size)
+    for digest in md5_block_strings(filepath, block_size):
+        f.write('%s\n' % digest)
+    f.close()
+
+
+def compress(filepath, method):
+    """Writes a compressed copy of a file, with 'method' 'gzip' or 'xz'.
+
+The copy is written to a file with '.gz' or '.xz' appended to the name."""
+
+    if method == 'gzip':
+        import gzip
+        out = gzip.open(filepath + '.gz', 'wb', 9)
+    else:
+        out = lzma.LZMAFile(filepath + '.xz', 'wb')
+    f = file(filepath, 'rb')
+    try:
+        shutil.copyfileobj(f, out, COPY_SIZE)
+    finally:
+        f.close()
+        out.close()
+
+
+def usage(code = 0):
+    'Displays command line usage information.'
+
+    print 'Usage:\n    %s [<options>] <url> <file> ...' % sys.argv[0]
+    print """
+Required arguments:
+    <url>               the URL of the directory from which the files will
+                        be downloaded
+    <file>              a file required for the project
+
+Available options:
+    -h, --help:         show this description
+    -b<n>, --blocks=<n> write a block list for delta updates, with blocks of
+                        <n> kilobytes (default: 64)
+    -m<n>, --mode=<n>   set the mode of the files to the octal mode <n>
+    -z<m>, --compress=<m>
+                        write a copy of each file compressed with method <m>
+                        ("gzip" or "xz"; may be given twice)
+
+
+Prepares files for distribution to the participants of a project, and writes a
+file element for each of them, to be put in the project description.
+
+With -b, a block list with the MD5 hash code of each block of the file is
+written next to it, and participants that have a previous version of the file
+only download the blocks that changed (provided that the web server supports
+byte ranges). With -z, participants download the compressed copy instead of
+the file if they can decompress it; xz requires the lzma module.
+"""
+    sys.exit(code)
+
+
+#
+# Application entry point
+#
+
+if __name__ == '__main__':
+
+    block_size = None
+    mode       = None
+    methods    = []
+
+    # Parse command line arguments
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hb:m:z:',
+            ['help', 'blocks=', 'mode=', 'compress='])
+    except getopt.GetoptError, message:
+        sys.stderr.write('Error: %s.\n' % str(message))
+        usage(2)
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            usage()
+        if opt in ('-b', '--blocks'):
+            try:
+                block_size = max(1, int(arg)) * 1024
+            except ValueError:
+                sys.stderr.write('Warning: invalid blocks argument; '
+                    'ignored.\n')
+        if opt in ('-m', '--mode'):
+            mode = arg
+        if opt in ('-z', '--compress'):
+            if arg not in ('gzip', 'xz'):
+                sys.stderr.write('Error: unknown compression method "%s".\n'
+                    % arg)
+                usage(2)
+            if (arg == 'xz') and not lzma:
+                sys.stderr.write('Error: the lzma module is required for xz '
+                    'compression.\n')
+                sys.exit(2)
+            methods.append(arg)
+    if len(args) < 2:
+        sys.stderr.write('Error: at least two arguments required.\n')
+        usage(2)
+    base_url, paths = args[0].rstrip('/'), args[1:]
+
+    for path in paths:
+        url = '%s/%s' % (base_url, urllib.quote(os.path.basename(path)))
+        attributes = [ ('md5', md5_file_string(path)),
+                       ('name', os.path.basename(path)) ]
+        if mode:
+            attributes.append(('mode', mode))
+        if block_size:
+            make_blocks(path, block_size)
+            attributes.append(('blocks', url + '.blocks'))
+        for method in methods:
+            compress(path, method)
+            attributes.append((method, url + { 'gzip': '.gz',
+                                               'xz':   '.xz' }[method]))
+        print '<file %s>%s</file>' % (' '.join([ '%s="%s"' % attribute
+            for attribute in attributes ]), url)
 
 
 # EOF
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+
+#
+# Imported modules
+#
+
+import getopt, itertools, os, struct, sys, time
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+
+#
+# Global constants
+#
+
+MAGIC  = 'D2RLOG\x00\x01'                # first bytes of a result log
+RECORD = struct.Struct('<I16sdHHII')    # record header (see ResultLog)
+LENGTH = struct.Struct('<I')            # length prefix of each result
+ENTRY  = struct.Struct('<16sQ')         # index entry: digest, offset
+
+PART_SIZE  = 16 << 20       # minimum size of the parts of a text output file
+BLOCK_SIZE = 1 << 20        # number of bytes read at a time from a part
+
+
+#
+# Definitions
+#
+
+def usage(code = 0):
+    'Displays command line usage information.'
+
+    print 'Usage:\n    %s [<options>] <log-file>' % sys.argv[0]
+    print """
+Required arguments:
+    <log-file>          the binary result log written by the dispense tool
+
+Available options:
+    -h, --help:         show this description
+    -l<w>, --lookup=<w> write only the results for work unit <w>
+    -r, --reindex       rebuild the index of the result log
+
+The resultlog tool converts a binary result log, as written by the dispense
+tool when started with the -l option, to the text format that dispense writes
+otherwise, and writes it to standard output.
+"""
+    sys.exit(code)
+
+
+def is_result_log(path):
+    "Returns whether the file at 'path' is a binary result log."
+
+    try:
+        f = file(path, 'rb')
+        try:
+            return f.read(len(MAGIC)) == MAGIC
+        finally:
+            f.close()
+    except IOError:
+        return False
+
+
+def read_record(f):
+    """Reads a record from the result log file 'f' at its current position.
+
+Returns a tuple (digest, timestamp, (host, port), work, results), or None if
+the end of the file has been reached or the record is incomplete."""
+
+    header = f.read(RECORD.size)
+    if len(header) < RECORD.size:
+        return None
+    length, digest, timestamp, port, host_length, work_length, count = \
+        RECORD.unpack(header)
+    body = f.read(length - (RECORD.size - LENGTH.size))
+    if len(body) < length - (RECORD.size - LENGTH.size):
+        return None
+    host = body[:host_length]
+    work = body[host_length:host_length + work_length]
+    pos = host_length + work_length
+    results = []
+    for _ in range(count):
+        size, = LENGTH.unpack_from(body, pos)
+        pos += LENGTH.size
+        results.append(body[pos:pos + size])
+        pos += size
+    return digest, timestamp, (host, port), work, results
+
+
+def read_records(f):
+    """Iterates over the records in the result log file 'f'.
+
+Yields tuples as returned by read_record(); an incomplete record at the end of
+the file (left by a crash while writing it) is ignored."""
+
+    f.seek(len(MAGIC))
+    while True:
+        record = read_record(f)
+        if record is None:
+            break
+        yield record
+
+
+def annotation(timestamp, addr):
+    'Returns the annotation line that precedes results in the text format.'
+
+    return '[%s] %s:%i' % ((time.ctime(timestamp),) + tuple(addr))
+
+
+def text_parts(path, count, size = None):
+    """Splits the text output file at 'path' into up to 'count' parts.
+
+Returns a list of (start, end) byte offsets of parts of at least 'size' bytes
+(default: PART_SIZE). Each part but the first starts with an annotation or a
+work unit line that does not follow an annotation, so that reading the parts
+one after another yields the same results as reading the whole file."""
+
+    file_size = os.path.getsize(path)
+    count = max(1, min(count, file_size // (size or PART_SIZE)))
+    f = file(path, 'r')
+    offsets = [ 0 ]
+    for i in range(1, count):
+        f.seek(max(offsets[-1], file_size * i // count))
+        if f.tell() > 0:
+            f.seek(f.tell() - 1)
+            f.readline()                # skip to the start of a line
+        previous = None
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if (not line) or ((line[:1] in ('[', '>')) and
+                    (previous is not None) and (previous[:1] <> '[')):
+                break
+            previous = line
+        if offset > offsets[-1]:
+            offsets.append(offset)
+    f.close()
+    offsets.append(file_size)
+    return zip(offsets[:-1], offsets[1:])
+
+
+def _blocks(path, start, end):
+    'Yields lists of the lines from byte \'start\' to \'end\' of \'path\'.'
+
+    f = file(path, 'r')
+    try:
+        f.seek(start)
+        rest = ''
+        while start < end:
+            block = f.read(min(BLOCK_SIZE, end - start))
+            if not block:
+                break
+            start += len(block)
+            lines = (rest + block).split('\n')
+            rest = lines.pop()
+            yield lines
+        if rest:
+            yield [ rest ]
+    finally:
+        f.close()
+
+
+def text_lines(path, start, end):
+    """Returns an iterator over the lines of the part of the text output file
+at 'path' from 'start' to 'end', without line terminators."""
+
+    return itertools.chain.from_iterable(_blocks(path, start, end))
+
+
+def export(f, out):
+    "Writes the records of result log 'f' in the text format to 'out'."
+
+    for _, timestamp, addr, work, results in read_records(f):
+        out.write('%s\n>%s\n' % (annotation(timestamp, addr), work))
+        for result in results:
+            out.write('<%s\n' % result)
+
+
+
+class ResultLog:
+    """Append-only binary log of computation results, with an index.
+
+The log file starts with MAGIC and consists of records, each of which starts
+with a RECORD header: the length of the rest of the record, the MD5 digest of
+the work unit, the time at which the results were received, the client port,
+and the lengths of the client host name and the work unit and the number of
+results. The header is followed by the host name, the work unit, and the
+results, each preceded by its LENGTH.
+
+For each record, an ENTRY with the digest and the offset of the record is
+appended to an index file (the log path with ".idx" appended), which is
+used to look up the results for a work unit without scanning the log. When a
+log is opened, records that are missing from the index are indexed, and an
+incomplete record at the end (left by a crash) is removed. Since the index may
+be written to disk before the log, entries at the end of the index whose
+records cannot be read back are removed as well.
+"""
+
+    def __init__(self, path):
+        "Opens (or creates) the result log at 'path' for appending."
+
+        self.path  = path
+        self.index = None
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self.log = file(path, 'r+b')
+            if self.log.read(len(MAGIC)) <> MAGIC:
+                raise IOError('"%s" is not a result log' % path)
+        else:
+            self.log = file(path, 'w+b')
+            self.log.write(MAGIC)
+        if os.path.exists(path + '.idx'):
+            self.idx = file(path + '.idx', 'r+b')
+        else:
+            self.idx = file(path + '.idx', 'w+b')
+        self._recover()
+
+
+    def _recover(self):
+        'Indexes records missing from the index and drops incomplete ones.'
+
+        self.idx.seek(0, 2)
+        entries = self.idx.tell() // ENTRY.size
+        while entries:
+            self.idx.seek((entries - 1) * ENTRY.size)
+            digest, offset = ENTRY.unpack(self.idx.read(ENTRY.size))
+            self.log.seek(offset)
+            record = read_record(self.log)
+            if (record is not None) and (record[0] == digest):
+                break
+            entries -= 1        # the record was lost or torn
+        if not entries:
+            self.log.seek(len(MAGIC))
+        self.idx.truncate(entries * ENTRY.size)
+        self.idx.seek(0, 2)
+        while True:
+            offset = self.log.tell()
+            record = read_record(self.log)
+            if record is None:
+                break
+            self.idx.write(ENTRY.pack(record[0], offset))
+        self.log.truncate(offset)
+        self.log.seek(0, 2)
+        self.idx.flush()
+
+
+    def append(self, addr, work, results, timestamp = None):
+        'Appends the results for a work unit, received from \'addr\'.'
+
+        if timestamp is None:
+            timestamp = time.time()
+        host, port = addr
+        digest = md5(work).digest()
+        parts = [ host, work ]
+        for result in results:
+            parts.append(LENGTH.pack(len(result)))
+            parts.append(result)
+        body = ''.join(parts)
+        offset = self.log.tell()
+        self.log.write(RECORD.pack(RECORD.size - LENGTH.size + len(body),
+            digest, timestamp, port, len(host), len(work), len(results)))
+        self.log.write(body)
+        self.idx.write(ENTRY.pack(digest, offset))
+        if self.index is not None:
+            self.index.setdefault(digest, []).append(offset)
+
+
+    def flush(self):
+        'Writes buffered records to the operating system.'
+
+        self.log.flush()
+        self.idx.flush()
+
+
+    def fileno(self):
+        'Returns the file descriptor of the log file.'
+
+        return self.log.fileno()
+
+
+    def sync(self):
+        'Writes buffered records to disk, the log before the index.'
+
+        self.flush()
+        os.fsync(self.log.fileno())
+        os.fsync(self.idx.fileno())
+
+
+    def lookup(self, work):
+        """Returns the records for the work unit 'work', in order of arrival.
+
+The index is loaded into memory the first time this is called, after which
+each lookup takes constant time."""
+
+        if self.index is None:
+            self.flush()
+            self.index = {}
+            self.idx.seek(0)
+            while True:
+                entry = self.idx.read(ENTRY.size)
+                if len(entry) < ENTRY.size:
+                    break
+                digest, offset = ENTRY.unpack(entry)
+                self.index.setdefault(digest, []).append(offset)
+            self.idx.seek(0, 2)
+        records = []
+        for offset in self.index.get(md5(work).digest(), []):
+            self.log.seek(offset)
+            record = read_record(self.log)
+            if record[3] == work:
+                records.append(record)
+        self.log.seek(0, 2)
+        return records
+
+
+    def reindex(self):
+        'Rebuilds the index from the records in the log.'
+
+        self.idx.seek(0)
+        self.idx.truncate()
+        self.index = None
+        self._recover()
+
+
+    def close(self):
+        self.flush()
+        self.log.close()
+        self.idx.close()
+
+
+
+#
+# Application entry point
+#
+
+if __name__ == '__main__':
+
+    lookup  = None
+    reindex = False
+
+    # Parse command line arguments
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hl:r',
+            ['help', 'lookup=', 'reindex'])
+    except getopt.GetoptError, message:
+        sys.stderr.write('Error: %s.\n' % str(message))
+        usage(2)
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            usage()
+        if opt in ('-l', '--lookup'):
+            lookup = arg
+        if opt in ('-r', '--reindex'):
+            reindex = True
+    if len(args) <> 1:
+        sys.stderr.write('Error: exactly one argument required.\n')
+        usage(2)
+    path, = args
+
+    if not is_result_log(path):
+        sys.stderr.write('Error: "%s" is not a result log!\n' % path)
+        sys.exit(2)
+    if reindex:
+        ResultLog(path).reindex()
+    elif lookup <> None:
+        for _, timestamp, addr, work, results in \
+                ResultLog(path).lookup(lookup):
+            sys.stdout.write('%s\n>%s\n' % (annotation(timestamp, addr), work))
+            for result in results:
+                sys.stdout.write('<%s\n' % result)
+    else:
+        export(file(path, 'rb'), sys.stdout)
+
+
+# EOF
@@ -0,0 +1,630 @@
+#!/usr/bin/env python
+
+#
+# Imported modules
+#
+
+import array, getopt, math, struct, sys, time
+import resultlog
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+try:
+    import json
+except ImportError:
+    json = None
+
+
+#
+# Global constants
+#
+
+DISTINCT_BITS   = 14                    # log2 of the number of registers
+DISTINCT_STRUCT = struct.Struct('<HQ')  # register index, hash value
+
+GAP_BUCKETS = 32            # inter-result gaps up to 2**31 seconds
+
+
+#
+# Definitions
+#
+
+def usage(code = 0):
+    'Displays command line usage information.'
+
+    print 'Usage:\n    %s [<options>] [<output-file> ...]' % sys.argv[0]
+    print """
+Required arguments:
+    None.
+
+Optional arguments:
+    <output-file>       an output file of the dispense tool, in the text format
+                        or a binary result log (default: standard input)
+
+Available options:
+    -h, --help:         show this description
+    -f<f>, --format=<f> write the statistics as "text" (the default), "json"
+                        or "csv"
+    -i<n>, --interval=<n>
+                        report throughput per <n> seconds (default: 3600)
+    -j<n>, --jobs=<n>:  read text output files in <n> parts in parallel
+                        (default: number of processors)
+    -e, --estimate      estimate the number of distinct work units in
+                        constant memory, instead of counting them exactly
+    -x, --exact         count distinct work units exactly (the default)
+
+The stats tool reads the results written by the dispense tool in a single pass
+and reports the number of results and of distinct work units, the throughput
+over time, the contribution and rate of each host, and for each client (a
+host and port, so a connection of an enacting application) the distribution of
+the time between its results. Gaps are counted in power-of-two buckets; their
+percentiles are given as the upper bound of the bucket.
+
+The number of distinct work units, and thus the ratio of duplicate results, is
+counted exactly, for which memory usage grows with the number of work units
+(by about 100 bytes each). With -e, it is estimated to within about 1% of the
+number of distinct work units, which can be as large as the duplicate ratio
+itself. Results without an annotation (such as those written by the collect
+tool) are counted, but not timed.
+
+Large text output files are split into parts at the start of a result, which
+are read by separate processes; the statistics of the parts are then merged.
+Binary result logs and standard input are read by a single process.
+"""
+    sys.exit(code)
+
+
+
+class DistinctCounter:
+    """Estimates the number of distinct work units in constant memory.
+
+This is a HyperLogLog counter with 2**DISTINCT_BITS registers, fed with the MD5
+digests of the work units; the standard error of the estimate is 1.04 divided
+by the square root of the number of registers, or about 0.8%.
+"""
+
+    def __init__(self):
+        self.size      = 1 << DISTINCT_BITS
+        self.registers = array.array('B', [ 0 ]) * self.size
+
+
+    def add_digest(self, digest):
+        'Adds the work unit with MD5 digest \'digest\'.'
+
+        index, value = DISTINCT_STRUCT.unpack_from(digest)
+        index &= self.size - 1
+        rank = 65 - value.bit_length()
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+
+    def __len__(self):
+        size = self.size
+        zeros = self.registers.count(0)
+        total = sum([ 2.0 ** -rank for rank in self.registers ])
+        estimate = 0.7213 / (1 + 1.079 / size) * size * size / total
+        if (estimate <= 2.5 * size) and zeros:
+            estimate = size * math.log(float(size) / zeros)
+        return int(round(estimate))
+
+
+    def merge(self, other):
+        'Adds the work units counted by the DistinctCounter \'other\'.'
+
+        self.registers = array.array('B', map(max, self.registers,
+                                              other.registers))
+
+
+
+class ExactCounter:
+    'Counts distinct work units exactly, by keeping their MD5 digests.'
+
+    def __init__(self):
+        self.digests = set()
+
+
+    def add_digest(self, digest):
+        self.digests.add(digest)
+
+
+    def merge(self, other):
+        self.digests.update(other.digests)
+
+
+    def __len__(self):
+        return len(self.digests)
+
+
+
+class ClientStatistics:
+    'Results of a single client, and the gaps between them.'
+
+    def __init__(self, timestamp):
+        self.results = 0
+        self.first   = timestamp
+        self.last    = timestamp
+        self.max_gap = 0
+        self.gaps    = array.array('L', [ 0 ]) * GAP_BUCKETS
+
+
+    def add(self, timestamp):
+        'Adds a result received at \'timestamp\'.'
+
+        if self.results:
+            gap = timestamp - self.last
+            if gap >= 0:
+                self.gaps[min(int(gap).bit_length(), GAP_BUCKETS - 1)] += 1
+                self.max_gap = max(self.max_gap, gap)
+                self.last = timestamp
+            else:
+                self.first = min(self.first, timestamp)  # files out of order
+        self.results += 1
+
+
+    def merge(self, other):
+        """Adds the results of the same client counted in 'other', which must
+have been read after those in this object."""
+
+        if self.results and other.results:
+            self.add(other.first)       # the gap between the two
+            self.results -= 1
+        for bucket, count in enumerate(other.gaps):
+            self.gaps[bucket] += count
+        self.results += other.results
+        self.first    = min(self.first, other.first)
+        self.last     = max(self.last, other.last)
+        self.max_gap  = max(self.max_gap, other.max_gap)
+
+
+    def gap_percentile(self, fraction):
+        """Returns the upper bound of the gaps below which lie 'fraction' of
+all gaps, or None if there are no gaps."""
+
+        count = sum(self.gaps)
+        if not count:
+            return None
+        seen = 0
+        for bucket, bucket_count in enumerate(self.gaps):
+            seen += bucket_count
+            if seen >= fraction * count:
+                return 2 ** bucket
+        return 2 ** (GAP_BUCKETS - 1)
+
+
+
+class Statistics:
+    """Statistics over the results written by the dispense tool.
+
+Results are added one at a time; the memory used depends on the number of
+clients and throughput intervals, and, unless 'exact' is False and distinct
+work units are estimated, on the number of work units.
+"""
+
+    def __init__(self, interval = 3600, exact = True):
+        self.interval    = interval
+        self.results     = 0
+        self.untimed     = 0
+        self.first       = None
+        self.last        = None
+        self.throughput  = {}   # interval number -> results
+        self.clients     = {}   # "host:port" -> ClientStatistics
+        if exact:
+            self.distinct = ExactCounter()
+        else:
+            self.distinct = DistinctCounter()
+
+
+    def add(self, timestamp, client, digest):
+        """Adds a result for the work unit with MD5 digest 'digest', received
+from 'client' ("host:port") at 'timestamp' (None if unknown)."""
+
+        self.results += 1
+        self.distinct.add_digest(digest)
+        if timestamp is None:
+            self.untimed += 1
+            return
+        if (self.first is None) or (timestamp < self.first):
+            self.first = timestamp
+        if (self.last is None) or (timestamp > self.last):
+            self.last = timestamp
+        slot = int(timestamp // self.interval)
+        self.throughput[slot] = self.throughput.get(slot, 0) + 1
+        stats = self.clients.get(client)
+        if stats is None:
+            stats = self.clients[client] = ClientStatistics(timestamp)
+        stats.add(timestamp)
+
+
+    def read_text(self, f):
+        """Adds the results in the text output format read from file 'f'.
+
+This does the work of add() inline, as it runs once for every result: the time
+of an annotation is only parsed when it differs from the one before, and the
+statistics of a client are only looked up when the annotation changes."""
+
+        if isinstance(self.distinct, DistinctCounter):
+            registers = self.distinct.registers
+            mask      = self.distinct.size - 1
+            unpack    = DISTINCT_STRUCT.unpack_from
+            add_digest = None
+        else:
+            add_digest = self.distinct.add_digest
+        throughput = self.throughput
+        clients    = self.clients
+        annotation = ctime = stats = slot = timestamp = annotation_stats = None
+        results = untimed = counted = 0
+        for line in f:
+            first = line[:1]
+            if first == '<':
+                continue
+            elif first == '>':
+                digest = md5(line[1:].rstrip('\n')).digest()
+                if add_digest is None:
+                    index, value = unpack(digest)
+                    index &= mask
+                    rank = 65 - value.bit_length()
+                    if rank > registers[index]:
+                        registers[index] = rank
+                else:
+                    add_digest(digest)
+                results += 1
+                if stats is None:
+                    untimed += 1
+                    continue
+                counted += 1
+                if stats.results:
+                    gap = timestamp - stats.last
+                    if gap >= 0:
+                        if gap < 1:
+                            stats.gaps[0] += 1
+                        else:
+                            stats.gaps[min(int(gap).bit_length(),
+                                           GAP_BUCKETS - 1)] += 1
+                        if gap > stats.max_gap:
+                            stats.max_gap = gap
+                        stats.last = timestamp
+                    elif timestamp < stats.first:
+                        stats.first = timestamp
+                stats.results += 1
+                stats = None
+            elif first == '[':
+                if line == annotation:
+                    stats = annotation_stats
+                    continue
+                end = line.find('] ')
+                if end < 0:
+                    continue
+                if line[1:end] <> ctime:
+                    try:
+                        timestamp = time.mktime(time.strptime(line[1:end]))
+                    except ValueError:
+                        continue
+                    ctime = line[1:end]
+                    if int(timestamp // self.interval) <> slot:
+                        if counted:
+                            throughput[slot] = \
+                                throughput.get(slot, 0) + counted
+                            counted = 0
+                        slot = int(timestamp // self.interval)
+                    if (self.first is None) or (timestamp < self.first):
+                        self.first = timestamp
+                    if (self.last is None) or (timestamp > self.last):
+                        self.last = timestamp
+                client = line[end + 2:].rstrip('\n')
+                stats = clients.get(client)
+                if stats is None:
+                    stats = clients[client] = ClientStatistics(timestamp)
+                annotation, annotation_stats = line, stats
+        if counted:
+            throughput[slot] = throughput.get(slot, 0) + counted
+        self.results += results
+        self.untimed += untimed
+
+
+    def read_log(self, f):
+        'Adds the results in the binary result log file \'f\'.'
+
+        for digest, timestamp, addr, _, _ in resultlog.read_records(f):
+            self.add(timestamp, '%s:%i' % addr, digest)
+
+
+    def merge(self, other):
+        """Adds the statistics in the Statistics object 'other', which must
+have been read after those in this object."""
+
+        self.results += other.results
+        self.untimed += other.untimed
+        for timestamp in (other.first, other.last):
+            if timestamp is not None:
+                if (self.first is None) or (timestamp < self.first):
+                    self.first = timestamp
+                if (self.last is None) or (timestamp > self.last):
+                    self.last = timestamp
+        for slot, count in other.throughput.items():
+            self.throughput[slot] = self.throughput.get(slot, 0) + count
+        for client, stats in other.clients.items():
+            if client in self.clients:
+                self.clients[client].merge(stats)
+            else:
+                self.clients[client] = stats
+        self.distinct.merge(other.distinct)
+
+
+    def summary(self):
+        'Returns a dictionary of overall statistics.'
+
+        distinct = min(len(self.distinct), self.results)
+        summary = { 'results': self.results, 'distinct': distinct,
+                    'duplicate_ratio': 0.0, 'untimed': self.untimed,
+                    'clients': len(self.clients),
+                    'hosts': len(self.hosts()), 'first': self.first,
+                    'last': self.last, 'rate': None }
+        if self.results:
+            summary['duplicate_ratio'] = \
+                float(self.results - distinct) / self.results
+        if (self.first is not None) and (self.last > self.first):
+            summary['rate'] = (self.results - self.untimed) / \
+                (self.last - self.first)
+        return summary
+
+
+    def intervals(self):
+        'Returns a list of (start time, results, results per second).'
+
+        return [ (slot * self.interval, self.throughput[slot],
+                  float(self.throughput[slot]) / self.interval)
+                 for slot in sorted(self.throughput) ]
+
+
+    def hosts(self):
+        """Returns a list of (host, clients, results, share of all results,
+results per second while active), by decreasing number of results."""
+
+        hosts = {}
+        for client, stats in self.clients.items():
+            host = client.rsplit(':', 1)[0]
+            entry = hosts.setdefault(host, [ 0, 0, stats.first, stats.last ])
+            entry[0] += 1
+            entry[1] += stats.results
+            entry[2] = min(entry[2], stats.first)
+            entry[3] = max(entry[3], stats.last)
+        table = []
+        for host, (clients, results, first, last) in hosts.items():
+            rate = None
+            if last > first:
+                rate = results / (last - first)
+            table.append((host, clients, results,
+                          float(results) / max(1, self.results), rate))
+        table.sort(key = lambda entry: (-entry[2], entry[0]))
+        return table
+
+
+    def client_table(self):
+        """Returns a list of (client, results, results per second, median,
+90th percentile and maximum of the gaps between results), by client."""
+
+        table = []
+        for client in sorted(self.clients):
+            stats = self.clients[client]
+            rate = None
+            if stats.last > stats.first:
+                rate = (stats.results - 1) / (stats.last - stats.first)
+            table.append((client, stats.results, rate,
+                          stats.gap_percentile(0.5),
+                          stats.gap_percentile(0.9), stats.max_gap))
+        return table
+
+
+
+def read_text_part((path, start, end, interval, exact)):
+    """Returns the Statistics of the part of a text output file at 'path'
+from 'start' to 'end' (see resultlog.text_parts())."""
+
+    stats = Statistics(interval, exact)
+    stats.read_text(resultlog.text_lines(path, start, end))
+    return stats
+
+
+def read_text_file(stats, path, jobs):
+    """Adds the results in the text output file at 'path' to 'stats', read
+in parallel by up to 'jobs' processes."""
+
+    parts = resultlog.text_parts(path, jobs)
+    tasks = [ (path, start, end, stats.interval,
+               isinstance(stats.distinct, ExactCounter))
+              for start, end in parts ]
+    if len(tasks) == 1:
+        stats.merge(read_text_part(tasks[0]))
+        return
+    import multiprocessing
+    pool = multiprocessing.Pool(min(jobs, len(tasks)))
+    try:
+        for part in pool.imap(read_text_part, tasks):
+            stats.merge(part)
+    finally:
+        pool.terminate()
+
+
+def cpu_count():
+    'Returns the number of processors in the system, or 1 if unknown.'
+
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+def _time(timestamp):
+    'Formats a timestamp for the text and CSV output.'
+
+    if timestamp is None:
+        return ''
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+
+
+def _number(value, format = '%.2f'):
+    'Formats a number that may be None for the text and CSV output.'
+
+    if value is None:
+        return '-'
+    return format % value
+
+
+def write_text(stats, out):
+    'Writes the statistics in a human readable format to \'out\'.'
+
+    summary = stats.summary()
+    out.write('Results:             %d\n' % summary['results'])
+    out.write('Distinct work units: %d%s\n' % (summary['distinct'],
+        (not isinstance(stats.distinct, ExactCounter)) and ' (estimated)'
+        or ''))
+    out.write('Duplicate ratio:     %.2f%%\n' %
+        (100 * summary['duplicate_ratio']))
+    if summary['untimed']:
+        out.write('Untimed results:     %d\n' % summary['untimed'])
+    out.write('Period:              %s - %s\n' % (_time(summary['first']),
+        _time(summary['last'])))
+    out.write('Results per second:  %s\n' % _number(summary['rate']))
+    out.write('Hosts:               %d\n' % summary['hosts'])
+    out.write('Clients:             %d\n' % summary['clients'])
+
+    out.write('\nThroughput per %d seconds:\n' % stats.interval)
+    out.write('%-19s %10s %10s\n' % ('start', 'results', 'per second'))
+    for start, results, rate in stats.intervals():
+        out.write('%-19s %10d %10.2f\n' % (_time(start), results, rate))
+
+    out.write('\nHosts:\n')
+    out.write('%-30s %7s %10s %7s %10s\n' % ('host', 'clients', 'results',
+        'share', 'per second'))
+    for host, clients, results, share, rate in stats.hosts():
+        out.write('%-30s %7d %10d %6.2f%% %10s\n' % (host, clients, results,
+            100 * share, _number(rate)))
+
+    out.write('\nClients (gaps between results in seconds):\n')
+    out.write('%-36s %10s %10s %7s %7s %9s\n' % ('client', 'results',
+        'per second', 'median', '90%', 'maximum'))
+    for client, results, rate, median, p90, max_gap in stats.client_table():
+        out.write('%-36s %10d %10s %7s %7s %9s\n' % (client, results,
+            _number(rate), _number(median, '<%d'), _number(p90, '<%d'),
+            _number(max_gap, '%.0f')))
+
+
+def write_json(stats, out):
+    'Writes the statistics as a JSON object to \'out\'.'
+
+    document = stats.summary()
+    document['interval'] = stats.interval
+    document['throughput'] = [ { 'start': start, 'results': results,
+                                 'rate': rate }
+                               for start, results, rate in stats.intervals() ]
+    document['host_stats'] = [ { 'host': host, 'clients': clients,
+                                 'results': results, 'share': share,
+                                 'rate': rate }
+                               for host, clients, results, share, rate
+                               in stats.hosts() ]
+    document['client_stats'] = [ { 'client': client, 'results': results,
+                                   'rate': rate, 'gap_median': median,
+                                   'gap_90': p90, 'gap_max': max_gap }
+                                 for client, results, rate, median, p90,
+                                     max_gap in stats.client_table() ]
+    json.dump(document, out, indent = 1, sort_keys = True)
+    out.write('\n')
+
+
+def write_csv(stats, out):
+    """Writes the statistics as CSV to 'out'.
+
+Each row starts with the name of the table it belongs to ("summary",
+"throughput", "host" or "client"), and each table starts with a header row."""
+
+    def row(*fields):
+        out.write(','.join([ str(field) for field in fields ]) + '\n')
+
+    summary = stats.summary()
+    row('summary', 'results', 'distinct', 'duplicate_ratio', 'untimed',
+        'first', 'last', 'rate', 'hosts', 'clients')
+    row('summary', summary['results'], summary['distinct'],
+        '%.6f' % summary['duplicate_ratio'], summary['untimed'],
+        _time(summary['first']), _time(summary['last']),
+        _number(summary['rate'], '%.6f'), summary['hosts'],
+        summary['clients'])
+    row('throughput', 'start', 'results', 'rate')
+    for start, results, rate in stats.intervals():
+        row('throughput', _time(start), results, '%.6f' % rate)
+    row('host', 'host', 'clients', 'results', 'share', 'rate')
+    for host, clients, results, share, rate in stats.hosts():
+        row('host', host, clients, results, '%.6f' % share,
+            _number(rate, '%.6f'))
+    row('client', 'client', 'results', 'rate', 'gap_median', 'gap_90',
+        'gap_max')
+    for client, results, rate, median, p90, max_gap in stats.client_table():
+        row('client', client, results, _number(rate, '%.6f'),
+            _number(median, '%d'), _number(p90, '%d'),
+            _number(max_gap, '%.3f'))
+
+
+#
+# Application entry point
+#
+
+if __name__ == '__main__':
+
+    output_format = 'text'
+    interval      = 3600
+    exact         = True
+    jobs          = cpu_count()
+
+    # Parse command line arguments
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hef:i:j:x',
+            ['help', 'estimate', 'format=', 'interval=', 'jobs=', 'exact'])
+    except getopt.GetoptError, message:
+        sys.stderr.write('Error: %s.\n' % str(message))
+        usage(2)
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            usage()
+        if opt in ('-f', '--format'):
+            if arg not in ('text', 'json', 'csv'):
+                sys.stderr.write('Error: unknown format "%s".\n' % arg)
+                usage(2)
+            output_format = arg
+        if opt in ('-i', '--interval'):
+            try:
+                interval = max(1, int(arg))
+            except ValueError:
+                sys.stderr.write('Warning: invalid interval argument; '
+                    'ignored.\n')
+        if opt in ('-j', '--jobs'):
+            try:
+                jobs = max(1, int(arg))
+            except ValueError:
+                sys.stderr.write('Warning: invalid jobs argument; ignored.\n')
+        if opt in ('-e', '--estimate'):
+            exact = False
+        if opt in ('-x', '--exact'):
+            exact = True
+    if (output_format == 'json') and (json is None):
+        sys.stderr.write('Error: JSON output requires Python 2.6 or later.\n')
+        sys.exit(2)
+
+    stats = Statistics(interval, exact)
+    if not args:
+        stats.read_text(sys.stdin)
+    for path in args:
+        try:
+            if resultlog.is_result_log(path):
+                stats.read_log(file(path, 'rb'))
+            else:
+                read_text_file(stats, path, jobs)
+        except IOError, e:
+            sys.stderr.write('Could not read file "%s": %s.\n' % (path, e))
+            sys.exit(2)
+
+    { 'text': write_text, 'json': write_json,
+      'csv':  write_csv }[output_format](stats, sys.stdout)
+
+
+# EOF